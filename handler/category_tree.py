@@ -0,0 +1,156 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class CategoryTree:
+    """
+    Класс, предоставляющий интерфейс для свертки
+    статистики категорий по дереву подкатегорий.
+
+    Индекс потомков строится один раз, обход выполняется
+    итеративно (без рекурсии), поэтому сложность свертки линейна
+    по числу категорий и офферов.
+    """
+
+    def __init__(self, all_categories: dict) -> None:
+        self.parents = all_categories
+        self.children = defaultdict(list)
+        for category_id, parent_id in all_categories.items():
+            if parent_id is not None:
+                self.children[parent_id].append(category_id)
+        self.roots = [
+            category_id for category_id, parent_id in all_categories.items()
+            if parent_id is None
+        ]
+
+    def _walk(self):
+        """
+        Защищенный метод, обходит дерево от корневых категорий.
+
+        Для каждой категории отдает пару (category_id, is_exit):
+        вход в категорию и выход из нее после всех потомков.
+        """
+        visited = set()
+        for root_id in self.roots:
+            stack = [(root_id, False)]
+            while stack:
+                category_id, is_exit = stack.pop()
+                if is_exit:
+                    yield category_id, True
+                    continue
+                if category_id in visited:
+                    continue
+                visited.add(category_id)
+                yield category_id, False
+                stack.append((category_id, True))
+                for child_id in reversed(self.children.get(category_id, [])):
+                    stack.append((child_id, False))
+
+    def rollup(self, category_data: dict) -> tuple[np.ndarray, dict]:
+        """
+        Метод, сворачивает цены категорий по дереву.
+
+        Цены раскладываются в один массив в порядке обхода дерева,
+        так что цены любого поддерева занимают непрерывный срез
+        [start, end), без объединения списков цен. Возвращает этот
+        массив и словарь срезов {category_id: (start, end)}.
+        Категории, недостижимые из корней, учитывают только
+        собственные цены.
+        """
+        chunks = []
+        size = 0
+        spans = {}
+        starts = {}
+
+        for category_id, is_exit in self._walk():
+            if not is_exit:
+                prices = category_data.get(category_id, [])
+                starts[category_id] = size
+                chunks.append(prices)
+                size += len(prices)
+                continue
+            spans[category_id] = (starts.pop(category_id), size)
+
+        for category_id, prices in category_data.items():
+            if category_id in spans:
+                continue
+            spans[category_id] = (size, size + len(prices))
+            chunks.append(prices)
+            size += len(prices)
+
+        flat = np.fromiter(
+            (price for chunk in chunks for price in chunk),
+            dtype=np.int64,
+            count=size
+        )
+        return flat, spans
+
+    def merge_up(self, values: dict, merge) -> dict:
+        """
+        Метод, сворачивает значения категорий по дереву снизу вверх.
+
+        values - словарь {category_id: значение по собственным ценам},
+        merge - функция, объединяющая список значений категории
+        и ее подкатегорий. Возвращает словарь значений поддеревьев.
+        Категории, недостижимые из корней, сохраняют собственные
+        значения.
+        """
+        merged = {}
+        for category_id, is_exit in self._walk():
+            if not is_exit:
+                continue
+            parts = [values[category_id]] if category_id in values else []
+            parts.extend(
+                merged[child_id]
+                for child_id in self.children.get(category_id, [])
+                if child_id in merged
+            )
+            merged[category_id] = merge(parts)
+        for category_id, value in values.items():
+            merged.setdefault(category_id, value)
+        return merged
+
+    @staticmethod
+    def iter_batches(
+        flat: np.ndarray,
+        spans: dict,
+        category_ids: list,
+        max_size: int
+    ):
+        """
+        Метод, нарезает поддеревья категорий на пакеты для
+        пакетного расчета статистики.
+
+        Отдает тройки (category_ids, prices, codes): цены всех поддеревьев
+        пакета подряд и номер категории внутри пакета для каждой цены.
+        Размер пакета ограничен max_size ценами (поддерево крупнее
+        лимита уходит отдельным пакетом).
+        """
+        batch = []
+        batch_size = 0
+        for category_id in category_ids:
+            start, end = spans[category_id]
+            if batch and batch_size + end - start > max_size:
+                yield CategoryTree._gather(flat, spans, batch)
+                batch = []
+                batch_size = 0
+            batch.append(category_id)
+            batch_size += end - start
+        if batch:
+            yield CategoryTree._gather(flat, spans, batch)
+
+    @staticmethod
+    def _gather(flat: np.ndarray, spans: dict, category_ids: list):
+        """Защищенный метод, собирает цены пакета поддеревьев."""
+        bounds = np.array(
+            [spans[category_id] for category_id in category_ids],
+            dtype=np.intp
+        ).reshape(-1, 2)
+        lengths = bounds[:, 1] - bounds[:, 0]
+        codes = np.repeat(np.arange(len(category_ids)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        index = np.arange(lengths.sum()) + np.repeat(
+            bounds[:, 0] - offsets, lengths
+        )
+        return category_ids, flat[index], codes
@@ -1,6 +1,21 @@
 """Константа названия магазина."""
 NAME_OF_SHOP = 'citilink'
 
+"""Пул соединений с базой данных: имя и размер."""
+DB_POOL_NAME = 'feed_handler'
+DB_POOL_SIZE = 5
+
+"""
+Пакетная загрузка отчета в базу: число строк в одном многострочном
+INSERT (каждая порция - отдельная транзакция) и загрузка через
+временный CSV и LOAD DATA LOCAL INFILE вместо INSERT.
+"""
+DB_INSERT_BATCH_SIZE = 5000
+DB_LOAD_LOCAL_INFILE = False
+
+"""Папка с сохраненной статистикой категорий для загрузки изменений."""
+REPORT_STATE_FOLDER = 'data'
+
 """Константы стоковых названий директорий."""
 FEEDS_FOLDER = 'temp_feeds'
 PARSE_FEEDS_FOLDER = 'new_feeds'
@@ -8,6 +23,56 @@ PARSE_FEEDS_FOLDER = 'new_feeds'
 IMAGE_FOLDER = 'old_images'
 NEW_IMAGE_FOLDER = 'new_images'
 
+"""
+Настройки обработки изображений для NEW_IMAGE_FOLDER: рамки (ш, в),
+в которые вписываются копии (None - исходный размер), формат вывода
+(None - исходный), качество, дополнение до квадрата, цвет фона
+и файл в целевой папке, где записаны источники готовых копий.
+"""
+IMAGE_TRANSFORM_SIZES = [(600, 600)]
+IMAGE_TRANSFORM_FORMAT = 'WEBP'
+IMAGE_TRANSFORM_QUALITY = 85
+IMAGE_TRANSFORM_SQUARE = True
+IMAGE_TRANSFORM_BACKGROUND = (255, 255, 255)
+IMAGE_TRANSFORM_SOURCES = '.transform_sources.json'
+
+"""Манифест и папка объектов инкрементальной синхронизации изображений."""
+IMAGE_MANIFEST = 'manifest.sqlite3'
+IMAGE_OBJECTS_FOLDER = 'objects'
+
+"""
+Колоночные снимки фидов: суффиксы папок снимка и индекса офферов
+рядом с фидом и признак использования снимков в отчете и загрузке изображений.
+"""
+SNAPSHOT_SUFFIX = '.snapshot'
+OFFER_INDEX_SUFFIX = '.index'
+USE_FEED_SNAPSHOTS = True
+
+"""
+Парсер фидов для отчетов и изображений: etree - ElementTree,
+expat - pyexpat с извлечением только нужных полей.
+"""
+FEED_PARSER = 'etree'
+
+"""
+Разбор больших фидов частями: число процессов (None - по числу ядер,
+1 - без разбиения), размер фида в байтах, начиная с которого
+он разбирается частями, и примерный размер части в байтах.
+"""
+FEED_PARSE_WORKERS = None
+PARALLEL_PARSE_MIN_SIZE = 256 * 1024 * 1024
+FEED_PARSE_CHUNK_SIZE = 64 * 1024 * 1024
+
+"""Количество потоков для параллельного скачивания фидов."""
+FEED_DOWNLOAD_WORKERS = 8
+
+"""Размер куска (в байтах) при потоковом скачивании фидов."""
+DOWNLOAD_CHUNK_SIZE = 65536
+
+"""Количество потоков и таймаут (сек.) при скачивании изображений."""
+IMAGE_DOWNLOAD_WORKERS = 16
+IMAGE_REQUEST_TIMEOUT = 30
+
 """Константы для среза массива (без выбросов)."""
 UPPER_OUTLIER_PERCENTILE = 0.75
 LOWER_OUTLIER_PERCENTILE = 0.25
@@ -15,6 +80,80 @@ LOWER_OUTLIER_PERCENTILE = 0.25
 """Округление до указанного количества знаков после точки."""
 DECIMAL_ROUNDING = 2
 
+"""Дополнительные перцентили цен для отчета (доли от 0 до 1)."""
+EXTRA_PERCENTILES = ()
+
+"""
+Режим статистики отчета (exact - по всем ценам, sketch - по эскизам
+квантилей), точность эскиза (число центроидов, до которого цены
+хранятся без потерь) и название фида для строк по всем регионам.
+"""
+REPORT_STATS_MODE = 'exact'
+SKETCH_COMPRESSION = 200
+ALL_REGIONS_FEED_NAME = 'all_regions'
+
+"""
+Кеш строк отчета: использование, папка, версия формата (меняется
+при изменении расчета), время жизни записи в секундах и общий
+размер кеша в байтах.
+"""
+USE_REPORT_CACHE = True
+REPORT_CACHE_FOLDER = 'data/report_cache'
+REPORT_CACHE_VERSION = 3
+REPORT_CACHE_MAX_AGE = 14 * 24 * 60 * 60
+REPORT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+"""Максимальное количество цен в одном пакете расчета статистики."""
+STATS_BATCH_SIZE = 1_000_000
+
+"""
+Объединение фидов: сколько офферов держать в памяти до сброса на диск
+и какой оффер брать при повторяющихся id (first, last, priority).
+"""
+FEED_JOIN_RUN_SIZE = 50_000
+JOIN_CONFLICT_POLICY = 'last'
+
+"""
+Запись фидов: расстановка отступов, сжатие gzip (к имени файла
+добавляется .gz), XML-декларация в начале файла и размер буфера записи.
+"""
+FEED_OUTPUT_PRETTY = True
+FEED_OUTPUT_COMPRESS = False
+FEED_OUTPUT_DECLARATION = False
+FEED_WRITE_BUFFER_SIZE = 1024 * 1024
+
+"""
+Обработка фидов в process_feeds: число процессов (None - по числу
+ядер, 1 - последовательно), размер фида в байтах, начиная с которого
+он делится на части, и примерный размер одной части в байтах.
+"""
+PROCESS_FEEDS_WORKERS = None
+PROCESS_SHARD_MIN_SIZE = 64 * 1024 * 1024
+PROCESS_SHARD_SIZE = 16 * 1024 * 1024
+
+"""
+Конвейер обработки фидов: этапы по умолчанию, число потоков
+каждого этапа (для label и report - процессов) и размер очередей
+между этапами.
+"""
+PIPELINE_STAGES = ['report', 'json', 'db']
+PIPELINE_WORKERS = {
+    'download': 4,
+    'label': 2,
+    'report': 2,
+    'db': 1,
+    'images': 2
+}
+PIPELINE_QUEUE_SIZE = 2
+
+"""
+Проверка времени запуска: модули, которые не должны импортироваться
+вместе с handler.main, и допустимое время импорта в секундах.
+"""
+STARTUP_HEAVY_MODULES = ('numpy', 'PIL', 'requests', 'mysql', 'dotenv')
+STARTUP_IMPORT_BUDGET = 0.1
+STARTUP_BENCHMARK_REPEAT = 5
+
 """Список id офферов для available=False."""
 UNAVAILABLE_OFFER_ID_LIST = ['1621720', '1621704', '1621686']
 
@@ -55,7 +194,29 @@ KEY `idx_category` (`category_id`)
 );
 '''
 
+CREATE_STAGING_TABLE = '''
+CREATE TEMPORARY TABLE {staging_table} LIKE {table_name}
+'''
+
+DROP_STAGING_TABLE = '''
+DROP TEMPORARY TABLE IF EXISTS {staging_table}
+'''
+
 # запросы заполнения таблиц данными.
+REPORT_COLUMNS = (
+    'date',
+    'feed_name',
+    'category_id',
+    'parent_id',
+    'count_offers',
+    'min_price',
+    'clear_min_price',
+    'max_price',
+    'clear_max_price',
+    'avg_price',
+    'median_price'
+)
+
 INSERT_LOGS = '''
 INSERT INTO {table_name} (
     date,
@@ -80,3 +241,131 @@ ON DUPLICATE KEY UPDATE
     avg_price = VALUES(avg_price),
     median_price = VALUES(median_price)
 '''
+
+INSERT_LOGS_BATCH = '''
+INSERT INTO {table_name} (
+    date,
+    feed_name,
+    category_id,
+    parent_id,
+    count_offers,
+    min_price,
+    clear_min_price,
+    max_price,
+    clear_max_price,
+    avg_price,
+    median_price
+)
+VALUES {values}
+ON DUPLICATE KEY UPDATE
+    count_offers = VALUES(count_offers),
+    min_price = VALUES(min_price),
+    clear_min_price = VALUES(clear_min_price),
+    max_price = VALUES(max_price),
+    clear_max_price = VALUES(clear_max_price),
+    avg_price = VALUES(avg_price),
+    median_price = VALUES(median_price)
+'''
+
+INSERT_LOGS_ROW = '(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+
+CARRY_FORWARD_LOGS = '''
+INSERT INTO {table_name} (
+    date,
+    feed_name,
+    category_id,
+    parent_id,
+    count_offers,
+    min_price,
+    clear_min_price,
+    max_price,
+    clear_max_price,
+    avg_price,
+    median_price
+)
+SELECT
+    %s,
+    feed_name,
+    category_id,
+    parent_id,
+    count_offers,
+    min_price,
+    clear_min_price,
+    max_price,
+    clear_max_price,
+    avg_price,
+    median_price
+FROM {table_name} AS previous
+WHERE previous.date = %s AND previous.feed_name = %s
+ON DUPLICATE KEY UPDATE
+    count_offers = previous.count_offers,
+    min_price = previous.min_price,
+    clear_min_price = previous.clear_min_price,
+    max_price = previous.max_price,
+    clear_max_price = previous.clear_max_price,
+    avg_price = previous.avg_price,
+    median_price = previous.median_price
+'''
+
+DELETE_LOGS_CATEGORIES = '''
+DELETE FROM {table_name}
+WHERE date = %s AND feed_name = %s AND category_id IN ({placeholders})
+'''
+
+LOAD_LOGS_INFILE = '''
+LOAD DATA LOCAL INFILE '{file_path}'
+INTO TABLE {staging_table}
+CHARACTER SET utf8mb4
+FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY '\\\\'
+LINES TERMINATED BY '\\n'
+(
+    date,
+    feed_name,
+    category_id,
+    parent_id,
+    count_offers,
+    min_price,
+    clear_min_price,
+    max_price,
+    clear_max_price,
+    avg_price,
+    median_price
+)
+'''
+
+UPSERT_LOGS_FROM_STAGING = '''
+INSERT INTO {table_name} (
+    date,
+    feed_name,
+    category_id,
+    parent_id,
+    count_offers,
+    min_price,
+    clear_min_price,
+    max_price,
+    clear_max_price,
+    avg_price,
+    median_price
+)
+SELECT
+    date,
+    feed_name,
+    category_id,
+    parent_id,
+    count_offers,
+    min_price,
+    clear_min_price,
+    max_price,
+    clear_max_price,
+    avg_price,
+    median_price
+FROM {staging_table}
+ON DUPLICATE KEY UPDATE
+    count_offers = VALUES(count_offers),
+    min_price = VALUES(min_price),
+    clear_min_price = VALUES(clear_min_price),
+    max_price = VALUES(max_price),
+    clear_max_price = VALUES(clear_max_price),
+    avg_price = VALUES(avg_price),
+    median_price = VALUES(median_price)
+'''
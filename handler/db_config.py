@@ -1,6 +1,8 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
+from mysql.connector import HAVE_CEXT
 
 load_dotenv()
 
@@ -14,7 +16,10 @@ load_dotenv()
 - database (название базы данных)
 - port (порт по умолчанию 3306)
 - connection_timeout (таймаут подключения)
-- use_pure (флаг использования чистого Python-коннектора)
+- allow_local_infile_in_path (LOAD DATA LOCAL INFILE разрешен только
+  для файлов из временной папки)
+- use_pure (флаг использования чистого Python-коннектора: только если
+  C-расширение mysql-connector недоступно)
 
 Пример переменных окружения:
 LOGIN='admin'
@@ -29,5 +34,6 @@ config = {
     'database': os.getenv('DB_NAME_CITILINK'),
     'port': os.getenv('DB_PORT_CITILINK', 3306),
     'connection_timeout': 10,
-    'use_pure': True
+    'allow_local_infile_in_path': tempfile.gettempdir(),
+    'use_pure': not HAVE_CEXT
 }
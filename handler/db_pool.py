@@ -0,0 +1,93 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from mysql.connector.pooling import MySQLConnectionPool
+
+from handler.constants import DB_POOL_NAME, DB_POOL_SIZE
+from handler.db_config import config
+
+
+class DBPool:
+    """
+    Класс, предоставляющий общий пул соединений с базой данных.
+
+    Пул создается при первом обращении и заново в каждом процессе
+    (соединения нельзя разделять между процессами после fork).
+    Транзакция привязана к потоку: вложенные вызовы transaction
+    получают курсор внешнего вызова, а фиксация или откат
+    выполняются только во внешнем. Если все pool_size соединений
+    заняты, поток ждет освобождения соединения (MySQLConnectionPool
+    в этом случае сразу выбрасывает PoolError).
+    """
+
+    def __init__(
+        self,
+        db_config: dict,
+        pool_size: int = DB_POOL_SIZE,
+        pool_name: str = DB_POOL_NAME
+    ) -> None:
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.pool_name = pool_name
+        self._pool = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_pool(self) -> tuple[MySQLConnectionPool, threading.Semaphore]:
+        """
+        Защищенный метод, возвращает пул текущего процесса и семафор
+        свободных соединений.
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = MySQLConnectionPool(
+                    pool_size=self.pool_size,
+                    pool_name=f'{self.pool_name}_{os.getpid()}',
+                    **self.db_config
+                )
+                self._slots = threading.BoundedSemaphore(self.pool_size)
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    @contextmanager
+    def transaction(self):
+        """
+        Метод, выдает курсор транзакции текущего потока.
+
+        Внешний вызов берет соединение из пула (дожидаясь свободного),
+        фиксирует транзакцию при успехе или откатывает при ошибке
+        и возвращает соединение в пул. Вложенные вызовы работают
+        в той же транзакции.
+        """
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is not None:
+            yield cursor
+            return
+        pool, slots = self._get_pool()
+        slots.acquire()
+        try:
+            connection = pool.get_connection()
+        except BaseException:
+            slots.release()
+            raise
+        try:
+            cursor = connection.cursor()
+            self._local.cursor = cursor
+            try:
+                yield cursor
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+            finally:
+                self._local.cursor = None
+                cursor.close()
+        finally:
+            connection.close()
+            slots.release()
+
+
+db_pool = DBPool(config)
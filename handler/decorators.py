@@ -1,12 +1,6 @@
 import logging
 import time
 
-import mysql.connector
-from handler.db_config import config
-from handler.logging_config import setup_logging
-
-setup_logging()
-
 
 def time_of_function(func):
     """
@@ -41,9 +35,11 @@ def connection_db(func):
     """
     Декоратор для подключения к базе данных.
 
-    Подключается к базе данных, обрабатывает ошибки в процессе подключения,
-    логирует все успешные/неуспешные действия, вызывает функцию, выполняющую
-    действия в базе данных и закрывает подключение.
+    Берет соединение из общего пула, обрабатывает ошибки в процессе
+    подключения, логирует все успешные/неуспешные действия, вызывает
+    функцию, выполняющую действия в базе данных, и возвращает соединение
+    в пул. Вложенные вызовы декорированных функций используют курсор
+    и транзакцию внешнего вызова.
 
     Args:
         func (callable): Декорируемая функция, которая выполняет
@@ -54,18 +50,13 @@ def connection_db(func):
         подключения к базе данных и логирования.
     """
     def wrapper(*args, **kwargs):
-        connection = mysql.connector.connect(**config)
-        cursor = connection.cursor()
+        # mysql.connector загружается при первом обращении к базе
+        from handler.db_pool import db_pool
         try:
-            kwargs['cursor'] = cursor
-            result = func(*args, **kwargs)
-            connection.commit()
-            return result
+            with db_pool.transaction() as cursor:
+                kwargs['cursor'] = cursor
+                return func(*args, **kwargs)
         except Exception as e:
-            connection.rollback()
             logging.error(f'Ошибка в {func.__name__}: {str(e)}', exc_info=True)
             raise
-        finally:
-            cursor.close()
-            connection.close()
     return wrapper
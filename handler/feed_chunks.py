@@ -0,0 +1,265 @@
+import io
+import mmap
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from pyexpat import ExpatError, ParserCreate
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from handler.feed_columns import bytes_array, detect_encoding
+
+OFFERS_START_TAG = re.compile(rb'<offers(?:\s[^>]*)?>')
+OFFERS_END_TAG = b'</offers>'
+OFFER_TAG = re.compile(rb'<offer[\s/>]')
+TEXT_FIELDS = ('name', 'url', 'picture')
+
+
+class OfferColumns:
+    """
+    Класс, накапливающий колонки офферов для снимка фида и отчета.
+
+    Колонки: offer_id, offer_category, price и has_price, available,
+    а при with_text=True еще и тексты name, url, picture (байты всех
+    значений подряд и смещения <поле>_offsets). Цены, которые
+    не приводятся к int, считаются в invalid_prices.
+    """
+
+    def __init__(self, with_text: bool = True) -> None:
+        self.with_text = with_text
+        self.offer_ids = []
+        self.categories = []
+        self.prices = []
+        self.has_price = []
+        self.available = []
+        self.invalid_prices = 0
+        self.texts = {field: bytearray() for field in TEXT_FIELDS}
+        self.offsets = {field: [0] for field in TEXT_FIELDS}
+
+    def add(self, offer) -> None:
+        """Метод, добавляет оффер."""
+        self.add_values(
+            offer.get('id'),
+            offer.findtext('categoryId'),
+            offer.findtext('price'),
+            offer.get('available'),
+            [offer.findtext(field) for field in TEXT_FIELDS]
+            if self.with_text else ()
+        )
+
+    def add_values(
+        self,
+        offer_id: str | None,
+        category_id: str | None,
+        price: str | None,
+        available: str | None,
+        texts=()
+    ) -> None:
+        """
+        Метод, добавляет оффер по уже прочитанным значениям: id,
+        categoryId, price, атрибут available и тексты TEXT_FIELDS.
+        """
+        self.offer_ids.append((offer_id or '').encode())
+        self.categories.append((category_id or '').encode())
+        try:
+            self.prices.append(int(price) if price else 0)
+            self.has_price.append(bool(price))
+        except ValueError:
+            self.invalid_prices += 1
+            self.prices.append(0)
+            self.has_price.append(False)
+        self.available.append(
+            -1 if available is None else int(available == 'true')
+        )
+        if not self.with_text:
+            return
+        for field, text in zip(TEXT_FIELDS, texts):
+            self.texts[field] += (text or '').encode()
+            self.offsets[field].append(len(self.texts[field]))
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """Метод, возвращает накопленные колонки как массивы NumPy."""
+        columns = {
+            'offer_id': bytes_array(self.offer_ids),
+            'offer_category': bytes_array(self.categories),
+            'price': np.array(self.prices, dtype=np.int64),
+            'has_price': np.array(self.has_price, dtype=bool),
+            'available': np.array(self.available, dtype=np.int8)
+        }
+        if self.with_text:
+            for field in TEXT_FIELDS:
+                columns[field] = np.frombuffer(
+                    bytes(self.texts[field]), dtype=np.uint8
+                )
+                columns[f'{field}_offsets'] = np.array(
+                    self.offsets[field], dtype=np.int64
+                )
+        return columns
+
+    @staticmethod
+    def concat(parts: list[dict]) -> dict[str, np.ndarray]:
+        """
+        Метод, склеивает колонки частей фида в порядке частей,
+        пересчитывая смещения текстов.
+        """
+        columns = {}
+        for name in parts[0]:
+            if not name.endswith('_offsets'):
+                columns[name] = np.concatenate([part[name] for part in parts])
+                continue
+            field = name[:-len('_offsets')]
+            offsets = [np.zeros(1, dtype=np.int64)]
+            base = 0
+            for part in parts:
+                offsets.append(part[name][1:] + base)
+                base += part[field].size
+            columns[name] = np.concatenate(offsets)
+        return columns
+
+
+def split_offers(data, chunk_size: int) -> tuple[int, int, list] | None:
+    """
+    Делит секцию <offers> фида на куски примерно по chunk_size байт.
+
+    Границы кусков ставятся только перед открывающим тегом <offer,
+    поэтому каждый кусок содержит целые офферы. Возвращает начало
+    и конец содержимого секции и список диапазонов [start, end)
+    или None, если секции нет.
+    """
+    match = OFFERS_START_TAG.search(data)
+    body_end = data.rfind(OFFERS_END_TAG)
+    if match is None or body_end < match.end():
+        return None
+    body_start = match.end()
+    points = [body_start]
+    for target in range(body_start + chunk_size, body_end, chunk_size):
+        if target <= points[-1]:
+            continue
+        offer_match = OFFER_TAG.search(data, target, body_end)
+        if offer_match is None:
+            break
+        points.append(offer_match.start())
+    points.append(body_end)
+    return body_start, body_end, list(zip(points[:-1], points[1:]))
+
+
+def shard_context(data, body_start: int) -> tuple[bytes, bytes, int]:
+    """
+    Возвращает обрамление куска секции <offers> для разбора отдельно
+    от фида: пролог фида (XML-декларация и DOCTYPE с объявлениями
+    сущностей) и открывающие теги всех предков офферов от корня
+    до <offers> включительно (с объявлениями пространств имен),
+    закрывающие теги этих предков и глубину <offers> в дереве.
+    Соседние с предками элементы (шапка магазина, категории)
+    в обрамление не попадают.
+    """
+    parser = ParserCreate()
+    parser.ordered_attributes = True
+    ancestors = []
+    prolog_end = None
+
+    def start_element(name, attributes):
+        nonlocal prolog_end
+        if prolog_end is None:
+            prolog_end = parser.CurrentByteIndex
+        ancestors.append((name, attributes))
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = lambda name: ancestors.pop()
+    parser.Parse(bytes(data[:body_start]), False)
+    encoding = detect_encoding(data)
+    start_tags = ''.join(
+        '<{}{}>'.format(name, ''.join(
+            f' {attributes[index]}={quoteattr(attributes[index + 1])}'
+            for index in range(0, len(attributes), 2)
+        ))
+        for name, attributes in ancestors
+    )
+    end_tags = ''.join(f'</{name}>' for name, _ in reversed(ancestors))
+    return (
+        bytes(data[:prolog_end])
+        + start_tags.encode(encoding, 'xmlcharrefreplace'),
+        end_tags.encode(encoding, 'xmlcharrefreplace'),
+        len(ancestors) - 1
+    )
+
+
+def read_shard(path, start: int, end: int, head: bytes, tail: bytes):
+    """
+    Возвращает документ из байтов [start, end) файла path
+    в обрамлении head и tail (см. shard_context).
+    """
+    with open(path, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        return head + data[start:end] + tail
+
+
+def parse_offer_chunk(task: tuple) -> tuple[dict, int]:
+    """
+    Разбирает кусок секции <offers> (функция процесса-исполнителя).
+
+    task - кортеж (path, start, end, head, tail, with_text), где head
+    и tail - обрамление куска из shard_context. Возвращает колонки
+    офферов куска и число некорректных цен.
+    """
+    path, start, end, head, tail, with_text = task
+    document = read_shard(path, start, end, head, tail)
+    columns = OfferColumns(with_text)
+    for _, elem in ET.iterparse(io.BytesIO(document)):
+        if elem.tag == 'offer':
+            columns.add(elem)
+            elem.clear()
+    return columns.arrays(), columns.invalid_prices
+
+
+def parse_feed_parallel(
+    path: Path,
+    chunk_size: int,
+    max_workers: int | None = None,
+    with_text: bool = True
+) -> tuple[ET.Element, dict, int] | None:
+    """
+    Разбирает фид частями в пуле процессов.
+
+    Файл отображается в память, секция <offers> делится на куски
+    по границам офферов, каждый кусок разбирается в своем процессе,
+    а колонки кусков склеиваются в исходном порядке. Каркас фида
+    (все, кроме секции офферов) разбирается в текущем процессе,
+    офферы вне секции добавляются в конец. Куски разбираются
+    с прологом фида и открывающими тегами предков офферов
+    (shard_context), поэтому объявления сущностей и пространств имен
+    действуют и в них. Возвращает корень каркаса, колонки офферов
+    и число некорректных цен или None, если у фида нет секции
+    <offers> или кусок не разобрался (тогда фид нужно разобрать
+    целиком).
+    """
+    with open(path, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        split = split_offers(data, chunk_size)
+        if split is None:
+            return None
+        body_start, body_end, ranges = split
+        try:
+            head, tail, _ = shard_context(data, body_start)
+        except ExpatError:
+            return None
+        skeleton = ET.fromstring(data[:body_start] + data[body_end:])
+    tasks = [
+        (str(path), start, end, head, tail, with_text)
+        for start, end in ranges
+    ]
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(parse_offer_chunk, tasks))
+    except ET.ParseError:
+        return None
+    rest = OfferColumns(with_text)
+    for offer in skeleton.iter('offer'):
+        rest.add(offer)
+    results.append((rest.arrays(), rest.invalid_prices))
+    columns = OfferColumns.concat([result[0] for result in results])
+    return skeleton, columns, sum(result[1] for result in results)
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+from handler.feed_manifest import FeedManifest
+from handler.file_utils import temp_path_for
+
+
+COLUMNS_META = 'meta.json'
+ENCODING_PATTERN = re.compile(rb'<\?xml[^>]*encoding=["\']([^"\']+)["\']')
+
+
+def file_hash(file_path: Path) -> str:
+    """Считает sha256 содержимого файла."""
+    content_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def detect_encoding(data) -> str:
+    """Возвращает кодировку из XML-декларации (по умолчанию utf-8)."""
+    match = ENCODING_PATTERN.match(data[:200])
+    return match.group(1).decode() if match else 'utf-8'
+
+
+def bytes_array(values: list[bytes]) -> np.ndarray:
+    """Собирает массив байтовых строк фиксированной ширины."""
+    width = max(map(len, values), default=0) or 1
+    return np.array(values, dtype=f'S{width}')
+
+
+class FeedColumns:
+    """
+    Базовый класс для производных файлов фида, хранящихся рядом
+    с ним в папке <фид><suffix> как массивы NumPy (.npy).
+
+    Колонки читаются через mmap. Описание (meta.json) с sha256,
+    размером и временем изменения фида пишется последним, поэтому
+    недописанные файлы считаются недействительными. Наследники
+    задают suffix, version и метод _collect, возвращающий колонки
+    и дополнительные поля описания.
+    """
+
+    suffix = ''
+    version = 1
+
+    def __init__(self, feed_path: Path, content_hash: str | None = None):
+        self.feed_path = Path(feed_path)
+        self.path = self.feed_path.with_name(
+            f'{self.feed_path.name}{self.suffix}'
+        )
+        self._content_hash = content_hash
+        self._columns = {}
+        self._meta = None
+
+    @classmethod
+    def for_feed(cls, feeds_folder: str, file_name: str, **options):
+        """
+        Метод, возвращает действительные файлы фида из папки
+        feeds_folder, при необходимости перестраивая их. Хеш фида
+        берется из манифеста фидов, options передаются в конструктор.
+        """
+        manifest = FeedManifest(feeds_folder)
+        return cls(
+            manifest.folder_path / file_name,
+            manifest.content_hash(file_name),
+            **options
+        ).ensure()
+
+    @property
+    def content_hash(self) -> str:
+        """Хеш текущего содержимого фида (из манифеста или посчитанный)."""
+        if self._content_hash is None:
+            self._content_hash = file_hash(self.feed_path)
+        return self._content_hash
+
+    @property
+    def meta(self) -> dict:
+        """
+        Описание файлов: хеш фида, размер, время изменения и поля
+        наследника.
+        """
+        if self._meta is None:
+            with open(self.path / COLUMNS_META, encoding='utf-8') as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def is_valid(self) -> bool:
+        """
+        Метод, проверяет, что файлы построены по текущему фиду.
+        Если время изменения фида отличается от записанного, хеш
+        считается по файлу, а не берется из манифеста: файл мог
+        измениться в обход манифеста.
+        """
+        try:
+            meta = self.meta
+        except (OSError, ValueError):
+            return False
+        feed_stat = self.feed_path.stat()
+        if meta.get('mtime_ns') != feed_stat.st_mtime_ns:
+            self._content_hash = file_hash(self.feed_path)
+        return (
+            meta.get('version') == self.version
+            and meta.get('size') == feed_stat.st_size
+            and meta.get('sha256') == self.content_hash
+        )
+
+    def _collect(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Защищенный метод, разбирает фид и возвращает колонки."""
+        raise NotImplementedError
+
+    def _save_column(self, name: str, values: np.ndarray) -> None:
+        """Защищенный метод, атомарно записывает колонку."""
+        column_path = self.path / f'{name}.npy'
+        temp_path = temp_path_for(column_path)
+        with open(temp_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(temp_path, column_path)
+
+    def _save_meta(self, **fields) -> None:
+        """Защищенный метод, атомарно записывает описание."""
+        feed_stat = self.feed_path.stat()
+        meta = {
+            'version': self.version,
+            'sha256': self.content_hash,
+            'size': feed_stat.st_size,
+            'mtime_ns': feed_stat.st_mtime_ns,
+            **fields,
+            'created_at': dt.now().isoformat(timespec='seconds')
+        }
+        meta_path = self.path / COLUMNS_META
+        temp_path = temp_path_for(meta_path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, meta_path)
+        self._meta = meta
+
+    def build(self) -> None:
+        """Метод, разбирает фид и записывает колонки и описание."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        (self.path / COLUMNS_META).unlink(missing_ok=True)
+        self._meta = None
+        self._columns.clear()
+        columns, fields = self._collect()
+        for name, values in columns.items():
+            self._save_column(name, values)
+        self._save_meta(**fields)
+        logging.info(
+            f'Построено {self.path.name}: '
+            + ', '.join(f'{key} - {value}' for key, value in fields.items())
+        )
+
+    def ensure(self):
+        """Метод, перестраивает файлы, если они устарели."""
+        if not self.is_valid():
+            self.build()
+        return self
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Возвращает колонку, отображенную в память."""
+        if name not in self._columns:
+            self._columns[name] = np.load(
+                self.path / f'{name}.npy', mmap_mode='r'
+            )
+        return self._columns[name]
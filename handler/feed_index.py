@@ -0,0 +1,339 @@
+import logging
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from pyexpat import ParserCreate
+
+import numpy as np
+
+from handler.constants import OFFER_INDEX_SUFFIX
+from handler.feed_columns import (
+    FeedColumns,
+    bytes_array,
+    detect_encoding,
+    file_hash
+)
+from handler.file_utils import temp_path_for
+
+
+PARSE_CHUNK_SIZE = 1024 * 1024
+OFFER_END_TAG = re.compile(rb'</offer\s*>')
+
+
+class FeedIndex(FeedColumns):
+    """
+    Класс, предоставляющий индекс офферов фида для произвольного доступа.
+
+    Для каждого оффера хранится диапазон байтов [start, end) элемента
+    <offer> в файле фида (колонки offer_id, offer_start, offer_end,
+    отсортированные по id), а для каждой категории - список офферов
+    в порядке документа (category_id, category_offsets,
+    category_offers - номера строк в колонках офферов). Офферы
+    читаются и переписываются через mmap без разбора остального
+    документа.
+    """
+
+    suffix = OFFER_INDEX_SUFFIX
+
+    def _collect(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Защищенный метод, разбирает фид через pyexpat."""
+        offer_ids, starts, ends, categories = [], [], [], []
+        with open(self.feed_path, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            encoding = detect_encoding(data)
+            parser = ParserCreate()
+            depth = 0
+            offer_depth = None
+            text = None
+
+            def start_element(tag, attrs):
+                nonlocal depth, offer_depth, text
+                depth += 1
+                if tag == 'offer' and offer_depth is None:
+                    offer_depth = depth
+                    offer_ids.append(attrs.get('id', '').encode())
+                    starts.append(parser.CurrentByteIndex)
+                    categories.append(None)
+                elif (
+                    tag == 'categoryId'
+                    and offer_depth == depth - 1
+                    and categories[-1] is None
+                ):
+                    text = []
+
+            def end_element(tag):
+                nonlocal depth, offer_depth, text
+                if text is not None and tag == 'categoryId':
+                    categories[-1] = ''.join(text).encode()
+                    text = None
+                elif tag == 'offer' and offer_depth == depth:
+                    position = parser.CurrentByteIndex
+                    tag_match = OFFER_END_TAG.match(data, position)
+                    # для пустого элемента <offer ... /> позиция
+                    # указывает сразу за ним
+                    ends.append(tag_match.end() if tag_match else position)
+                    offer_depth = None
+                depth -= 1
+
+            def character_data(chunk):
+                if text is not None:
+                    text.append(chunk)
+
+            parser.StartElementHandler = start_element
+            parser.EndElementHandler = end_element
+            parser.CharacterDataHandler = character_data
+            for position in range(0, len(data), PARSE_CHUNK_SIZE):
+                parser.Parse(data[position:position + PARSE_CHUNK_SIZE])
+            parser.Parse(b'', True)
+
+        columns = self._index_columns(
+            offer_ids,
+            starts,
+            ends,
+            [category or b'' for category in categories]
+        )
+        return columns, {
+            'offers': len(offer_ids),
+            'categories': len(columns['category_id']),
+            'encoding': encoding
+        }
+
+    @staticmethod
+    def _index_columns(
+        offer_ids: list[bytes],
+        starts: list[int],
+        ends: list[int],
+        categories: list[bytes]
+    ) -> dict[str, np.ndarray]:
+        """
+        Защищенный метод, строит колонки индекса по id, диапазонам
+        и категориям офферов в порядке документа.
+        """
+        offer_ids = bytes_array(offer_ids)
+        order = np.argsort(offer_ids, kind='stable')
+        rows = np.empty(len(order), dtype=np.int64)
+        rows[order] = np.arange(len(order))
+        categories = bytes_array(categories)
+        with_category = np.flatnonzero(categories != b'')
+        category_order = with_category[
+            np.argsort(categories[with_category], kind='stable')
+        ]
+        category_ids, category_counts = np.unique(
+            categories[category_order], return_counts=True
+        )
+        return {
+            'offer_id': offer_ids[order],
+            'offer_start': np.array(starts, dtype=np.int64)[order],
+            'offer_end': np.array(ends, dtype=np.int64)[order],
+            'category_id': category_ids,
+            'category_offsets': np.concatenate(
+                ([0], np.cumsum(category_counts))
+            ).astype(np.int64),
+            'category_offers': rows[category_order]
+        }
+
+    def _search(self, column: str, key: str) -> tuple[int, int]:
+        """
+        Защищенный метод, ищет строки с ключом key в отсортированной
+        колонке и возвращает их диапазон.
+        """
+        values = self[column]
+        key = key.encode()
+        if len(key) > values.dtype.itemsize:
+            return 0, 0
+        return (
+            int(np.searchsorted(values, key, side='left')),
+            int(np.searchsorted(values, key, side='right'))
+        )
+
+    def locate(self, offer_id: str) -> list[tuple[int, int]]:
+        """
+        Метод, возвращает диапазоны байтов всех офферов с id offer_id
+        в порядке документа.
+        """
+        first, last = self._search('offer_id', offer_id)
+        return sorted(zip(
+            self['offer_start'][first:last].tolist(),
+            self['offer_end'][first:last].tolist()
+        ))
+
+    def category_offer_ids(self, category_id: str) -> list[str]:
+        """Метод, возвращает id офферов категории в порядке документа."""
+        first, last = self._search('category_id', category_id)
+        if first == last:
+            return []
+        offsets = self['category_offsets']
+        rows = self['category_offers'][offsets[first]:offsets[first + 1]]
+        return [
+            offer_id.decode() for offer_id in self['offer_id'][rows].tolist()
+        ]
+
+    def fetch(self, offer_ids: list[str]) -> dict[str, list[bytes]]:
+        """Метод, читает исходные байты офферов через mmap."""
+        result = {}
+        with open(self.feed_path, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            for offer_id in dict.fromkeys(offer_ids):
+                ranges = self.locate(offer_id)
+                if ranges:
+                    result[offer_id] = [
+                        data[start:end] for start, end in ranges
+                    ]
+        return result
+
+    def parse(self, offer_ids: list[str]) -> dict[str, list[ET.Element]]:
+        """Метод, читает и разбирает офферы."""
+        encoding = self.meta['encoding']
+        return {
+            offer_id: [
+                ET.fromstring(fragment.decode(encoding))
+                for fragment in fragments
+            ]
+            for offer_id, fragments in self.fetch(offer_ids).items()
+        }
+
+    def patch(self, offer_ids: list[str], patch) -> int:
+        """
+        Метод, применяет функцию patch к каждому офферу с id
+        из offer_ids и записывает измененные офферы в фид.
+        Возвращает число замененных офферов.
+        """
+        encoding = self.meta['encoding']
+        replacements = {}
+        with open(self.feed_path, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            for offer_id in dict.fromkeys(offer_ids):
+                for start, end in self.locate(offer_id):
+                    offer = ET.fromstring(data[start:end].decode(encoding))
+                    patch(offer)
+                    replacements[(start, end)] = offer
+        return self.rewrite(replacements)
+
+    def _serialize(self, offer: ET.Element) -> bytes:
+        """Защищенный метод, сериализует оффер в кодировке фида."""
+        offer.tail = None
+        return ET.tostring(offer, encoding='unicode').encode(
+            self.meta['encoding'], errors='xmlcharrefreplace'
+        )
+
+    def rewrite(self, replacements: dict[tuple[int, int], ET.Element]) -> int:
+        """
+        Метод, заменяет офферы в файле фида.
+
+        replacements - словарь {(start, end): новый элемент оффера}.
+        Если каждый новый оффер не длиннее старого, байты заменяются
+        на месте через mmap, а остаток диапазона заполняется пробелами.
+        Иначе файл переписывается копированием неизмененных кусков
+        во временный файл с атомарной заменой. Индекс сдвигается
+        без повторного разбора фида, а если у новых офферов другие
+        id или categoryId, пересобираются поиск по id и списки
+        офферов категорий. Возвращает число замененных офферов.
+        """
+        if not replacements:
+            return 0
+        keys = {
+            start: (
+                (offer.get('id') or '').encode(),
+                (offer.findtext('categoryId') or '').encode()
+            )
+            for (start, _), offer in replacements.items()
+        }
+        patches = sorted(
+            (start, end, self._serialize(offer))
+            for (start, end), offer in replacements.items()
+        )
+        in_place = all(
+            len(content) <= end - start for start, end, content in patches
+        )
+        if in_place:
+            with open(self.feed_path, 'r+b') as f, mmap.mmap(
+                f.fileno(), 0
+            ) as data:
+                for start, end, content in patches:
+                    data[start:end] = content.ljust(end - start)
+                data.flush()
+        else:
+            temp_path = temp_path_for(self.feed_path)
+            with open(self.feed_path, 'rb') as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as data, open(temp_path, 'wb') as output:
+                position = 0
+                for start, end, content in patches:
+                    output.write(data[position:start])
+                    output.write(content)
+                    position = end
+                output.write(data[position:])
+            os.replace(temp_path, self.feed_path)
+        self._update_keys(keys)
+        if not in_place:
+            self._shift(patches)
+        self._content_hash = file_hash(self.feed_path)
+        self._save_meta(**{
+            key: value for key, value in self.meta.items()
+            if key not in (
+                'version', 'sha256', 'size', 'mtime_ns', 'created_at'
+            )
+        })
+        logging.info(
+            f'В фиде {self.feed_path.name} заменено офферов: {len(patches)}'
+        )
+        return len(patches)
+
+    def _update_keys(self, keys: dict[int, tuple[bytes, bytes]]) -> None:
+        """
+        Защищенный метод, обновляет id и категории замененных офферов.
+
+        keys - словарь {начало оффера: (новый id, новый categoryId)}.
+        Если ничего не изменилось, колонки не переписываются.
+        """
+        starts = np.array(self['offer_start'])
+        offer_ids = np.array(self['offer_id'])
+        offsets = self['category_offsets']
+        categories = np.full(len(starts), b'', dtype=self['category_id'].dtype)
+        categories[self['category_offers']] = np.repeat(
+            self['category_id'], np.diff(offsets)
+        )
+        offer_ids = offer_ids.tolist()
+        categories = categories.tolist()
+        changed = False
+        for row in np.flatnonzero(np.isin(starts, list(keys))).tolist():
+            new_keys = keys[int(starts[row])]
+            if new_keys != (offer_ids[row], categories[row]):
+                offer_ids[row], categories[row] = new_keys
+                changed = True
+        if not changed:
+            return
+        order = np.argsort(starts, kind='stable').tolist()
+        columns = self._index_columns(
+            [offer_ids[row] for row in order],
+            starts[order],
+            np.array(self['offer_end'])[order],
+            [categories[row] for row in order]
+        )
+        self._columns.clear()
+        for name, values in columns.items():
+            self._save_column(name, values)
+        self.meta['categories'] = len(columns['category_id'])
+
+    def _shift(self, patches: list[tuple[int, int, bytes]]) -> None:
+        """
+        Защищенный метод, пересчитывает диапазоны офферов после
+        замены частей файла на содержимое другой длины.
+        """
+        patch_starts = np.array([start for start, _, _ in patches])
+        lengths = np.array([len(content) for _, _, content in patches])
+        deltas = lengths - np.array([end - start for start, end, _ in patches])
+        shift_before = np.concatenate(([0], np.cumsum(deltas)))
+        starts = np.array(self['offer_start'])
+        positions = np.searchsorted(patch_starts, starts, 'left')
+        new_starts = starts + shift_before[positions]
+        new_ends = np.array(self['offer_end']) + shift_before[positions]
+        patched = np.isin(starts, patch_starts)
+        new_ends[patched] = new_starts[patched] + lengths[positions[patched]]
+        self._columns.clear()
+        self._save_column('offer_start', new_starts)
+        self._save_column('offer_end', new_ends)
@@ -0,0 +1,188 @@
+import heapq
+import logging
+import pickle
+import tempfile
+import xml.etree.ElementTree as ET
+from itertools import groupby
+from pathlib import Path
+
+from handler.constants import FEED_JOIN_RUN_SIZE
+from handler.xml_writer import FeedWriter
+
+
+JOIN_TYPES = ('inner', 'full_outer', 'left', 'anti')
+CONFLICT_POLICIES = ('first', 'last', 'priority')
+
+
+class FeedJoiner:
+    """
+    Класс, предоставляющий потоковое объединение фидов по id оффера.
+
+    Каждый фид читается один раз через iterparse. Офферы сериализуются
+    и сбрасываются на диск отсортированными по id порциями
+    (не более run_size офферов в памяти), затем порции всех фидов
+    сливаются k-путевым слиянием, а результат пишется в файл
+    потоково через FeedWriter. Шапка (магазин, категории) берется
+    из первого фида; если в нем нет элемента offers, в шапку
+    добавляется пустой offers.
+
+    Типы объединения: inner - оффер есть во всех фидах, full_outer -
+    хотя бы в одном, left - в первом фиде, anti - только в первом.
+    Политика конфликтов для повторяющихся id: first - первое вхождение,
+    last - последнее, priority - из фида, который раньше
+    в списке priority (внутри фида - последнее вхождение).
+    """
+
+    def __init__(
+        self,
+        file_paths: list[Path],
+        policy: str = 'last',
+        priority: list[str] | None = None,
+        run_size: int = FEED_JOIN_RUN_SIZE
+    ) -> None:
+        if policy not in CONFLICT_POLICIES:
+            raise ValueError(f'Неизвестная политика конфликтов: {policy}')
+        self.file_paths = [Path(file_path) for file_path in file_paths]
+        self.policy = policy
+        self.run_size = run_size
+        names = [file_path.name for file_path in self.file_paths]
+        priority = [name for name in (priority or []) if name in names]
+        order = priority + [name for name in names if name not in priority]
+        self._rank = [order.index(name) for name in names]
+
+    @staticmethod
+    def _write_run(records: list, temp_dir: str) -> str:
+        """Защищенный метод, сбрасывает отсортированную порцию на диск."""
+        records.sort()
+        with tempfile.NamedTemporaryFile(
+            dir=temp_dir, suffix='.run', delete=False
+        ) as run_file:
+            for record in records:
+                pickle.dump(record, run_file, pickle.HIGHEST_PROTOCOL)
+        records.clear()
+        return run_file.name
+
+    @staticmethod
+    def _read_run(run_path: str, feed_index: int):
+        """Защищенный метод, читает порцию с диска."""
+        with open(run_path, 'rb') as run_file:
+            while True:
+                try:
+                    offer_id, seq, xml = pickle.load(run_file)
+                except EOFError:
+                    return
+                yield offer_id, feed_index, seq, xml
+
+    def _spill_feed(self, feed_index: int, temp_dir: str):
+        """
+        Защищенный метод, читает фид и сбрасывает его офферы на диск.
+
+        Возвращает пути порций и для первого фида - каркас
+        (корень и элемент offers, из которого удалены офферы).
+        """
+        runs = []
+        records = []
+        root = offers = None
+        parents = []
+        seq = 0
+        for event, elem in ET.iterparse(
+            self.file_paths[feed_index], events=('start', 'end')
+        ):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag != 'offer':
+                continue
+            offers = parents[-1]
+            offer_id = elem.get('id')
+            if offer_id:
+                elem.tail = None
+                records.append(
+                    (offer_id, seq, ET.tostring(elem, encoding='unicode'))
+                )
+                seq += 1
+                if len(records) >= self.run_size:
+                    runs.append(self._write_run(records, temp_dir))
+            elem.clear()
+            offers.remove(elem)
+        if records:
+            runs.append(self._write_run(records, temp_dir))
+        if offers is None and root is not None:
+            offers = root.find('.//offers')
+        return runs, root, offers
+
+    @staticmethod
+    def _empty_offers(root):
+        """
+        Защищенный метод, добавляет пустой элемент offers в каркас
+        фида без офферов: в элемент shop, а если его нет - в корень.
+        """
+        shop = root.find('.//shop') if root.tag != 'shop' else root
+        return ET.SubElement(root if shop is None else shop, 'offers')
+
+    def _select(self, group: list) -> str:
+        """Защищенный метод, выбирает оффер из группы с одним id."""
+        if self.policy == 'first':
+            return group[0][3]
+        if self.policy == 'last':
+            return group[-1][3]
+        best_rank = min(self._rank[record[1]] for record in group)
+        return [
+            record for record in group
+            if self._rank[record[1]] == best_rank
+        ][-1][3]
+
+    def _matches(self, how: str, feeds: set) -> bool:
+        """Защищенный метод, проверяет условие объединения."""
+        if how == 'inner':
+            return len(feeds) == len(self.file_paths)
+        if how == 'full_outer':
+            return True
+        if how == 'left':
+            return 0 in feeds
+        return feeds == {0}
+
+    def join(self, how: str, output_path: Path, **writer_options) -> int:
+        """
+        Метод, объединяет фиды и записывает результат в output_path.
+
+        Офферы в результате упорядочены по id, writer_options
+        передаются в FeedWriter. Возвращает число записанных офферов.
+        """
+        if how not in JOIN_TYPES:
+            raise ValueError(f'Неизвестный тип объединения: {how}')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            streams = []
+            root = offers = None
+            for feed_index in range(len(self.file_paths)):
+                runs, feed_root, feed_offers = self._spill_feed(
+                    feed_index, temp_dir
+                )
+                if feed_index == 0:
+                    root, offers = feed_root, feed_offers
+                streams.extend(
+                    self._read_run(run_path, feed_index) for run_path in runs
+                )
+            if offers is None:
+                offers = self._empty_offers(root)
+            with FeedWriter(output_path, **writer_options) as writer:
+                for _, records in groupby(
+                    heapq.merge(*streams), key=lambda record: record[0]
+                ):
+                    group = list(records)
+                    if not self._matches(
+                        how, {record[1] for record in group}
+                    ):
+                        continue
+                    if not writer.started:
+                        writer.begin(root, offers)
+                    writer.write_offer(ET.fromstring(self._select(group)))
+                writer.finish(root, offers)
+        logging.info(
+            f'Объединение {how}: записано {writer.offers_count} офферов '
+            f'в {output_path}'
+        )
+        return writer.offers_count
@@ -0,0 +1,131 @@
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from handler.feed_chunks import read_shard
+from handler.label_rules import LabelRules
+from handler.xml_writer import FeedWriter, indent
+
+_worker_state = {}
+
+
+def label_offer(offer, rules: LabelRules, flag: str) -> None:
+    """
+    Подставляет в оффер данные по правилам меток: флаг available
+    для недоступных офферов и новые элементы custom_label_<n>.
+    """
+    offer_name_text = offer.findtext('name')
+    offer_url_text = offer.findtext('url')
+    offer_id = offer.get('id')
+    if None in (offer_name_text, offer_url_text, offer_id):
+        return
+    if rules.is_unavailable(offer_id):
+        offer.set('available', flag)
+    existing_nums = set()
+    for el in offer.findall('*'):
+        if el.tag.startswith('custom_label_'):
+            try:
+                existing_nums.add(int(el.tag.split('_')[-1]))
+            except ValueError:
+                continue
+    for label_name in rules.match(
+        offer_id, name=offer_name_text, url=offer_url_text
+    ):
+        next_num = 0
+        while next_num in existing_nums:
+            next_num += 1
+        existing_nums.add(next_num)
+        ET.SubElement(offer, f'custom_label_{next_num}').text = label_name
+
+
+def stream_label_feed(
+    input_path,
+    output_path,
+    rules: LabelRules,
+    flag: str,
+    **writer_options
+) -> int:
+    """
+    Потоково размечает фид: офферы читаются через iterparse,
+    размечаются и сразу пишутся в output_path через FeedWriter,
+    в памяти остается только каркас фида. writer_options передаются
+    в FeedWriter. Возвращает число записанных офферов.
+    """
+    root = offers = None
+    parents = []
+    with FeedWriter(output_path, **writer_options) as writer:
+        for event, elem in ET.iterparse(input_path, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif elem.tag == 'offer' and offers is None:
+                    offers = parents[-1]
+                    writer.begin(root, offers)
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag != 'offer':
+                continue
+            label_offer(elem, rules, flag)
+            if parents and parents[-1] is offers:
+                writer.write_offer(elem)
+                offers.remove(elem)
+        writer.finish(root, offers)
+    return writer.offers_count
+
+
+def init_worker(
+    custom_label: dict[str, dict],
+    offers_id_list: list[str],
+    flag: str
+) -> None:
+    """Строит правила меток один раз на процесс-исполнитель."""
+    _worker_state['rules'] = LabelRules(custom_label, offers_id_list)
+    _worker_state['flag'] = flag
+
+
+def label_feed(task: tuple) -> str:
+    """
+    Обрабатывает фид целиком (функция процесса-исполнителя).
+
+    task - кортеж (input_path, output_path, writer_options).
+    Результат совпадает с последовательной обработкой.
+    Возвращает имя фида.
+    """
+    input_path, output_path, writer_options = task
+    stream_label_feed(
+        input_path,
+        output_path,
+        _worker_state['rules'],
+        _worker_state['flag'],
+        **writer_options
+    )
+    return Path(input_path).name
+
+
+def label_shard(task: tuple) -> tuple[str | None, str]:
+    """
+    Обрабатывает часть офферов фида (функция процесса-исполнителя).
+
+    task - кортеж (input_path, start, end, head, tail, depth, level,
+    pretty): байты [start, end) секции <offers> (целые офферы, см.
+    feed_chunks.split_offers) разбираются отдельно от остального
+    фида в обрамлении head и tail из feed_chunks.shard_context
+    (depth - глубина <offers>), офферы размечаются, при pretty=True
+    получают отступы уровня level. Возвращает текст перед первым
+    элементом части и все элементы части, сериализованные одной
+    строкой.
+    """
+    input_path, start, end, head, tail, depth, level, pretty = task
+    shard = ET.fromstring(read_shard(input_path, start, end, head, tail))
+    for _ in range(depth):
+        shard = shard[0]
+    parts = []
+    for offer in shard:
+        if offer.tag == 'offer':
+            label_offer(
+                offer, _worker_state['rules'], _worker_state['flag']
+            )
+        if pretty:
+            indent(offer, level)
+        parts.append(ET.tostring(offer, encoding='unicode'))
+    return shard.text, ''.join(parts)
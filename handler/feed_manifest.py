@@ -0,0 +1,141 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from datetime import datetime as dt
+from pathlib import Path
+
+from handler.constants import FEEDS_FOLDER
+
+
+class FeedManifest:
+    """
+    Класс, предоставляющий интерфейс к манифесту скачанных фидов.
+
+    Манифест хранится в json-файле рядом с директорией фидов
+    (temp_feeds_manifest.json для temp_feeds). Для каждого фида
+    в нем записаны ETag, Last-Modified, размер и sha256 содержимого,
+    а для каждого этапа обработки - хеш фида, который этап видел
+    при последнем запуске. Записи на диск из разных экземпляров,
+    потоков и процессов не пересекаются: они выполняются под
+    блокировкой файла <манифест>.lock.
+    """
+
+    _save_lock = threading.Lock()
+
+    def __init__(self, feeds_folder: str = FEEDS_FOLDER) -> None:
+        folder_path = Path(__file__).parent.parent / feeds_folder
+        self.path = folder_path.with_name(
+            f'{folder_path.name}_manifest.json'
+        )
+        self.folder_path = folder_path
+        self._lock = threading.Lock()
+        self._data = self._load()
+        self._dirty_feeds: set[str] = set()
+        self._dirty_stages: set[tuple[str, str]] = set()
+
+    def _load(self) -> dict:
+        """Защищенный метод, читает манифест с диска."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            logging.warning(f'Манифест {self.path} не прочитан: {e}')
+            data = {}
+        data.setdefault('feeds', {})
+        data.setdefault('stages', {})
+        return data
+
+    def save(self) -> None:
+        """
+        Метод, атомарно записывает манифест на диск.
+
+        Перед записью манифест перечитывается, и в него переносятся
+        только измененные этим экземпляром записи, чтобы не затереть
+        результаты других этапов. Чтение, слияние и замена файла
+        выполняются под межпроцессной блокировкой fcntl.flock.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = self.path.with_name(f'{self.path.name}.lock')
+        with (
+            FeedManifest._save_lock,
+            self._lock,
+            open(lock_path, 'a') as lock_file
+        ):
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            data = self._load()
+            for file_name in self._dirty_feeds:
+                data['feeds'][file_name] = self._data['feeds'][file_name]
+            for stage, file_name in self._dirty_stages:
+                data['stages'].setdefault(stage, {})[file_name] = (
+                    self._data['stages'][stage][file_name]
+                )
+            temp_path = self.path.with_name(
+                f'.{self.path.name}.{os.getpid()}.part'
+            )
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            self._data = data
+            self._dirty_feeds.clear()
+            self._dirty_stages.clear()
+
+    def get(self, file_name: str) -> dict:
+        """Метод, возвращает запись фида (пустую, если ее нет)."""
+        with self._lock:
+            return dict(self._data['feeds'].get(file_name, {}))
+
+    def content_hash(self, file_name: str) -> str | None:
+        """Метод, возвращает sha256 последнего скачанного содержимого."""
+        return self.get(file_name).get('sha256')
+
+    def conditional_headers(self, file_name: str) -> dict:
+        """
+        Метод, возвращает заголовки условного запроса для фида.
+
+        Заголовки отправляются, только если файл фида есть на диске,
+        иначе ответ 304 нечем было бы заменить.
+        """
+        if not (self.folder_path / file_name).is_file():
+            return {}
+        entry = self.get(file_name)
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, file_name: str, **fields) -> None:
+        """Метод, обновляет запись фида."""
+        with self._lock:
+            entry = self._data['feeds'].setdefault(file_name, {})
+            entry.update(fields)
+            entry['checked_at'] = dt.now().isoformat(timespec='seconds')
+            self._dirty_feeds.add(file_name)
+
+    def is_changed(self, file_name: str, stage: str) -> bool:
+        """
+        Метод, проверяет, изменился ли фид с последнего
+        запуска этапа stage.
+
+        Фид без записанного хеша считается измененным.
+        """
+        current_hash = self.content_hash(file_name)
+        if current_hash is None:
+            return True
+        with self._lock:
+            seen_hash = self._data['stages'].get(stage, {}).get(file_name)
+        return seen_hash != current_hash
+
+    def mark_processed(self, file_name: str, stage: str) -> None:
+        """Метод, запоминает текущий хеш фида как обработанный этапом."""
+        current_hash = self.content_hash(file_name)
+        with self._lock:
+            self._data['stages'].setdefault(stage, {})[file_name] = (
+                current_hash
+            )
+            self._dirty_stages.add((stage, file_name))
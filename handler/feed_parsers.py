@@ -0,0 +1,104 @@
+from collections import deque
+from pyexpat import ParserCreate
+
+FEED_PARSERS = ('etree', 'expat')
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def element_records(elements, fields: tuple[str, ...]):
+    """
+    Перебирает записи фида по элементам ElementTree.
+
+    Для <category> отдается кортеж ('category', id, parentId),
+    для <offer> - ('offer', id, текст первого дочернего элемента
+    для каждого из fields или None, если его нет). Поле вида
+    @available означает атрибут оффера.
+    """
+    for elem in elements:
+        if elem.tag == 'category':
+            yield 'category', elem.get('id'), elem.get('parentId')
+        elif elem.tag == 'offer':
+            yield (
+                'offer',
+                elem.get('id'),
+                *(
+                    elem.get(field[1:]) if field.startswith('@')
+                    else elem.findtext(field)
+                    for field in fields
+                )
+            )
+
+
+def _finalize(record) -> tuple:
+    """Превращает запись оффера с кусками текста в кортеж."""
+    if isinstance(record, tuple):
+        return record
+    return (
+        *record[:2],
+        *(chunks if chunks is None or isinstance(chunks, str)
+          else ''.join(chunks)
+          for chunks in record[2:])
+    )
+
+
+def expat_records(file_path, fields: tuple[str, ...]):
+    """
+    Перебирает записи фида через pyexpat без построения дерева.
+
+    Записи те же, что у element_records для офферов и категорий
+    в порядке документа: читаются только атрибуты этих тегов и текст
+    дочерних элементов оффера из fields, остальные теги пропускаются.
+    Файл читается кусками по READ_CHUNK_SIZE байт.
+    """
+    positions = {field: index for index, field in enumerate(fields, 2)}
+    pending = deque()
+    opened = []
+    depth = 0
+    capture = None
+    parser = ParserCreate()
+    parser.buffer_text = True
+
+    def start_element(tag, attrs):
+        nonlocal depth, capture
+        depth += 1
+        # текст после дочернего элемента не входит в text
+        capture = None
+        if tag == 'category':
+            pending.append(
+                ('category', attrs.get('id'), attrs.get('parentId'))
+            )
+        elif tag == 'offer':
+            record = ['offer', attrs.get('id')] + [
+                attrs.get(field[1:]) if field.startswith('@') else None
+                for field in fields
+            ]
+            pending.append(record)
+            opened.append((depth, record))
+        elif opened and opened[-1][0] == depth - 1 and tag in positions:
+            record = opened[-1][1]
+            if record[positions[tag]] is None:
+                capture = record[positions[tag]] = []
+
+    def end_element(tag):
+        nonlocal depth, capture
+        capture = None
+        if opened and opened[-1][0] == depth:
+            opened.pop()
+        depth -= 1
+
+    def character_data(text):
+        if capture is not None:
+            capture.append(text)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            parser.Parse(chunk)
+            # офферы отдаются в порядке открывающих тегов, как findall
+            while pending and not (opened and pending[0] is opened[0][1]):
+                yield _finalize(pending.popleft())
+        parser.Parse(b'', True)
+    while pending:
+        yield _finalize(pending.popleft())
@@ -0,0 +1,213 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from handler.constants import (
+    FEED_PARSE_CHUNK_SIZE,
+    FEED_PARSER,
+    FEED_PARSE_WORKERS,
+    PARALLEL_PARSE_MIN_SIZE,
+    SNAPSHOT_SUFFIX
+)
+from handler.feed_chunks import (
+    TEXT_FIELDS,
+    OfferColumns,
+    parse_feed_parallel
+)
+from handler.feed_columns import FeedColumns, bytes_array
+from handler.feed_parsers import FEED_PARSERS, expat_records
+
+
+def group_category_prices(
+    offer_categories: np.ndarray,
+    prices: np.ndarray,
+    has_price: np.ndarray,
+    all_categories: dict
+) -> dict:
+    """
+    Группирует цены офферов по категориям.
+
+    Возвращает словарь {id категории: список цен}: сначала категории
+    из all_categories, затем категории, встречающиеся только
+    у офферов, в порядке первого появления. Учитываются офферы
+    с категорией и ценой.
+    """
+    offer_categories = np.asarray(offer_categories)
+    mask = np.asarray(has_price) & (offer_categories != b'')
+    categories = offer_categories[mask]
+    prices = np.asarray(prices)[mask]
+    by_id = {}
+    first_seen = []
+    if categories.size:
+        unique, first, inverse = np.unique(
+            categories, return_index=True, return_inverse=True
+        )
+        order = np.argsort(inverse, kind='stable')
+        groups = np.split(
+            prices[order], np.cumsum(np.bincount(inverse))[:-1]
+        )
+        by_id = {
+            category_id.decode(): group.tolist()
+            for category_id, group in zip(unique.tolist(), groups)
+        }
+        first_seen = [unique[index].decode() for index in np.argsort(first)]
+    category_data = {
+        category_id: by_id.pop(category_id, [])
+        for category_id in all_categories
+    }
+    for category_id in first_seen:
+        if category_id in by_id:
+            category_data[category_id] = by_id.pop(category_id)
+    return category_data
+
+
+def category_columns(categories) -> dict[str, np.ndarray]:
+    """Собирает колонки категорий из пар (id, parentId)."""
+    category_ids, category_parents, category_has_parent = [], [], []
+    for category_id, parent_id in categories:
+        category_ids.append((category_id or '').encode())
+        category_parents.append((parent_id or '').encode())
+        category_has_parent.append(parent_id is not None)
+    return {
+        'category_id': bytes_array(category_ids),
+        'category_parent': bytes_array(category_parents),
+        'category_has_parent': np.array(category_has_parent, dtype=bool)
+    }
+
+
+class FeedSnapshot(FeedColumns):
+    """
+    Класс, предоставляющий колоночный снимок фида.
+
+    Фид разбирается один раз, а его офферы и категории сохраняются
+    рядом с ним в папке <фид>.snapshot как массивы NumPy (.npy),
+    которые читаются через mmap без разбора XML. Колонки офферов
+    описаны в OfferColumns, колонки категорий: category_id,
+    category_parent и category_has_parent. Снимок действителен,
+    пока совпадает sha256 содержимого фида. Фиды от
+    PARALLEL_PARSE_MIN_SIZE байт разбираются частями в пуле
+    из max_workers процессов (куски - через etree), остальные -
+    потоково парсером parser (см. FEED_PARSERS).
+    """
+
+    suffix = SNAPSHOT_SUFFIX
+
+    def __init__(
+        self,
+        feed_path,
+        content_hash: str | None = None,
+        max_workers: int | None = FEED_PARSE_WORKERS,
+        parser: str = FEED_PARSER
+    ) -> None:
+        if parser not in FEED_PARSERS:
+            raise ValueError(f'Неизвестный парсер фидов: {parser}')
+        super().__init__(feed_path, content_hash)
+        self.max_workers = max_workers
+        self.parser = parser
+
+    def _collect_parallel(self) -> tuple[dict, list, int] | None:
+        """Защищенный метод, разбирает фид частями в пуле процессов."""
+        parsed = parse_feed_parallel(
+            self.feed_path, FEED_PARSE_CHUNK_SIZE, self.max_workers
+        )
+        if parsed is None:
+            return None
+        skeleton, columns, invalid_prices = parsed
+        return columns, [
+            (elem.get('id'), elem.get('parentId'))
+            for elem in skeleton.iter('category')
+        ], invalid_prices
+
+    def _collect_expat(self) -> tuple[dict, list, int]:
+        """
+        Защищенный метод, разбирает фид через pyexpat без создания
+        элементов.
+        """
+        offers = OfferColumns()
+        categories = []
+        for tag, element_id, *values in expat_records(
+            self.feed_path, ('categoryId', 'price', '@available', *TEXT_FIELDS)
+        ):
+            if tag == 'category':
+                categories.append((element_id, values[0]))
+                continue
+            category_id, price, available, *texts = values
+            offers.add_values(element_id, category_id, price, available, texts)
+        return offers.arrays(), categories, offers.invalid_prices
+
+    def _collect_serial(self) -> tuple[dict, list, int]:
+        """Защищенный метод, разбирает фид через iterparse."""
+        if self.parser == 'expat':
+            return self._collect_expat()
+        offers = OfferColumns()
+        categories = []
+        parents = []
+        for event, elem in ET.iterparse(
+            self.feed_path, events=('start', 'end')
+        ):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag == 'category':
+                categories.append((elem.get('id'), elem.get('parentId')))
+                continue
+            if elem.tag != 'offer':
+                continue
+            offers.add(elem)
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+        return offers.arrays(), categories, offers.invalid_prices
+
+    def _collect(self) -> tuple[dict[str, np.ndarray], dict]:
+        """
+        Защищенный метод, разбирает фид: большой - частями
+        в пуле процессов, остальные - потоково в текущем процессе.
+        """
+        collected = None
+        if (
+            self.max_workers != 1
+            and self.feed_path.stat().st_size >= PARALLEL_PARSE_MIN_SIZE
+        ):
+            collected = self._collect_parallel()
+        if collected is None:
+            collected = self._collect_serial()
+        offer_columns, categories, invalid_prices = collected
+        columns = {**category_columns(categories), **offer_columns}
+        return columns, {
+            'offers': len(columns['offer_id']),
+            'categories': len(columns['category_id']),
+            'invalid_prices': invalid_prices
+        }
+
+    def iter_text(self, field: str):
+        """Метод, перебирает значения текстового поля офферов."""
+        data = self[field]
+        offsets = self[f'{field}_offsets']
+        raw = data.tobytes() if data.size else b''
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            yield raw[start:end].decode()
+
+    def categories(self) -> dict:
+        """Метод, возвращает словарь {id категории: id родителя}."""
+        return {
+            category_id.decode(): parent_id.decode() if has_parent else None
+            for category_id, parent_id, has_parent in zip(
+                self['category_id'].tolist(),
+                self['category_parent'].tolist(),
+                self['category_has_parent'].tolist()
+            )
+        }
+
+    def category_prices(self, all_categories: dict) -> dict:
+        """
+        Метод, возвращает словарь {id категории: список цен}
+        (см. group_category_prices).
+        """
+        return group_category_prices(
+            self['offer_category'],
+            self['price'],
+            self['has_price'],
+            all_categories
+        )
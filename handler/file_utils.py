@@ -0,0 +1,14 @@
+import os
+import threading
+from pathlib import Path
+
+
+def temp_path_for(file_path) -> Path:
+    """
+    Возвращает уникальный путь временного файла рядом с file_path
+    для последующей атомарной замены через os.replace.
+    """
+    file_path = Path(file_path)
+    return file_path.with_name(
+        f'.{file_path.name}.{os.getpid()}.{threading.get_ident()}.part'
+    )
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from handler.constants import IMAGE_DOWNLOAD_WORKERS, IMAGE_REQUEST_TIMEOUT
+from handler.session_pool import SessionPool
+
+
+class ImageFetcher:
+    """
+    Класс, предоставляющий движок параллельного скачивания изображений.
+
+    Каждая ссылка скачивается один раз через общий пул keep-alive
+    соединений, число одновременных запросов ограничено max_workers,
+    а очередь задач - удвоенным числом потоков, поэтому
+    память не растет с размером фида.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = IMAGE_DOWNLOAD_WORKERS,
+        timeout: float = IMAGE_REQUEST_TIMEOUT,
+        session_pool: SessionPool | None = None
+    ) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session_pool = session_pool or SessionPool(pool_size=max_workers)
+
+    def _fetch(
+        self,
+        url: str,
+        headers: dict | None = None
+    ) -> requests.Response:
+        """Защищенный метод, скачивает содержимое по ссылке."""
+        response = self.session_pool.get(
+            url, headers=headers, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _failure_reason(error: Exception) -> str:
+        """Защищенный метод, возвращает краткую причину ошибки."""
+        if (
+            isinstance(error, requests.HTTPError)
+            and error.response is not None
+        ):
+            return f'HTTP {error.response.status_code}'
+        return type(error).__name__
+
+    def run(self, tasks, handler) -> dict:
+        """
+        Метод, скачивает изображения и передает их обработчику.
+
+        tasks - итерируемый объект пар (key, url) или троек
+        (key, url, headers) для условных запросов, handler - функция
+        handler(key, url, response), которая сохраняет скачанные байты
+        (response.content) или обрабатывает ответ 304.
+        Возвращает статистику: количество успешных и неудачных загрузок,
+        объем, время, пропускную способность (изображений и МБ в секунду)
+        и сводку ошибок по причинам.
+        """
+        stats = {'total': 0, 'succeeded': 0, 'failed': 0, 'bytes': 0}
+        failures = Counter()
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+        start_time = time.monotonic()
+
+        def job(key, url, headers):
+            try:
+                response = self._fetch(url, headers)
+                handler(key, url, response)
+            except Exception as e:
+                reason = self._failure_reason(e)
+                logging.error(f'Ошибка при обработке изображения {url}: {e}')
+                with lock:
+                    stats['failed'] += 1
+                    failures[reason] += 1
+            else:
+                with lock:
+                    stats['succeeded'] += 1
+                    stats['bytes'] += len(response.content)
+            finally:
+                slots.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for key, url, *options in tasks:
+                    slots.acquire()
+                    stats['total'] += 1
+                    executor.submit(
+                        job, key, url, options[0] if options else None
+                    )
+        finally:
+            self.session_pool.close()
+
+        seconds = max(time.monotonic() - start_time, 1e-9)
+        stats['seconds'] = round(seconds, 3)
+        stats['images_per_second'] = round(stats['succeeded'] / seconds, 2)
+        stats['mb_per_second'] = round(stats['bytes'] / 1e6 / seconds, 2)
+        stats['failures'] = dict(failures)
+        logging.info(
+            f'Скачано {stats["succeeded"]} изображений из {stats["total"]} '
+            f'({round(stats["bytes"] / 1e6, 2)} МБ) за {stats["seconds"]} '
+            f'сек.: {stats["images_per_second"]} изобр./сек., '
+            f'{stats["mb_per_second"]} МБ/сек. Ошибки: {stats["failures"]}'
+        )
+        return stats
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime as dt
+from pathlib import Path
+
+from handler.constants import IMAGE_MANIFEST, IMAGE_OBJECTS_FOLDER
+from handler.file_utils import temp_path_for
+
+
+class ImageStore:
+    """
+    Класс, предоставляющий контентно-адресуемое хранилище изображений.
+
+    Байты изображения хранятся один раз в objects/<xx>/<sha256>.<ext>,
+    а для каждого оффера в папке изображений создается жесткая ссылка
+    <offer_id>.<ext> на этот объект (или копия, если ссылки
+    не поддерживаются). Манифест в SQLite связывает ссылку на картинку
+    с хешем, файлом объекта и валидаторами HTTP (ETag, Last-Modified).
+    """
+
+    def __init__(self, folder_path: Path) -> None:
+        self.folder_path = Path(folder_path)
+        self.objects_path = self.folder_path / IMAGE_OBJECTS_FOLDER
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.folder_path / IMAGE_MANIFEST)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                file TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS links (
+                offer_id TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                link TEXT NOT NULL
+            );
+        ''')
+
+    def close(self) -> None:
+        """Метод, сохраняет изменения манифеста и закрывает его."""
+        self.connection.commit()
+        self.connection.close()
+
+    def get_image(self, url: str) -> dict | None:
+        """
+        Метод, возвращает запись манифеста по ссылке на картинку,
+        если файл объекта на месте.
+        """
+        row = self.connection.execute(
+            'SELECT * FROM images WHERE url = ?', (url,)
+        ).fetchone()
+        if row is None or not (self.objects_path / row['file']).is_file():
+            return None
+        return dict(row)
+
+    def put_object(self, content: bytes, extension: str) -> tuple[str, str]:
+        """
+        Метод, сохраняет байты изображения в хранилище, если такого
+        объекта еще нет. Возвращает sha256 и путь объекта
+        относительно objects. Безопасен для вызова из потоков.
+        """
+        sha256 = hashlib.sha256(content).hexdigest()
+        file = f'{sha256[:2]}/{sha256}.{extension}'
+        object_path = self.objects_path / file
+        if not object_path.is_file():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = temp_path_for(object_path)
+            with open(temp_path, 'wb') as temp_file:
+                temp_file.write(content)
+            os.replace(temp_path, object_path)
+        return sha256, file
+
+    def record_image(
+        self,
+        url: str,
+        sha256: str,
+        file: str,
+        etag: str | None = None,
+        last_modified: str | None = None
+    ) -> None:
+        """Метод, записывает в манифест скачанное изображение."""
+        self.connection.execute(
+            'INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                url, sha256, file, etag, last_modified,
+                dt.now().isoformat(timespec='seconds')
+            )
+        )
+
+    def touch_image(self, url: str) -> None:
+        """Метод, отмечает изображение как подтвержденное сервером."""
+        self.connection.execute(
+            'UPDATE images SET checked_at = ? WHERE url = ?',
+            (dt.now().isoformat(timespec='seconds'), url)
+        )
+
+    def link(self, offer_id: str, file: str) -> bool:
+        """
+        Метод, связывает оффер с объектом хранилища.
+
+        Возвращает True, если ссылка создана или изменена.
+        """
+        row = self.connection.execute(
+            'SELECT file, link FROM links WHERE offer_id = ?', (offer_id,)
+        ).fetchone()
+        link = f'{offer_id}{Path(file).suffix}'
+        link_path = self.folder_path / link
+        if (
+            row is not None
+            and row['file'] == file
+            and link_path.is_file()
+        ):
+            return False
+        if row is not None and row['link'] != link:
+            (self.folder_path / row['link']).unlink(missing_ok=True)
+        temp_path = link_path.with_name(f'.{link}.part')
+        temp_path.unlink(missing_ok=True)
+        try:
+            os.link(self.objects_path / file, temp_path)
+        except OSError:
+            shutil.copyfile(self.objects_path / file, temp_path)
+        os.replace(temp_path, link_path)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO links VALUES (?, ?, ?)',
+            (offer_id, file, link)
+        )
+        return True
+
+    def collect_garbage(
+        self,
+        offer_ids: set[str],
+        urls: set[str]
+    ) -> tuple[int, int]:
+        """
+        Метод, удаляет ссылки офферов, пропавших из фидов, записи
+        о картинках, на которые больше никто не ссылается, и объекты
+        без записей. Возвращает число удаленных ссылок и объектов.
+        """
+        removed_links = 0
+        for row in self.connection.execute(
+            'SELECT offer_id, link FROM links'
+        ).fetchall():
+            if row['offer_id'] in offer_ids:
+                continue
+            (self.folder_path / row['link']).unlink(missing_ok=True)
+            self.connection.execute(
+                'DELETE FROM links WHERE offer_id = ?', (row['offer_id'],)
+            )
+            removed_links += 1
+
+        for (url,) in self.connection.execute(
+            'SELECT url FROM images'
+        ).fetchall():
+            if url not in urls:
+                self.connection.execute(
+                    'DELETE FROM images WHERE url = ?', (url,)
+                )
+
+        used_files = {
+            file for (file,) in self.connection.execute(
+                'SELECT file FROM images UNION SELECT file FROM links'
+            )
+        }
+        removed_objects = 0
+        for object_path in self.objects_path.glob('*/*'):
+            file = object_path.relative_to(self.objects_path).as_posix()
+            if file not in used_files:
+                object_path.unlink()
+                removed_objects += 1
+        self.connection.commit()
+        logging.info(
+            f'Удалено ссылок на изображения: {removed_links}, '
+            f'объектов: {removed_objects}'
+        )
+        return removed_links, removed_objects
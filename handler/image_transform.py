@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from handler.constants import (
+    IMAGE_MANIFEST,
+    IMAGE_TRANSFORM_BACKGROUND,
+    IMAGE_TRANSFORM_FORMAT,
+    IMAGE_TRANSFORM_QUALITY,
+    IMAGE_TRANSFORM_SIZES,
+    IMAGE_TRANSFORM_SOURCES,
+    IMAGE_TRANSFORM_SQUARE
+)
+from handler.file_utils import temp_path_for
+
+
+def _fit(image: Image.Image, box, square: bool, background) -> Image.Image:
+    """Вписывает изображение в рамку box и при необходимости в квадрат."""
+    result = image.copy()
+    if box is not None:
+        result.thumbnail(box, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if square and result.width != result.height:
+        side = max(result.size)
+        canvas = Image.new(result.mode, (side, side), background)
+        canvas.paste(
+            result,
+            ((side - result.width) // 2, (side - result.height) // 2)
+        )
+        result = canvas
+    return result
+
+
+def _prepare_mode(image: Image.Image, image_format: str, background):
+    """
+    Приводит изображение к RGB (или RGBA для форматов с прозрачностью),
+    для JPEG прозрачные области заливаются фоном.
+    """
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+    if not has_alpha:
+        return image if image.mode == 'RGB' else image.convert('RGB')
+    image = image.convert('RGBA')
+    if image_format not in ('JPEG', 'BMP'):
+        return image
+    canvas = Image.new('RGB', image.size, background)
+    canvas.paste(image, mask=image.getchannel('A'))
+    return canvas
+
+
+def transform_image(task: tuple) -> tuple[str, int, str | None]:
+    """
+    Обрабатывает одно изображение (функция процесса-исполнителя).
+
+    task - кортеж (source, targets, image_format, quality, square,
+    background), где targets - список пар (box, output_path).
+    Для JPEG декодирование сразу идет в уменьшенном масштабе
+    через draft(). Возвращает путь источника, число записанных
+    файлов и текст ошибки (или None).
+    """
+    source, targets, image_format, quality, square, background = task
+    try:
+        with Image.open(source) as image:
+            boxes = [box for box, _ in targets]
+            if image.format == 'JPEG' and None not in boxes:
+                image.draft('RGB', (
+                    max(box[0] for box in boxes),
+                    max(box[1] for box in boxes)
+                ))
+            output_format = image_format or image.format
+            prepared = _prepare_mode(image, output_format, background)
+            for box, output_path in targets:
+                result = _fit(prepared, box, square, background)
+                output_path = Path(output_path)
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = temp_path_for(output_path)
+                result.save(
+                    temp_path, output_format, quality=quality, optimize=True
+                )
+                os.replace(temp_path, output_path)
+        return source, len(targets), None
+    except Exception as e:
+        return source, 0, str(e)
+
+
+class ImageTransformer:
+    """
+    Класс, предоставляющий этап обработки изображений в пуле процессов.
+
+    Читает изображения из папки источника и записывает в целевую папку
+    уменьшенные до рамок sizes копии (по подпапке <w>x<h> на рамку,
+    None - исходный размер в корне целевой папки) в формате
+    image_format с качеством quality, при square=True - дополненные
+    до квадрата фоном background.
+
+    Для каждого источника в файле IMAGE_TRANSFORM_SOURCES целевой
+    папки записывается, из какого файла (inode, размер и время
+    изменения) построены его копии. Копии пропускаются, пока источник
+    тот же: сравнения времени изменения недостаточно, потому что
+    изображения ImageStore - жесткие ссылки на объекты, которые
+    сохраняют свое время изменения при перепривязке оффера.
+    """
+
+    def __init__(
+        self,
+        sizes: list = IMAGE_TRANSFORM_SIZES,
+        image_format: str | None = IMAGE_TRANSFORM_FORMAT,
+        quality: int = IMAGE_TRANSFORM_QUALITY,
+        square: bool = IMAGE_TRANSFORM_SQUARE,
+        background: tuple = IMAGE_TRANSFORM_BACKGROUND
+    ) -> None:
+        self.sizes = [tuple(size) if size else None for size in sizes]
+        self.image_format = image_format.upper() if image_format else None
+        self.quality = quality
+        self.square = square
+        self.background = tuple(background)
+
+    def _output_path(self, source: Path, target_folder: Path, box) -> Path:
+        """Защищенный метод, возвращает путь выходного файла."""
+        folder = (
+            target_folder / f'{box[0]}x{box[1]}' if box else target_folder
+        )
+        suffix = (
+            f'.{self.image_format.lower()}'
+            if self.image_format else source.suffix
+        )
+        return folder / f'{source.stem}{suffix}'
+
+    @staticmethod
+    def _load_sources(target_folder: Path) -> dict:
+        """
+        Защищенный метод, читает отметки источников готовых копий:
+        {имя источника: [inode, размер, время изменения в нс]}.
+        """
+        try:
+            with open(
+                target_folder / IMAGE_TRANSFORM_SOURCES, encoding='utf-8'
+            ) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(
+                f'Отметки источников изображений не прочитаны: {e}'
+            )
+            return {}
+
+    @staticmethod
+    def _save_sources(target_folder: Path, sources: dict) -> None:
+        """Защищенный метод, атомарно записывает отметки источников."""
+        sources_path = target_folder / IMAGE_TRANSFORM_SOURCES
+        temp_path = temp_path_for(sources_path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(sources, f)
+        os.replace(temp_path, sources_path)
+
+    def _iter_tasks(
+        self,
+        source_folder: Path,
+        target_folder: Path,
+        sources: dict,
+        current: dict,
+        skipped
+    ):
+        """
+        Защищенный метод, перебирает задачи для изображений,
+        у которых есть устаревшие или отсутствующие выходные файлы.
+
+        sources - отметки источников прошлых запусков, в current
+        записываются отметки текущих файлов источников.
+        """
+        for source in source_folder.iterdir():
+            if (
+                not source.is_file()
+                or source.name.startswith('.')
+                or source.name == IMAGE_MANIFEST
+            ):
+                continue
+            source_stat = source.stat()
+            current[source.name] = [
+                source_stat.st_ino,
+                source_stat.st_size,
+                source_stat.st_mtime_ns
+            ]
+            is_same = sources.get(source.name) == current[source.name]
+            targets = []
+            for box in self.sizes:
+                output_path = self._output_path(source, target_folder, box)
+                if is_same and output_path.is_file():
+                    continue
+                targets.append((box, str(output_path)))
+            if not targets:
+                skipped.append(source)
+                continue
+            yield (
+                str(source), targets, self.image_format,
+                self.quality, self.square, self.background
+            )
+
+    def run(
+        self,
+        source_folder: Path,
+        target_folder: Path,
+        max_workers: int | None = None
+    ) -> dict:
+        """
+        Метод, обрабатывает изображения на всех ядрах
+        (или в max_workers процессах). Возвращает статистику.
+        """
+        start_time = time.monotonic()
+        target_folder.mkdir(parents=True, exist_ok=True)
+        skipped = []
+        sources = self._load_sources(target_folder)
+        current = {}
+        stats = {'transformed': 0, 'files': 0, 'failed': 0}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for source, files, error in executor.map(
+                transform_image,
+                self._iter_tasks(
+                    source_folder, target_folder, sources, current, skipped
+                ),
+                chunksize=16
+            ):
+                name = Path(source).name
+                if error is not None:
+                    stats['failed'] += 1
+                    sources.pop(name, None)
+                    logging.error(
+                        f'Ошибка при обработке изображения {source}: {error}'
+                    )
+                    continue
+                sources[name] = current[name]
+                stats['transformed'] += 1
+                stats['files'] += files
+        self._save_sources(target_folder, {
+            name: sources[name] for name in current if name in sources
+        })
+        stats['skipped'] = len(skipped)
+        stats['seconds'] = round(time.monotonic() - start_time, 3)
+        logging.info(
+            f'Обработано изображений: {stats["transformed"]}, '
+            f'записано файлов: {stats["files"]}, '
+            f'пропущено: {stats["skipped"]}, ошибок: {stats["failed"]} '
+            f'за {stats["seconds"]} сек.'
+        )
+        return stats
@@ -0,0 +1,96 @@
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+from handler.constants import (
+    STARTUP_BENCHMARK_REPEAT,
+    STARTUP_HEAVY_MODULES,
+    STARTUP_IMPORT_BUDGET
+)
+
+
+def measure_imports(module: str) -> tuple[float, list[tuple[int, str]]]:
+    """
+    Импортирует module в отдельном интерпретаторе с -X importtime.
+
+    Возвращает время импорта module в секундах (с учетом вложенных
+    импортов) и список (собственное время в мкс, имя) всех
+    импортированных модулей.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(self_time), name.strip()))
+        if name.strip() == module:
+            total = int(cumulative)
+    return total / 1_000_000, modules
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Разбирает аргументы командной строки."""
+    parser = argparse.ArgumentParser(
+        description='Проверка времени импорта точки входа'
+    )
+    parser.add_argument('--module', default='handler.main')
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=STARTUP_IMPORT_BUDGET,
+        help='допустимое время импорта, сек.'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=STARTUP_BENCHMARK_REPEAT,
+        help='число замеров, берется лучший'
+    )
+    parser.add_argument(
+        '--allow',
+        nargs='*',
+        default=[],
+        help='тяжелые модули, которые разрешено импортировать'
+    )
+    parser.add_argument(
+        '--top', type=int, default=10, help='сколько модулей показать'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Замеряет импорт модуля и возвращает 1, если он дольше бюджета
+    или тянет за собой модули из STARTUP_HEAVY_MODULES.
+    """
+    args = parse_args(argv)
+    runs = [measure_imports(args.module) for _ in range(max(1, args.repeat))]
+    total, modules = min(runs, key=lambda run: run[0])
+    print(f'Импорт {args.module}: {round(total, 4)} сек.')
+    for self_time, name in sorted(modules, reverse=True)[:args.top]:
+        print(f'  {self_time:>8} мкс  {name}')
+    heavy = sorted(
+        {name.split('.')[0] for _, name in modules}
+        & set(STARTUP_HEAVY_MODULES) - set(args.allow)
+    )
+    code = 0
+    if heavy:
+        print(f'Импортированы тяжелые модули: {", ".join(heavy)}')
+        code = 1
+    if total > args.budget:
+        print(f'Превышено допустимое время импорта: {args.budget} сек.')
+        code = 1
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
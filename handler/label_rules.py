@@ -0,0 +1,117 @@
+import re
+from collections import defaultdict
+
+LABEL_FIELDS = ('name', 'url')
+
+
+def _trie_pattern(node: dict) -> str:
+    """
+    Собирает регулярное выражение из префиксного дерева подстрок.
+
+    Общие префиксы не повторяются, поэтому проверка одной позиции
+    текста стоит не больше длины самой длинной подстроки, а не числа
+    подстрок. Необязательные продолжения жадные: в каждой позиции
+    находится самая длинная из подстрок.
+    """
+    branches = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in node.items() if char
+    ]
+    if not branches:
+        return ''
+    body = (
+        branches[0] if len(branches) == 1
+        else '(?:' + '|'.join(branches) + ')'
+    )
+    if '' in node:
+        return f'(?:{body})?'
+    return body
+
+
+class FieldMatcher:
+    """
+    Класс, предоставляющий поиск всех подстрок правил в одном поле
+    оффера за один проход по тексту (без учета регистра).
+
+    В каждой позиции текста выражение находит самую длинную подстроку,
+    а для нее заранее посчитано замыкание - метки всех подстрок,
+    которые в нее входят. Так находятся и вложенные совпадения.
+    """
+
+    def __init__(self, patterns: dict[str, set[int]]) -> None:
+        self.always = frozenset(patterns.pop('', ()))
+        self.closure = {}
+        self.regex = None
+        if not patterns:
+            return
+        trie = {}
+        for pattern in patterns:
+            node = trie
+            for char in pattern:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        self.regex = re.compile(f'(?=({_trie_pattern(trie)}))')
+        for pattern in sorted(patterns, key=len):
+            labels = set(patterns[pattern])
+            for length in range(len(pattern) - 1, 0, -1):
+                if pattern[:length] in patterns:
+                    labels |= self.closure[pattern[:length]]
+                    break
+            for match in self.regex.finditer(pattern, 1):
+                labels |= self.closure[match.group(1)]
+            self.closure[pattern] = frozenset(labels)
+
+    def match(self, text: str) -> set[int]:
+        """Метод, возвращает номера меток, подстроки которых есть в text."""
+        labels = set(self.always)
+        if self.regex is not None:
+            for found in set(self.regex.findall(text.lower())):
+                labels |= self.closure[found]
+        return labels
+
+
+class LabelRules:
+    """
+    Класс, предоставляющий скомпилированные правила
+    настраиваемых меток CUSTOM_LABEL.
+
+    Правила строятся один раз на запуск: подстроки каждого поля
+    собираются в одно выражение, id офферов и список недоступных
+    офферов - в множества. Проверка оффера не зависит от числа правил.
+    """
+
+    def __init__(
+        self,
+        custom_label: dict[str, dict],
+        unavailable_ids=()
+    ) -> None:
+        self.labels = list(custom_label)
+        self.unavailable_ids = frozenset(unavailable_ids)
+        self.id_labels = defaultdict(set)
+        field_patterns = {field: defaultdict(set) for field in LABEL_FIELDS}
+        for index, conditions in enumerate(custom_label.values()):
+            for offer_id in conditions.get('id', []):
+                self.id_labels[offer_id].add(index)
+            for field in LABEL_FIELDS:
+                for sub in conditions.get(field, []):
+                    field_patterns[field][sub.lower()].add(index)
+        self.matchers = {
+            field: FieldMatcher(dict(patterns))
+            for field, patterns in field_patterns.items()
+        }
+
+    def is_unavailable(self, offer_id: str) -> bool:
+        """Метод, проверяет, входит ли оффер в список недоступных."""
+        return offer_id in self.unavailable_ids
+
+    def match(self, offer_id: str, **fields: str) -> list[str]:
+        """
+        Метод, возвращает метки, подходящие офферу, в порядке
+        словаря CUSTOM_LABEL.
+
+        fields - тексты полей оффера (name, url).
+        """
+        found = set(self.id_labels.get(offer_id, ()))
+        for field, text in fields.items():
+            found |= self.matchers[field].match(text)
+        return [self.labels[index] for index in sorted(found)]
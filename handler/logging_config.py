@@ -3,6 +3,8 @@ import os
 from datetime import datetime as dt
 from logging.handlers import RotatingFileHandler
 
+_configured = False
+
 
 def setup_logging():
     """
@@ -17,7 +19,13 @@ def setup_logging():
 
     Логи сохраняются в папку 'logs' с именем файла в формате ГГГГ-ММ-ДД.log.
     Автоматически создает папку логов, если она не существует.
+    Вызывается один раз при запуске (в main и в процессах конвейера),
+    повторные вызовы ничего не делают.
     """
+    global _configured
+    if _configured:
+        return
+    _configured = True
     log_dir = os.path.abspath(
         os.path.join(os.path.dirname(__file__), '..', 'logs')
     )
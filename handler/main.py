@@ -1,27 +1,98 @@
-from handler.xml_database import XMLDataBase
-from handler.xml_handler import XMLHandler
-from handler.xml_image import XMLImage
-from handler.xml_saver import XMLSaver
-from handler.feeds import FEEDS
-from handler.constants import CUSTOM_LABEL, UNAVAILABLE_OFFER_ID_LIST
+import argparse
+import sys
+
+from handler.constants import PIPELINE_QUEUE_SIZE, PIPELINE_STAGES
 from handler.decorators import time_of_function
+from handler.feeds import FEEDS
+from handler.logging_config import setup_logging
+from handler.pipeline import STAGES, Pipeline
+
+
+def stage_workers(value: str) -> tuple[str, int]:
+    """Разбирает значение вида этап=число для --workers."""
+    stage, _, workers = value.partition('=')
+    if stage not in STAGES or not workers.isdigit() or not int(workers):
+        raise argparse.ArgumentTypeError(
+            f'Ожидается этап=число, например report=2: {value}'
+        )
+    return stage, int(workers)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """
+    Разбирает аргументы командной строки.
+
+    Подкоманда run запускает этапы из --stages (по умолчанию
+    PIPELINE_STAGES), подкоманда с названием этапа - только его.
+    Без подкоманды выполняется run.
+    """
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument(
+        '--feeds', nargs='+', default=FEEDS, help='ссылки на фиды'
+    )
+    options.add_argument(
+        '--only-changed',
+        action='store_true',
+        help='пропускать фиды, не изменившиеся с прошлого запуска'
+    )
+    options.add_argument(
+        '--workers',
+        type=stage_workers,
+        action='append',
+        default=[],
+        metavar='STAGE=N',
+        help='число потоков (процессов) этапа'
+    )
+    options.add_argument(
+        '--queue-size',
+        type=int,
+        default=PIPELINE_QUEUE_SIZE,
+        help='размер очередей между этапами'
+    )
+    parser = argparse.ArgumentParser(description='Конвейер обработки фидов')
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser(
+        'run', parents=[options], help='запустить выбранные этапы'
+    )
+    run.add_argument(
+        '--stages',
+        default=','.join(PIPELINE_STAGES),
+        help=f'этапы через запятую из: {", ".join(STAGES)}'
+    )
+    for stage in STAGES:
+        commands.add_parser(
+            stage, parents=[options], help=f'выполнить только этап {stage}'
+        )
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in ('-h', '--help', *commands.choices):
+        argv.insert(0, 'run')
+    args = parser.parse_args(argv)
+    if args.command in STAGES:
+        args.stages = [args.command]
+    else:
+        args.stages = [stage for stage in args.stages.split(',') if stage]
+        unknown = set(args.stages) - set(STAGES)
+        if unknown:
+            parser.error(f'неизвестные этапы: {", ".join(sorted(unknown))}')
+    return args
 
 
 @time_of_function
-def main():
-    # saver = XMLSaver(FEEDS)
-    handler = XMLHandler()
-    db_client = XMLDataBase()
-    # image_client = XMLImage()
-    # saver.save_xml()
-    # handler.process_feeds(CUSTOM_LABEL, UNAVAILABLE_OFFER_ID_LIST)
-    data = handler.get_offers_report()
-    handler.save_to_json(data)
-    # handler.full_outer_join_feeds()
-    # handler.inner_join_feeds()
-    db_client.insert_data(data)
-    # image_client.get_images()
+def main(argv: list[str] | None = None) -> int:
+    """
+    Точка входа: настраивает логирование и запускает конвейер.
+    Модули этапов импортируются конвейером только для выбранных этапов.
+    """
+    setup_logging()
+    args = parse_args(argv)
+    return Pipeline(
+        args.stages,
+        feeds_list=args.feeds,
+        workers=dict(args.workers),
+        queue_size=args.queue_size,
+        only_changed=args.only_changed
+    ).run()
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
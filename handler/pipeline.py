@@ -0,0 +1,311 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from handler.constants import (
+    CUSTOM_LABEL,
+    FEEDS_FOLDER,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_WORKERS,
+    UNAVAILABLE_OFFER_ID_LIST
+)
+from handler.feeds import FEEDS
+from handler.logging_config import setup_logging
+
+
+FEED_STAGES = ('download', 'label', 'report', 'db', 'images')
+STAGES = (*FEED_STAGES, 'json')
+CPU_STAGES = ('label', 'report')
+_DONE = object()
+
+
+def label_feed_stage(
+    feed: str,
+    feeds_folder: str,
+    only_changed: bool
+) -> None:
+    """Размечает один фид (функция процесса-исполнителя)."""
+    from handler.xml_handler import XMLHandler
+    if not XMLHandler(
+        feeds_folder=feeds_folder, feeds_list=[feed]
+    ).process_feeds(
+        CUSTOM_LABEL,
+        UNAVAILABLE_OFFER_ID_LIST,
+        only_changed=only_changed,
+        max_workers=1
+    ):
+        raise RuntimeError(f'Фид {feed} не обработан')
+
+
+def report_feed_stage(
+    feed: str,
+    feeds_folder: str,
+    only_changed: bool
+) -> list[dict] | None:
+    """
+    Считает отчет по одному фиду (функция процесса-исполнителя).
+    Возвращает None, если фид не изменился и пропущен.
+    """
+    from handler.feed_manifest import FeedManifest
+    from handler.xml_handler import XMLHandler
+    if only_changed and not FeedManifest(feeds_folder).is_changed(
+        feed.split('/')[-1], 'offers_report'
+    ):
+        logging.info(f'Фид {feed} не изменился, отчет берется из кеша')
+        return None
+    return XMLHandler(
+        feeds_folder=feeds_folder, feeds_list=[feed]
+    ).get_offers_report(
+        only_changed=only_changed, max_workers=1
+    )
+
+
+class Pipeline:
+    """
+    Класс, предоставляющий конвейер обработки фидов.
+
+    Каждый фид проходит выбранные этапы из FEED_STAGES по порядку,
+    как только закончился предыдущий, поэтому разные фиды одновременно
+    находятся на разных этапах (отчет по одному фиду считается, пока
+    скачивается другой). Этапы связаны очередями ограниченного
+    размера, у каждого этапа свое число потоков; этапы label и report
+    выполняются в общем пуле процессов. Этап json сохраняет отчет
+    по всем фидам после завершения конвейера. Если report не выбран,
+    этапы db и json берут строки отчета из кеша, как и для фидов,
+    пропущенных этапом report при only_changed. Фид, на котором
+    этап завершился ошибкой, дальше не передается.
+
+    Модули этапов (numpy, Pillow, requests, mysql.connector)
+    импортируются только при запуске выбранных этапов.
+    """
+
+    def __init__(
+        self,
+        stages: list[str],
+        feeds_list: list[str] = FEEDS,
+        feeds_folder: str = FEEDS_FOLDER,
+        workers: dict[str, int] | None = None,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        only_changed: bool = False
+    ) -> None:
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f'Неизвестные этапы: {", ".join(unknown)}')
+        self.stages = [stage for stage in FEED_STAGES if stage in stages]
+        self.save_json = 'json' in stages
+        self.feeds_list = feeds_list
+        self.feeds_folder = feeds_folder
+        self.workers = {**PIPELINE_WORKERS, **(workers or {})}
+        self.queue_size = queue_size
+        self.only_changed = only_changed
+        self.failures: list[tuple[str, str, str]] = []
+        self._lock = threading.Lock()
+        self._saver = None
+        self._executor = None
+
+    def _download(self, item: dict) -> None:
+        """Защищенный метод, этап скачивания фида."""
+        if self._saver.save_feed(item['feed'])['failed']:
+            raise RuntimeError(f'Фид {item["feed"]} не скачан')
+
+    def _label(self, item: dict) -> None:
+        """Защищенный метод, этап разметки фида."""
+        self._executor.submit(
+            label_feed_stage,
+            item['feed'],
+            self.feeds_folder,
+            self.only_changed
+        ).result()
+
+    def _report(self, item: dict) -> None:
+        """Защищенный метод, этап расчета отчета."""
+        item['rows'] = self._executor.submit(
+            report_feed_stage,
+            item['feed'],
+            self.feeds_folder,
+            self.only_changed
+        ).result()
+
+    def _get_rows(self, item: dict) -> list[dict]:
+        """
+        Защищенный метод, возвращает строки отчета фида: посчитанные
+        на этапе report или, если фид не считался (этап не выбран
+        или фид не изменился), из кеша отчета.
+        """
+        if item.get('rows') is None:
+            from handler.xml_handler import XMLHandler
+            item['rows'] = XMLHandler(
+                feeds_folder=self.feeds_folder, feeds_list=[item['feed']]
+            ).replay_offers_report()
+        return item['rows']
+
+    def _db(self, item: dict) -> None:
+        """Защищенный метод, этап загрузки отчета в базу данных."""
+        from handler.xml_database import XMLDataBase
+        rows = self._get_rows(item)
+        if rows:
+            XMLDataBase().insert_data(rows)
+
+    def _images(self, item: dict) -> None:
+        """Защищенный метод, этап загрузки изображений."""
+        from handler.xml_image import XMLImage
+        XMLImage(
+            feeds_folder=self.feeds_folder, feeds_list=[item['feed']]
+        ).get_images(
+            only_changed=self.only_changed
+        )
+
+    def _stage_worker(
+        self,
+        stage: str,
+        inbox: queue.Queue,
+        outbox: queue.Queue,
+        state: dict
+    ) -> None:
+        """
+        Защищенный метод, поток этапа: берет фиды из inbox, выполняет
+        этап и передает их в outbox. Последний завершившийся поток
+        этапа передает дальше признаки окончания, даже если поток
+        завершился исключением, не перехваченным этапом
+        (KeyboardInterrupt, SystemExit), иначе конвейер ждал бы их
+        вечно.
+        """
+        handler = getattr(self, f'_{stage}')
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+                start_time = time.monotonic()
+                try:
+                    handler(item)
+                except Exception as e:
+                    logging.error(
+                        f'Этап {stage} для фида {item["feed"]} '
+                        f'завершился ошибкой: {e}',
+                        exc_info=True
+                    )
+                    with self._lock:
+                        self.failures.append((stage, item['feed'], str(e)))
+                    continue
+                except BaseException as e:
+                    with self._lock:
+                        self.failures.append(
+                            (stage, item['feed'], repr(e))
+                        )
+                    raise
+                logging.info(
+                    f'Этап {stage} для фида {item["feed"]} выполнен за '
+                    f'{round(time.monotonic() - start_time, 3)} сек.'
+                )
+                outbox.put(item)
+        finally:
+            with self._lock:
+                state['running'] -= 1
+                last = not state['running']
+            if last:
+                for _ in range(state['next_workers']):
+                    outbox.put(_DONE)
+
+    def _feed_items(self, inbox: queue.Queue, workers: int) -> None:
+        """Защищенный метод, подает фиды на первый этап."""
+        for feed in self.feeds_list:
+            inbox.put({'feed': feed, 'rows': None})
+        for _ in range(workers):
+            inbox.put(_DONE)
+
+    def run(self) -> int:
+        """
+        Метод, запускает конвейер и ждет его завершения.
+
+        Возвращает код завершения: 0, если все этапы для всех фидов
+        выполнены, иначе 1.
+        """
+        start_time = time.monotonic()
+        workers = [max(1, self.workers[stage]) for stage in self.stages]
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        queues.append(queue.Queue())
+        threads = []
+        if 'download' in self.stages:
+            from handler.xml_saver import XMLSaver
+            self._saver = XMLSaver(
+                self.feeds_list,
+                feeds_folder=self.feeds_folder,
+                max_workers=self.workers['download']
+            )
+        cpu_workers = sum(
+            workers[index] for index, stage in enumerate(self.stages)
+            if stage in CPU_STAGES
+        )
+        if cpu_workers:
+            # процессы запускаются из потоков этапов, поэтому
+            # без fork
+            self._executor = ProcessPoolExecutor(
+                max_workers=cpu_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_logging
+            )
+        try:
+            for index, stage in enumerate(self.stages):
+                state = {
+                    'running': workers[index],
+                    'next_workers': (
+                        workers[index + 1] if index + 1 < len(workers) else 1
+                    )
+                }
+                for _ in range(workers[index]):
+                    thread = threading.Thread(
+                        target=self._stage_worker,
+                        args=(stage, queues[index], queues[index + 1], state),
+                        daemon=True
+                    )
+                    thread.start()
+                    threads.append(thread)
+            feeder = threading.Thread(
+                target=self._feed_items,
+                args=(queues[0], workers[0] if workers else 1),
+                daemon=True
+            )
+            feeder.start()
+            items = []
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                items.append(item)
+            for thread in threads:
+                thread.join()
+            if self.save_json:
+                self._save_json(items)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            if self._saver is not None:
+                self._saver.session_pool.close()
+        logging.info(
+            f'Конвейер {", ".join(self.stages)} завершен за '
+            f'{round(time.monotonic() - start_time, 3)} сек.: '
+            f'фидов - {len(items)}, ошибок - {len(self.failures)}'
+        )
+        return 1 if self.failures else 0
+
+    def _save_json(self, items: list[dict]) -> None:
+        """
+        Защищенный метод, этап json: сохраняет отчет по фидам
+        в порядке списка фидов.
+        """
+        order = {feed: index for index, feed in enumerate(self.feeds_list)}
+        rows = []
+        try:
+            from handler.xml_handler import XMLHandler
+            for item in sorted(items, key=lambda item: order[item['feed']]):
+                rows.extend(self._get_rows(item))
+            XMLHandler(
+                feeds_folder=self.feeds_folder, feeds_list=self.feeds_list
+            ).save_to_json(rows)
+        except Exception as e:
+            logging.error(f'Этап json завершился ошибкой: {e}', exc_info=True)
+            self.failures.append(('json', '', str(e)))
@@ -0,0 +1,254 @@
+import numpy as np
+
+from handler.constants import (
+    LOWER_OUTLIER_PERCENTILE,
+    SKETCH_COMPRESSION,
+    UPPER_OUTLIER_PERCENTILE
+)
+from handler.utils import _lerp, _outlier_bounds, percentile_key
+
+STATS_MODES = ('exact', 'sketch')
+
+
+class QuantileSketch:
+    """
+    Класс, предоставляющий объединяемый эскиз распределения цен.
+
+    Эскиз хранит отсортированные центроиды (значение и вес), а также
+    точные count, sum, min и max. Пока различных цен не больше
+    compression, центроиды - это сами цены с числом повторов,
+    и квантили совпадают с np.quantile (method='linear'). Иначе
+    соседние центроиды сливаются по шкале t-digest (k1): на хвостах
+    центроиды мельче, в середине крупнее, ошибка ранга ограничена
+    весом центроида, а квантили интерполируются между центрами
+    центроидов. Эскизы объединяются без исходных цен.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        weights: np.ndarray,
+        total: int = 0,
+        low=None,
+        high=None,
+        compression: int = SKETCH_COMPRESSION,
+        exact: bool = True
+    ) -> None:
+        self.values = values
+        self.weights = weights
+        self.count = int(weights.sum())
+        self.total = total
+        self.low = low
+        self.high = high
+        self.compression = compression
+        self.exact = exact
+
+    @classmethod
+    def from_prices(
+        cls,
+        prices,
+        compression: int = SKETCH_COMPRESSION
+    ) -> 'QuantileSketch':
+        """Метод, строит эскиз по списку цен."""
+        prices = np.asarray(prices, dtype=np.int64)
+        if not prices.size:
+            return cls(
+                np.zeros(0),
+                np.zeros(0, dtype=np.int64),
+                compression=compression
+            )
+        values, weights = np.unique(prices, return_counts=True)
+        return cls._compressed(
+            values.astype(np.float64),
+            weights,
+            int(prices.sum()),
+            int(values[0]),
+            int(values[-1]),
+            compression
+        )
+
+    @classmethod
+    def merge(
+        cls,
+        sketches: list['QuantileSketch'],
+        compression: int = SKETCH_COMPRESSION
+    ) -> 'QuantileSketch':
+        """Метод, объединяет эскизы в один."""
+        sketches = [sketch for sketch in sketches if sketch.count]
+        if not sketches:
+            return cls.from_prices([], compression)
+        if len(sketches) == 1 and sketches[0].compression == compression:
+            return sketches[0]
+        values, inverse = np.unique(
+            np.concatenate([sketch.values for sketch in sketches]),
+            return_inverse=True
+        )
+        weights = np.bincount(
+            inverse,
+            weights=np.concatenate([sketch.weights for sketch in sketches]),
+            minlength=values.size
+        ).astype(np.int64)
+        return cls._compressed(
+            values,
+            weights,
+            sum(sketch.total for sketch in sketches),
+            min(sketch.low for sketch in sketches),
+            max(sketch.high for sketch in sketches),
+            compression,
+            all(sketch.exact for sketch in sketches)
+        )
+
+    @classmethod
+    def _compressed(
+        cls,
+        values: np.ndarray,
+        weights: np.ndarray,
+        total: int,
+        low: int,
+        high: int,
+        compression: int,
+        exact: bool = True
+    ) -> 'QuantileSketch':
+        """
+        Защищенный метод, сливает соседние центроиды, если их больше
+        compression: центроиды с одинаковым целым значением шкалы
+        k1(q) = compression / (2 * pi) * asin(2q - 1) объединяются.
+        Если ни один центроид не объединил разные значения, эскиз
+        остается точным.
+        """
+        if values.size > compression:
+            count = weights.sum()
+            centers = (np.cumsum(weights) - weights / 2) / count
+            scale = compression / (2 * np.pi) * np.arcsin(2 * centers - 1)
+            groups = np.floor(scale - scale[0]).astype(np.intp)
+            starts = np.flatnonzero(np.diff(groups, prepend=-1))
+            if starts.size < values.size:
+                merged = np.add.reduceat(weights, starts)
+                values = np.add.reduceat(values * weights, starts) / merged
+                weights = merged
+                exact = False
+        return cls(values, weights, total, low, high, compression, exact)
+
+    def quantiles(self, quantiles) -> np.ndarray:
+        """
+        Метод, возвращает квантили (доли от 0 до 1) по формуле
+        np.quantile (method='linear'). Пока каждый центроид - одно
+        значение цены (в том числе для небольших групп), результат
+        совпадает с np.quantile, например медиана нечетного числа
+        цен - одна из цен. В сжатом эскизе значение интерполируется
+        между центрами соседних центроидов, а края распределения -
+        до точных min и max.
+        """
+        quantiles = np.asarray(quantiles, dtype=np.float64)
+        if not self.count:
+            return np.zeros(quantiles.size)
+        virtual_index = (self.count - 1) * quantiles
+        ends = np.cumsum(self.weights)
+        if not self.exact:
+            centers = ends - (self.weights + 1) / 2
+            return np.interp(
+                virtual_index,
+                np.concatenate(([0], centers, [self.count - 1])),
+                np.concatenate(([self.low], self.values, [self.high]))
+            )
+        previous_index = np.floor(virtual_index)
+        next_index = np.minimum(previous_index + 1, self.count - 1)
+        return _lerp(
+            self.values[np.searchsorted(ends, previous_index, 'right')],
+            self.values[np.searchsorted(ends, next_index, 'right')],
+            virtual_index - previous_index
+        )
+
+    def clear_bounds(self, lower: float, upper: float) -> tuple[int, int]:
+        """
+        Метод, возвращает наименьшую и наибольшую цены в границах
+        [lower, upper] (границы без выбросов). Если граница не отсекает
+        ни одной цены, возвращается точный min или max.
+        """
+        first = np.searchsorted(self.values, lower, 'left')
+        last = np.searchsorted(self.values, upper, 'right') - 1
+        return (
+            self.low if lower <= self.low else min(
+                max(int(np.rint(self.values[first])), self.low), self.high
+            ),
+            self.high if upper >= self.high else min(
+                max(int(np.rint(self.values[last])), self.low), self.high
+            )
+        )
+
+    def to_dict(self) -> dict:
+        """Метод, возвращает эскиз в виде словаря для json."""
+        return {
+            'values': self.values.tolist(),
+            'weights': self.weights.tolist(),
+            'total': self.total,
+            'low': self.low,
+            'high': self.high,
+            'compression': self.compression,
+            'exact': self.exact
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'QuantileSketch':
+        """Метод, восстанавливает эскиз из словаря to_dict."""
+        return cls(
+            np.asarray(data['values'], dtype=np.float64),
+            np.asarray(data['weights'], dtype=np.int64),
+            data['total'],
+            data['low'],
+            data['high'],
+            data['compression'],
+            data['exact']
+        )
+
+
+def sketch_price_stats(
+    sketches: list[QuantileSketch],
+    percentiles=()
+) -> dict[str, np.ndarray]:
+    """
+    Расчет статистики цен по эскизам групп.
+
+    Возвращает те же ключи, что group_price_stats, в тех же типах:
+    count, sum, min, max, mean, median, q1, q3, clear_min, clear_max
+    и перцентили из percentiles с ключами вида p90. Для пустых групп
+    все значения, кроме count, равны 0.
+    """
+    quantiles = [
+        LOWER_OUTLIER_PERCENTILE, 0.5, UPPER_OUTLIER_PERCENTILE,
+        *percentiles
+    ]
+    size = len(sketches)
+    stats = {
+        'count': np.zeros(size, dtype=np.int64),
+        'sum': np.zeros(size, dtype=np.int64),
+        'min': np.zeros(size, dtype=np.int64),
+        'max': np.zeros(size, dtype=np.int64),
+        'mean': np.zeros(size),
+        'median': np.zeros(size),
+        'q1': np.zeros(size),
+        'q3': np.zeros(size),
+        'clear_min': np.zeros(size, dtype=np.int64),
+        'clear_max': np.zeros(size, dtype=np.int64)
+    }
+    keys = ['q1', 'median', 'q3']
+    for quantile in percentiles:
+        keys.append(percentile_key(quantile))
+        stats[keys[-1]] = np.zeros(size)
+    for index, sketch in enumerate(sketches):
+        if not sketch.count:
+            continue
+        stats['count'][index] = sketch.count
+        stats['sum'][index] = sketch.total
+        stats['min'][index] = sketch.low
+        stats['max'][index] = sketch.high
+        stats['mean'][index] = sketch.total / sketch.count
+        for key, value in zip(keys, sketch.quantiles(quantiles)):
+            stats[key][index] = value
+        lower, upper = _outlier_bounds(
+            stats['q1'][index], stats['q3'][index]
+        )
+        stats['clear_min'][index], stats['clear_max'][index] = (
+            sketch.clear_bounds(lower, upper)
+        )
+    return stats
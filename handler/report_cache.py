@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from handler.constants import (
+    REPORT_CACHE_FOLDER,
+    REPORT_CACHE_MAX_AGE,
+    REPORT_CACHE_MAX_SIZE
+)
+from handler.file_utils import temp_path_for
+
+
+class ReportCache:
+    """
+    Класс, предоставляющий постоянный кеш строк отчета по фидам.
+
+    Строки одного фида хранятся в json-файле, имя которого - sha256
+    от названия фида, хеша его содержимого, даты отчета и версии
+    настроек статистики. Попадание в кеш обновляет время изменения
+    файла, а evict удаляет записи старше max_age секунд и самые
+    давние записи сверх max_size байт.
+    """
+
+    def __init__(
+        self,
+        folder: str = REPORT_CACHE_FOLDER,
+        max_age: int = REPORT_CACHE_MAX_AGE,
+        max_size: int = REPORT_CACHE_MAX_SIZE
+    ) -> None:
+        self.path = Path(__file__).parent.parent / folder
+        self.max_age = max_age
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(
+        file_name: str,
+        content_hash: str,
+        date_str: str,
+        config: dict
+    ) -> str:
+        """Метод, возвращает ключ записи кеша."""
+        payload = json.dumps(
+            [file_name, content_hash, date_str, config], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        """Защищенный метод, возвращает путь к файлу записи."""
+        return self.path / f'{key}.json'
+
+    def get(self, key: str) -> list[dict] | None:
+        """Метод, возвращает строки записи или None, если ее нет."""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, encoding='utf-8') as f:
+                rows = json.load(f)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f'Запись кеша {entry_path} не прочитана: {e}')
+            return None
+        return rows
+
+    def put(self, key: str, rows: list[dict]) -> None:
+        """Метод, атомарно записывает строки в кеш."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(key)
+        temp_path = temp_path_for(entry_path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(temp_path, entry_path)
+
+    def evict(self) -> int:
+        """
+        Метод, удаляет устаревшие записи и самые давние записи сверх
+        лимита размера. Возвращает число удаленных записей.
+        """
+        if not self.path.is_dir():
+            return 0
+        entries = []
+        for entry_path in self.path.glob('*.json'):
+            try:
+                entry_stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append(
+                (entry_stat.st_mtime, entry_stat.st_size, entry_path)
+            )
+        entries.sort(reverse=True)
+        now = time.time()
+        total_size = 0
+        removed = 0
+        for modified_at, size, entry_path in entries:
+            if (
+                now - modified_at > self.max_age
+                or total_size + size > self.max_size
+            ):
+                entry_path.unlink(missing_ok=True)
+                removed += 1
+                continue
+            total_size += size
+        if removed:
+            logging.info(f'Из кеша отчета удалено записей: {removed}')
+        return removed
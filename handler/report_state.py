@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+from handler.constants import NAME_OF_SHOP, REPORT_STATE_FOLDER
+from handler.file_utils import temp_path_for
+
+
+class ReportState:
+    """
+    Класс, предоставляющий сохраненную статистику категорий
+    из последней загрузки отчета в базу.
+
+    Состояние хранится в json-файле offers_report_state_<магазин>.json
+    в папке REPORT_STATE_FOLDER: для каждого фида - дата последней
+    загрузки (dates) и для каждой категории - строка отчета без даты
+    (feeds). По нему из нового отчета отбираются только новые
+    и изменившиеся строки, а неизменные переносятся в базе с даты
+    последней загрузки (см. XMLDataBase.insert_changed_data).
+    """
+
+    def __init__(
+        self,
+        shop_name: str = NAME_OF_SHOP,
+        folder: str = REPORT_STATE_FOLDER
+    ) -> None:
+        self.path = (
+            Path(__file__).parent.parent / folder
+            / f'offers_report_state_{shop_name}.json'
+        )
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        """
+        Защищенный метод, читает состояние с диска. В состоянии
+        старого формата (без дат) статистика фидов сохраняется,
+        а дата последней загрузки считается неизвестной.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            logging.warning(f'Состояние отчета {self.path} не прочитано: {e}')
+            data = {}
+        if 'feeds' not in data:
+            data = {'dates': {}, 'feeds': data}
+        return data
+
+    def last_date(self, feed_name: str) -> str | None:
+        """
+        Метод, возвращает дату последней загрузки фида или None,
+        если она неизвестна.
+        """
+        return self._data['dates'].get(feed_name)
+
+    def dated_feeds(self) -> list[str]:
+        """Метод, возвращает фиды с известной датой последней загрузки."""
+        return list(self._data['dates'])
+
+    def set_date(self, feed_name: str, date: str) -> None:
+        """
+        Метод, запоминает дату, на которую строки фида перенесены
+        без изменения статистики.
+        """
+        self._data['dates'][feed_name] = date
+
+    @staticmethod
+    def _stats(row: dict) -> dict:
+        """Защищенный метод, возвращает строку отчета без даты."""
+        return {key: value for key, value in row.items() if key != 'date'}
+
+    def diff(self, rows: list[dict]) -> tuple[list[dict], dict]:
+        """
+        Метод, сравнивает строки отчета с сохраненными.
+
+        Возвращает новые и изменившиеся строки и сводку: число новых,
+        измененных и неизменных строк, а также число категорий,
+        пропавших из фидов, которые есть в rows (см. removed).
+        """
+        changed = []
+        summary = {'new': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+        feeds = self._data['feeds']
+        for row in rows:
+            category_id = str(row['category_id'])
+            previous = feeds.get(row['feed_name'], {}).get(category_id)
+            if previous is None:
+                summary['new'] += 1
+            elif previous != self._stats(row):
+                summary['changed'] += 1
+            else:
+                summary['unchanged'] += 1
+                continue
+            changed.append(row)
+        summary['removed'] = sum(
+            len(category_ids) for category_ids in self.removed(rows).values()
+        )
+        return changed, summary
+
+    def removed(self, rows: list[dict]) -> dict[str, list[str]]:
+        """
+        Метод, возвращает для фидов из rows категории, которые были
+        в сохраненной статистике, но пропали из новых строк.
+        """
+        seen = {}
+        for row in rows:
+            seen.setdefault(row['feed_name'], set()).add(
+                str(row['category_id'])
+            )
+        return {
+            feed_name: sorted(
+                self._data['feeds'].get(feed_name, {}).keys() - category_ids
+            )
+            for feed_name, category_ids in seen.items()
+        }
+
+    def update(self, rows: list[dict]) -> None:
+        """
+        Метод, заменяет сохраненную статистику фидов из rows
+        их новыми строками и запоминает дату загрузки. Остальные
+        фиды не меняются.
+        """
+        feeds = {}
+        for row in rows:
+            feeds.setdefault(row['feed_name'], {})[
+                str(row['category_id'])
+            ] = self._stats(row)
+            self._data['dates'][row['feed_name']] = str(row['date'])
+        self._data['feeds'].update(feeds)
+
+    def save(self) -> None:
+        """Метод, атомарно записывает состояние на диск."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = temp_path_for(self.path)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
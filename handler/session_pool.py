@@ -0,0 +1,86 @@
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool:
+    """
+    Класс, предоставляющий общий пул keep-alive сессий по хостам.
+
+    Для каждого хоста создается одна сессия requests с пулом соединений
+    размера pool_size, которую разделяют все потоки. Хосты, ответившие
+    401, запоминаются, и последующие запросы к ним сразу
+    отправляются с авторизацией.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        auth: tuple[str, str] | None = None
+    ) -> None:
+        self.pool_size = pool_size
+        self.auth = auth if auth and all(auth) else None
+        self._sessions: dict[str, requests.Session] = {}
+        self._auth_hosts: set[str] = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _get_host(url: str) -> str:
+        """Защищенный метод, возвращает схему и хост ссылки."""
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    def _get_session(self, host: str) -> requests.Session:
+        """Защищенный метод, возвращает сессию хоста, создавая ее."""
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size
+                )
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Метод, выполняет GET-запрос через сессию хоста.
+
+        При ответе 401 повторяет запрос с авторизацией
+        и запоминает, что хосту она нужна.
+        """
+        host = self._get_host(url)
+        session = self._get_session(host)
+        use_auth = self.auth is not None and host in self._auth_hosts
+        response = session.get(
+            url, auth=self.auth if use_auth else None, **kwargs
+        )
+        if (
+            response.status_code == requests.codes.unauthorized
+            and self.auth is not None
+            and not use_auth
+        ):
+            response.close()
+            with self._lock:
+                self._auth_hosts.add(host)
+            logging.info(f'Хост {host} требует авторизации')
+            response = session.get(url, auth=self.auth, **kwargs)
+        return response
+
+    def close(self) -> None:
+        """Метод, закрывает все сессии пула."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
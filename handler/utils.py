@@ -6,23 +6,150 @@ from handler.constants import (
 )
 
 
+def _lerp(low, high, weight):
+    """
+    Линейная интерполяция между соседними значениями.
+
+    Повторяет формулу np.quantile (method='linear'), чтобы результаты
+    пакетного расчета совпадали с поэлементным.
+    """
+    diff = high - low
+    result = low + diff * weight
+    upper_half = weight >= 0.5
+    result[upper_half] = (
+        high[upper_half] - diff[upper_half] * (1 - weight[upper_half])
+    )
+    return result
+
+
+def _segment_quantile(sorted_prices, starts, counts, quantile):
+    """Квантиль каждого непустого отрезка отсортированного массива."""
+    virtual_index = (counts - 1) * quantile
+    previous_index = np.floor(virtual_index).astype(np.intp)
+    next_index = np.minimum(previous_index + 1, counts - 1)
+    weight = virtual_index - previous_index
+    return _lerp(
+        sorted_prices[starts + previous_index],
+        sorted_prices[starts + next_index],
+        weight
+    )
+
+
+def _outlier_bounds(q1, q3):
+    """Границы выбросов по межквартильному размаху."""
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+
+def percentile_key(quantile: float) -> str:
+    """Ключ перцентиля в словаре статистики, например p90."""
+    return f'p{quantile * 100:g}'
+
+
+def group_price_stats(
+    prices,
+    codes,
+    n_groups: int | None = None,
+    percentiles=()
+) -> dict[str, np.ndarray]:
+    """
+    Пакетный расчет статистики цен по группам.
+
+    Принимает плоский массив цен и массив кодов групп (целые от 0
+    до n_groups - 1) и за одну сортировку считает для всех групп:
+    count, sum, min, max, mean, median, q1, q3, clear_min, clear_max
+    (границы без выбросов по IQR), а также значения дополнительных
+    перцентилей из percentiles (доли от 0 до 1) с ключами вида p90.
+    Для пустых групп все значения, кроме count, равны 0.
+    """
+    prices = np.asarray(prices)
+    codes = np.asarray(codes, dtype=np.intp)
+    if n_groups is None:
+        n_groups = int(codes.max()) + 1 if codes.size else 0
+
+    order = np.lexsort((prices, codes))
+    sorted_prices = prices[order]
+    sorted_codes = codes[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+
+    present = counts > 0
+    p_starts = starts[present]
+    p_counts = counts[present]
+    p_ends = ends[present]
+
+    def full(values, dtype):
+        column = np.zeros(n_groups, dtype=dtype)
+        column[present] = values
+        return column
+
+    stats = {'count': counts}
+    stats['min'] = full(sorted_prices[p_starts], prices.dtype)
+    stats['max'] = full(sorted_prices[p_ends - 1], prices.dtype)
+    sums = (
+        np.add.reduceat(sorted_prices, p_starts)
+        if p_starts.size else np.zeros(0, dtype=prices.dtype)
+    )
+    stats['sum'] = full(sums, sums.dtype)
+    stats['mean'] = full(sums / p_counts, np.float64)
+
+    q1 = _segment_quantile(
+        sorted_prices, p_starts, p_counts, LOWER_OUTLIER_PERCENTILE
+    )
+    q3 = _segment_quantile(
+        sorted_prices, p_starts, p_counts, UPPER_OUTLIER_PERCENTILE
+    )
+    stats['q1'] = full(q1, np.float64)
+    stats['q3'] = full(q3, np.float64)
+    stats['median'] = full(
+        _segment_quantile(sorted_prices, p_starts, p_counts, 0.5),
+        np.float64
+    )
+    for quantile in percentiles:
+        stats[percentile_key(quantile)] = full(
+            _segment_quantile(sorted_prices, p_starts, p_counts, quantile),
+            np.float64
+        )
+
+    lower, upper = _outlier_bounds(stats['q1'], stats['q3'])
+    below = np.bincount(
+        sorted_codes[sorted_prices < lower[sorted_codes]],
+        minlength=n_groups
+    )
+    above = np.bincount(
+        sorted_codes[sorted_prices > upper[sorted_codes]],
+        minlength=n_groups
+    )
+    stats['clear_min'] = full(
+        sorted_prices[p_starts + below[present]], prices.dtype
+    )
+    stats['clear_max'] = full(
+        sorted_prices[p_ends - 1 - above[present]], prices.dtype
+    )
+    return stats
+
+
+def _single_group_stats(data) -> tuple[np.ndarray, dict]:
+    """Статистика по одному набору цен."""
+    array = np.asarray(data)
+    if not array.size:
+        raise ValueError('Передан пустой набор цен.')
+    return array, group_price_stats(array, np.zeros(array.size, np.intp))
+
+
 def calc_quantile(data):
-    array = np.array(data)
-    Q1 = np.quantile(array, LOWER_OUTLIER_PERCENTILE)
-    Q3 = np.quantile(array, UPPER_OUTLIER_PERCENTILE)
-    IQR = Q3 - Q1
-    upper_outlier_threshold = Q3 + 1.5 * IQR
-    lower_outlier_threshold = Q1 - 1.5 * IQR
-    filtered_data = array[(array >= lower_outlier_threshold) &
-                          (array <= upper_outlier_threshold)]
+    array, stats = _single_group_stats(data)
+    lower, upper = _outlier_bounds(stats['q1'][0], stats['q3'][0])
+    filtered_data = array[(array >= lower) & (array <= upper)]
     return filtered_data.tolist()
 
 
 def clear_min(data):
-    filtered_data = calc_quantile(data)
-    return min(filtered_data)
+    _, stats = _single_group_stats(data)
+    return stats['clear_min'][0].item()
 
 
 def clear_max(data):
-    filtered_data = calc_quantile(data)
-    return max(filtered_data)
+    _, stats = _single_group_stats(data)
+    return stats['clear_max'][0].item()
@@ -1,11 +1,34 @@
+import csv
 import logging
+import os
+import tempfile
+import time
+from datetime import datetime as dt
+from datetime import timedelta
+from pathlib import Path
 
-from handler.constants import CREATE_LOGS_TABLE, NAME_OF_SHOP, INSERT_LOGS
+from handler.constants import (
+    CARRY_FORWARD_LOGS,
+    CREATE_LOGS_TABLE,
+    CREATE_STAGING_TABLE,
+    DB_INSERT_BATCH_SIZE,
+    DB_LOAD_LOCAL_INFILE,
+    DELETE_LOGS_CATEGORIES,
+    DROP_STAGING_TABLE,
+    INSERT_LOGS,
+    INSERT_LOGS_BATCH,
+    INSERT_LOGS_ROW,
+    LOAD_LOGS_INFILE,
+    NAME_OF_SHOP,
+    REPORT_COLUMNS,
+    UPSERT_LOGS_FROM_STAGING
+)
 from handler.decorators import connection_db
 from handler.exceptions import TableNameError
-from handler.logging_config import setup_logging
+from handler.report_state import ReportState
 
-setup_logging()
+
+_known_tables: set[str] = set()
 
 
 class XMLDataBase:
@@ -28,14 +51,21 @@ class XMLDataBase:
         """
         Защищенный метод, создает таблицу в базе данных, если ее не существует.
         Если таблица есть в базе данных - возварщает ее имя.
+        Найденные и созданные таблицы запоминаются на время работы
+        процесса, повторно база не опрашивается.
         """
         table_name = f'test_report_offers_{self.shop_name}'
+        if table_name in _known_tables:
+            return table_name
         if table_name in self._allowed_tables():
             logging.info(f'Таблица {table_name} найдена в базе')
-            return table_name
-        create_table_query = CREATE_LOGS_TABLE.format(table_name=table_name)
-        cursor.execute(create_table_query)
-        logging.info(f'Таблица {table_name} успешно создана')
+        else:
+            create_table_query = CREATE_LOGS_TABLE.format(
+                table_name=table_name
+            )
+            cursor.execute(create_table_query)
+            logging.info(f'Таблица {table_name} успешно создана')
+        _known_tables.add(table_name)
         return table_name
 
     @connection_db
@@ -43,27 +73,216 @@ class XMLDataBase:
         """Метод наполняет данными таблицу базы данных."""
         table_name = self._create_table_if_not_exists()
         query = INSERT_LOGS.format(table_name=table_name)
-        params = [
-            (
-                item['date'],
-                item['feed_name'],
-                item['category_id'],
-                item['parent_id'],
-                item['count_offers'],
-                item['min_price'],
-                item['clear_min_price'],
-                item['max_price'],
-                item['clear_max_price'],
-                item['avg_price'],
-                item['median_price']
-            ) for item in data
-        ]
+        params = self._report_params(data)
         if isinstance(params, list):
             cursor.executemany(query, params)
         else:
             cursor.execute(query, params)
         logging.info('✅ Данные успешно сохранены!')
 
+    @staticmethod
+    def _report_params(data) -> list[tuple]:
+        """
+        Защищенный метод, возвращает строки отчета как кортежи
+        значений в порядке REPORT_COLUMNS.
+        """
+        return [
+            tuple(item[column] for column in REPORT_COLUMNS) for item in data
+        ]
+
+    @connection_db
+    def _insert_batch(
+        self,
+        table_name: str,
+        params: list[tuple],
+        cursor=None
+    ) -> None:
+        """
+        Защищенный метод, вставляет порцию строк одним многострочным
+        INSERT ... ON DUPLICATE KEY UPDATE.
+        """
+        query = INSERT_LOGS_BATCH.format(
+            table_name=table_name,
+            values=', '.join([INSERT_LOGS_ROW] * len(params))
+        )
+        cursor.execute(query, [value for row in params for value in row])
+
+    @connection_db
+    def _load_infile(
+        self,
+        table_name: str,
+        params: list[tuple],
+        cursor=None
+    ) -> None:
+        """
+        Защищенный метод, загружает строки через временный CSV:
+        LOAD DATA LOCAL INFILE во временную таблицу соединения,
+        затем одним запросом INSERT ... SELECT ... ON DUPLICATE KEY
+        UPDATE в основную таблицу.
+        """
+        staging_table = f'{table_name}_staging'
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8', newline='', delete=False
+        ) as csv_file:
+            writer = csv.writer(csv_file, lineterminator='\n')
+            for row in params:
+                writer.writerow([
+                    '\\N' if value is None
+                    else str(value).replace('\\', '\\\\')
+                    for value in row
+                ])
+        try:
+            cursor.execute(DROP_STAGING_TABLE.format(
+                staging_table=staging_table
+            ))
+            cursor.execute(CREATE_STAGING_TABLE.format(
+                staging_table=staging_table, table_name=table_name
+            ))
+            cursor.execute(LOAD_LOGS_INFILE.format(
+                file_path=Path(csv_file.name).as_posix(),
+                staging_table=staging_table
+            ))
+            cursor.execute(UPSERT_LOGS_FROM_STAGING.format(
+                table_name=table_name, staging_table=staging_table
+            ))
+            cursor.execute(DROP_STAGING_TABLE.format(
+                staging_table=staging_table
+            ))
+        finally:
+            os.unlink(csv_file.name)
+
+    def bulk_insert_data(
+        self,
+        data,
+        batch_size: int = DB_INSERT_BATCH_SIZE,
+        local_infile: bool = DB_LOAD_LOCAL_INFILE
+    ) -> int:
+        """
+        Метод наполняет таблицу базы данных большими объемами данных.
+
+        Строки вставляются многострочными INSERT по batch_size строк,
+        каждая порция фиксируется отдельной транзакцией, поэтому
+        блокировки не держатся на время всей загрузки. При
+        local_infile=True строки загружаются через LOAD DATA LOCAL
+        INFILE и промежуточную таблицу. Скорость загрузки (строк
+        в секунду) пишется в лог. Возвращает число загруженных строк.
+        """
+        start_time = time.monotonic()
+        table_name = self._create_table_if_not_exists()
+        params = self._report_params(data)
+        if local_infile:
+            self._load_infile(table_name, params)
+        else:
+            for start in range(0, len(params), batch_size):
+                self._insert_batch(
+                    table_name, params[start:start + batch_size]
+                )
+        execution_time = time.monotonic() - start_time
+        rows_per_second = (
+            round(len(params) / execution_time) if execution_time else 0
+        )
+        logging.info(
+            f'✅ Загружено строк: {len(params)} за '
+            f'{round(execution_time, 3)} сек. ({rows_per_second} строк/сек.)'
+        )
+        return len(params)
+
+    @connection_db
+    def _upload_changes(
+        self,
+        rows: list[dict],
+        carry_forward: list[tuple[str, str, str]],
+        removed: list[tuple[str, str, list[str]]],
+        cursor=None
+    ) -> None:
+        """
+        Защищенный метод, одной транзакцией переносит строки фидов
+        с прошлой даты на новую (carry_forward - кортежи (новая дата,
+        прошлая дата, фид)), удаляет на новую дату пропавшие категории
+        (removed - кортежи (дата, фид, id категорий)) и загружает
+        новые и изменившиеся строки rows.
+        """
+        table_name = self._create_table_if_not_exists()
+        for date, previous_date, feed_name in carry_forward:
+            cursor.execute(
+                CARRY_FORWARD_LOGS.format(table_name=table_name),
+                (date, previous_date, feed_name)
+            )
+        for date, feed_name, category_ids in removed:
+            cursor.execute(
+                DELETE_LOGS_CATEGORIES.format(
+                    table_name=table_name,
+                    placeholders=', '.join(['%s'] * len(category_ids))
+                ),
+                (date, feed_name, *category_ids)
+            )
+        if rows:
+            self.insert_data(rows)
+
+    def insert_changed_data(
+        self,
+        data,
+        state: ReportState | None = None
+    ) -> dict:
+        """
+        Метод загружает в базу только новые и изменившиеся строки.
+
+        Строки сравниваются со статистикой из state (по умолчанию -
+        состояние текущего магазина). Чтобы у каждой даты были строки
+        всех категорий, неизменные строки фида переносятся в базе
+        одним INSERT ... SELECT с даты его последней загрузки,
+        а категории, пропавшие из фида, на новую дату не попадают.
+        Фиды из state, которых нет в data (например, пропущенные
+        при only_changed), тоже переносятся на дату отчета, если
+        их последняя загрузка была раньше. Если дата последней
+        загрузки фида неизвестна, его строки загружаются целиком.
+        Состояние сохраняется только после успешной загрузки.
+        Возвращает сводку изменений.
+        """
+        state = state or ReportState(self.shop_name)
+        changed, summary = state.diff(data)
+        logging.info(
+            f'Изменения отчета: новых строк - {summary["new"]}, '
+            f'измененных - {summary["changed"]}, '
+            f'без изменений - {summary["unchanged"]}, '
+            f'пропавших категорий - {summary["removed"]}'
+        )
+        report_date = (dt.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        dates = {
+            feed_name: report_date for feed_name in state.dated_feeds()
+            if state.last_date(feed_name) < report_date
+        }
+        dates.update(
+            (row['feed_name'], str(row['date'])) for row in data
+        )
+        full_feeds = {
+            feed_name for feed_name in dates
+            if state.last_date(feed_name) is None
+        }
+        rows = [
+            row for row in data if row['feed_name'] in full_feeds
+        ] + [
+            row for row in changed if row['feed_name'] not in full_feeds
+        ]
+        carry_forward = [
+            (date, state.last_date(feed_name), feed_name)
+            for feed_name, date in dates.items()
+            if feed_name not in full_feeds
+            and state.last_date(feed_name) != date
+        ]
+        removed = [
+            (dates[feed_name], feed_name, category_ids)
+            for feed_name, category_ids in state.removed(data).items()
+            if category_ids and feed_name not in full_feeds
+        ]
+        if rows or carry_forward or removed:
+            self._upload_changes(rows, carry_forward, removed)
+        for date, _, feed_name in carry_forward:
+            state.set_date(feed_name, date)
+        state.update(data)
+        state.save()
+        return summary
+
     @connection_db
     def clean_db(self, cursor=None, **tables: bool) -> None:
         """
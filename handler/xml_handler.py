@@ -1,22 +1,70 @@
 import json
 import logging
+import mmap
 import os
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime as dt, timedelta
 from pathlib import Path
 from collections import defaultdict
-from statistics import median
+from itertools import chain
+from pyexpat import ExpatError
+from handler.category_tree import CategoryTree
 from handler.constants import (
+    ALL_REGIONS_FEED_NAME,
     DECIMAL_ROUNDING,
+    EXTRA_PERCENTILES,
+    FEED_PARSE_CHUNK_SIZE,
+    FEED_PARSE_WORKERS,
+    FEED_OUTPUT_COMPRESS,
+    FEED_OUTPUT_DECLARATION,
+    FEED_OUTPUT_PRETTY,
+    FEED_PARSER,
     FEEDS_FOLDER,
-    PARSE_FEEDS_FOLDER
+    JOIN_CONFLICT_POLICY,
+    LOWER_OUTLIER_PERCENTILE,
+    PARALLEL_PARSE_MIN_SIZE,
+    PARSE_FEEDS_FOLDER,
+    PROCESS_FEEDS_WORKERS,
+    PROCESS_SHARD_MIN_SIZE,
+    PROCESS_SHARD_SIZE,
+    REPORT_CACHE_VERSION,
+    REPORT_STATS_MODE,
+    SKETCH_COMPRESSION,
+    STATS_BATCH_SIZE,
+    UPPER_OUTLIER_PERCENTILE,
+    USE_REPORT_CACHE,
+    USE_FEED_SNAPSHOTS
 )
 from handler.decorators import time_of_function
+from handler.feed_chunks import (
+    parse_feed_parallel,
+    shard_context,
+    split_offers
+)
+from handler.feed_columns import file_hash
+from handler.feed_index import FeedIndex
+from handler.feed_join import FeedJoiner
+from handler.feed_labeler import (
+    init_worker,
+    label_feed,
+    label_offer,
+    label_shard,
+    stream_label_feed
+)
+from handler.feed_manifest import FeedManifest
+from handler.feed_parsers import FEED_PARSERS, element_records, expat_records
+from handler.feed_snapshot import FeedSnapshot, group_category_prices
 from handler.feeds import FEEDS
-from handler.logging_config import setup_logging
-from handler.utils import clear_max, clear_min
-
-setup_logging()
+from handler.label_rules import LabelRules
+from handler.quantile_sketch import (
+    STATS_MODES,
+    QuantileSketch,
+    sketch_price_stats
+)
+from handler.report_cache import ReportCache
+from handler.utils import group_price_stats, percentile_key
+from handler.xml_writer import FeedWriter, element_depth, indent
 
 
 class XMLHandler:
@@ -29,16 +77,48 @@ class XMLHandler:
         self,
         feeds_folder: str = FEEDS_FOLDER,
         new_feeds_folder: str = PARSE_FEEDS_FOLDER,
-        feeds_list: list[str] = FEEDS
+        feeds_list: list[str] = FEEDS,
+        pretty: bool = FEED_OUTPUT_PRETTY,
+        compress: bool = FEED_OUTPUT_COMPRESS,
+        declaration: bool = FEED_OUTPUT_DECLARATION,
+        use_snapshots: bool = USE_FEED_SNAPSHOTS,
+        parser: str = FEED_PARSER
     ) -> None:
+        if parser not in FEED_PARSERS:
+            raise ValueError(f'Неизвестный парсер фидов: {parser}')
         self.feeds_folder = feeds_folder
         self.new_feeds_folder = new_feeds_folder
         self.feeds_list = feeds_list
+        self.use_snapshots = use_snapshots
+        self.parser = parser
+        self.writer_options = {
+            'pretty': pretty,
+            'compress': compress,
+            'declaration': declaration
+        }
 
     def _get_filenames_list(self):
         """Защищенный метод, возвращает список названий фидов."""
         return [feed.split('/')[-1] for feed in self.feeds_list]
 
+    def _get_changed_filenames(
+        self,
+        manifest: FeedManifest,
+        stage: str
+    ) -> list[str]:
+        """
+        Защищенный метод, возвращает названия фидов, изменившихся
+        с последнего запуска этапа stage.
+        """
+        file_names = []
+        for file_name in self._get_filenames_list():
+            if manifest.is_changed(file_name, stage):
+                file_names.append(file_name)
+            else:
+                logging.info(f'Фид {file_name} не изменился, этап {stage} '
+                             'пропущен')
+        return file_names
+
     def _make_dir(self):
         """Защищенный метод, создает директорию."""
         file_path = Path(__file__).parent.parent / self.new_feeds_folder
@@ -46,6 +126,15 @@ class XMLHandler:
         file_path.mkdir(parents=True, exist_ok=True)
         return file_path
 
+    def _get_output_path(self, file_name: str) -> Path:
+        """
+        Защищенный метод, возвращает путь к итоговому файлу
+        (с суффиксом .gz при сжатии).
+        """
+        if self.writer_options['compress']:
+            file_name = f'{file_name}.gz'
+        return self._make_dir() / file_name
+
     def _get_tree(self, file_name: str):
         """Защищенный метод, создает экземпляра класса ElementTree."""
         file_path = (
@@ -56,221 +145,839 @@ class XMLHandler:
 
     def _indent(self, elem, level=0) -> None:
         """Защищенный метод, расставляет правильные отступы в XML файлах."""
-        i = '\n' + level * '  '
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + '  '
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-            for child in elem:
-                self._indent(child, level + 1)
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
+        indent(elem, level)
 
     def _format_xml(self, elem, file_path) -> None:
-        """Защищенный метод, сохраняет отформатированные файлы."""
-        root = elem
-        self._indent(root)
-        formatted_xml = ET.tostring(root, encoding='unicode')
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(formatted_xml)
-
-    def _super_feed(self):
-        """Защищенный метод, создает шаблон фида с пустыми offers."""
-        file_names: list[str] = self._get_filenames_list()
-        first_file_tree = self._get_tree(file_names[0])
-        root = first_file_tree.getroot()
-        offers = root.find('.//offers')
-        if offers is not None:
-            offers.clear()
-        return root, offers
+        """
+        Защищенный метод, сохраняет отформатированные файлы.
 
-    def _collect_all_offers(self, file_names: list[str]) -> tuple[dict, dict]:
+        Дерево пишется потоково через FeedWriter с настройками
+        записи обработчика.
         """
-        Защищенный метод, подсчитывает встречался ли оффер в том или ином фиде.
+        with FeedWriter(file_path, **self.writer_options) as writer:
+            writer.write_document(elem)
+
+    def _join_feeds(
+        self,
+        how: str,
+        policy: str,
+        priority: list[str] | None
+    ) -> bool:
         """
-        offer_counts: dict = defaultdict(int)
-        all_offers = {}
-        for file_name in file_names:
-            tree = self._get_tree(file_name)
-            root = tree.getroot()
-            for offer in root.findall('.//offer'):
-                offer_id = offer.get('id')
-                if offer_id:
-                    offer_counts[offer_id] += 1
-                    all_offers[offer_id] = offer
-        return offer_counts, all_offers
+        Защищенный метод, потоково объединяет фиды через FeedJoiner
+        и записывает результат в {how}_join_feed.xml.
+        """
+        folder_path = Path(__file__).parent.parent / self.feeds_folder
+        joiner = FeedJoiner(
+            [folder_path / name for name in self._get_filenames_list()],
+            policy=policy,
+            priority=priority
+        )
+        output_path = self._get_output_path(f'{how}_join_feed.xml')
+        joiner.join(how, output_path, **self.writer_options)
+        logging.debug(f'Файл создан по адресу: {output_path}')
+        return True
 
     @time_of_function
-    def inner_join_feeds(self) -> bool:
+    def inner_join_feeds(
+        self,
+        policy: str = JOIN_CONFLICT_POLICY,
+        priority: list[str] | None = None
+    ) -> bool:
         """
         Метод, объединяющий все офферы в один фид
         по принципу inner join.
+
+        policy задает выбор оффера при повторяющихся id
+        (first, last, priority - по порядку фидов в priority).
         """
-        file_names: list[str] = self._get_filenames_list()
-        offer_counts, all_offers = self._collect_all_offers(file_names)
-        root, offers = self._super_feed()
-        for offer_id, count in offer_counts.items():
-            if count == len(file_names):
-                offers.append(all_offers[offer_id])
-        output_path = self._make_dir() / 'inner_join_feed.xml'
-        self._format_xml(root, output_path)
-        logging.debug(f'Файл создан по адресу: {output_path}')
-        return True
+        return self._join_feeds('inner', policy, priority)
 
     @time_of_function
-    def full_outer_join_feeds(self) -> bool:
+    def full_outer_join_feeds(
+        self,
+        policy: str = JOIN_CONFLICT_POLICY,
+        priority: list[str] | None = None
+    ) -> bool:
         """
         Метод, объединяющий все офферы в один фид
         по принципу full outer join.
         """
-        file_names: list[str] = self._get_filenames_list()
-        _, all_offers = self._collect_all_offers(file_names)
-        root, offers = self._super_feed()
-        for offer in all_offers.values():
-            offers.append(offer)
-        output_path = self._make_dir() / 'full_outer_join_feed.xml'
-        self._format_xml(root, output_path)
-        logging.debug(f'Файл создан по адресу: {output_path}')
-        return True
+        return self._join_feeds('full_outer', policy, priority)
+
+    @time_of_function
+    def left_join_feeds(
+        self,
+        policy: str = JOIN_CONFLICT_POLICY,
+        priority: list[str] | None = None
+    ) -> bool:
+        """
+        Метод, собирающий в один фид офферы первого фида,
+        дополненные данными остальных фидов по принципу left join.
+        """
+        return self._join_feeds('left', policy, priority)
+
+    @time_of_function
+    def anti_join_feeds(
+        self,
+        policy: str = JOIN_CONFLICT_POLICY,
+        priority: list[str] | None = None
+    ) -> bool:
+        """
+        Метод, собирающий в один фид офферы первого фида,
+        которых нет в остальных фидах (anti join).
+        """
+        return self._join_feeds('anti', policy, priority)
+
+    def _get_feed_path(self, file_name: str) -> Path:
+        """Защищенный метод, возвращает путь к файлу фида."""
+        return Path(__file__).parent.parent / self.feeds_folder / file_name
+
+    def _process_feed_shards(
+        self,
+        executor: ProcessPoolExecutor,
+        file_name: str,
+        rules: LabelRules,
+        flag: str,
+        shard_size: int
+    ) -> None:
+        """
+        Защищенный метод, обрабатывает большой фид частями в пуле
+        процессов и собирает результат в исходном порядке.
+
+        Секция <offers> делится на байтовые диапазоны примерно
+        по shard_size байт по границам офферов, каждый диапазон
+        разбирается и размечается в своем процессе с прологом фида
+        и открывающими тегами предков офферов (shard_context).
+        В текущем процессе разбирается только каркас фида (все, кроме
+        секции офферов). Фид без секции <offers> или с частью, которая
+        не разобралась отдельно, обрабатывается потоково целиком.
+        """
+        input_path = self._get_feed_path(file_name)
+        output_path = self._get_output_path(f'new_{file_name}')
+        with open(input_path, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            split = split_offers(data, shard_size)
+            if split is not None:
+                body_start, body_end, ranges = split
+                has_offers = data.find(b'<', body_start, body_end) != -1
+                try:
+                    head, tail, depth = shard_context(data, body_start)
+                except ExpatError:
+                    split = None
+                else:
+                    root = ET.fromstring(
+                        data[:body_start] + data[body_end:]
+                    )
+        offers = root.find('.//offers') if split is not None else None
+        if offers is not None:
+            for offer in root.iter('offer'):
+                label_offer(offer, rules, flag)
+            try:
+                with FeedWriter(output_path, **self.writer_options) as writer:
+                    if has_offers:
+                        level = element_depth(root, offers) + 1
+                        pretty = self.writer_options['pretty']
+                        parts = executor.map(label_shard, [
+                            (
+                                str(input_path), start, end, head, tail,
+                                depth, level, pretty
+                            )
+                            for start, end in ranges
+                        ])
+                        offers.text, text = next(parts)
+                        writer.begin(root, offers, level)
+                        writer.write_raw(text)
+                        for _, text in parts:
+                            writer.write_raw(text)
+                    writer.finish(root, offers)
+                logging.debug(f'Файл записан по адресу: {output_path}')
+                return
+            except ET.ParseError as e:
+                logging.warning(
+                    f'Часть фида {file_name} не разобрана отдельно ({e}), '
+                    'фид обрабатывается целиком'
+                )
+        stream_label_feed(
+            input_path, output_path, rules, flag, **self.writer_options
+        )
+        logging.debug(f'Файл записан по адресу: {output_path}')
+
+    def _process_feeds_parallel(
+        self,
+        file_names: list[str],
+        custom_label: dict[str, dict],
+        offers_id_list: list[str],
+        flag: str,
+        manifest: FeedManifest,
+        max_workers: int | None,
+        shard_size: int
+    ) -> None:
+        """
+        Защищенный метод, обрабатывает фиды в пуле процессов:
+        небольшие фиды - целиком по одному на процесс, фиды
+        больше PROCESS_SHARD_MIN_SIZE байт - частями.
+        """
+        rules = LabelRules(custom_label, offers_id_list)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(custom_label, offers_id_list, flag)
+        ) as executor:
+            futures = []
+            large_feeds = []
+            for file_name in file_names:
+                input_path = self._get_feed_path(file_name)
+                if input_path.stat().st_size >= PROCESS_SHARD_MIN_SIZE:
+                    large_feeds.append(file_name)
+                    continue
+                futures.append(executor.submit(label_feed, (
+                    str(input_path),
+                    str(self._get_output_path(f'new_{file_name}')),
+                    self.writer_options
+                )))
+            for file_name in large_feeds:
+                self._process_feed_shards(
+                    executor, file_name, rules, flag, shard_size
+                )
+                manifest.mark_processed(file_name, 'process_feeds')
+            for future in as_completed(futures):
+                file_name = future.result()
+                logging.debug(
+                    'Файл записан по адресу: '
+                    f'{self._get_output_path(f"new_{file_name}")}'
+                )
+                manifest.mark_processed(file_name, 'process_feeds')
+
+    def get_offer_index(self, file_name: str) -> FeedIndex:
+        """
+        Метод, возвращает индекс офферов фида (байтовые диапазоны
+        по id и списки офферов категорий), при необходимости
+        перестраивая его.
+        """
+        return FeedIndex.for_feed(self.feeds_folder, file_name)
+
+    def fetch_offers(
+        self,
+        file_name: str,
+        offer_ids: list[str]
+    ) -> dict[str, list[bytes]]:
+        """
+        Метод, читает исходные байты офферов фида по индексу,
+        не разбирая остальной документ.
+        """
+        return self.get_offer_index(file_name).fetch(offer_ids)
+
+    def get_offers(
+        self,
+        file_name: str,
+        offer_ids: list[str]
+    ) -> dict[str, list[ET.Element]]:
+        """Метод, читает и разбирает офферы фида по индексу."""
+        return self.get_offer_index(file_name).parse(offer_ids)
+
+    def get_category_offers(
+        self,
+        file_name: str,
+        category_id: str
+    ) -> dict[str, list[ET.Element]]:
+        """Метод, читает и разбирает офферы категории по индексу."""
+        index = self.get_offer_index(file_name)
+        return index.parse(index.category_offer_ids(category_id))
+
+    def patch_offers(self, file_name: str, offer_ids: list[str], patch) -> int:
+        """
+        Метод, изменяет отдельные офферы фида по индексу.
+
+        patch - функция, принимающая элемент оффера и изменяющая его,
+        например lambda offer: offer.set('available', 'false').
+        Хеш фида в манифесте обновляется, поэтому следующие этапы
+        увидят фид измененным. Возвращает число замененных офферов.
+        """
+        index = self.get_offer_index(file_name)
+        patched = index.patch(offer_ids, patch)
+        if patched:
+            manifest = FeedManifest(self.feeds_folder)
+            manifest.update(
+                file_name,
+                sha256=index.content_hash,
+                content_length=index.meta['size']
+            )
+            manifest.save()
+        return patched
+
+    @time_of_function
+    def build_snapshots(self, only_changed: bool = False) -> bool:
+        """
+        Метод, строит колоночные снимки фидов, чтобы следующие этапы
+        не разбирали XML повторно.
+
+        Действительные снимки не перестраиваются. При only_changed=True
+        обрабатываются только фиды, изменившиеся с прошлого запуска
+        этапа (по манифесту фидов).
+        """
+        manifest = FeedManifest(self.feeds_folder)
+        file_names = (
+            self._get_changed_filenames(manifest, 'snapshots')
+            if only_changed else self._get_filenames_list()
+        )
+        try:
+            for file_name in file_names:
+                FeedSnapshot.for_feed(
+                    self.feeds_folder, file_name, parser=self.parser
+                )
+                manifest.mark_processed(file_name, 'snapshots')
+            return True
+        except Exception as e:
+            logging.error(f'Ошибка при построении снимков фидов: {e}')
+            return False
+        finally:
+            manifest.save()
 
     @time_of_function
     def process_feeds(
         self,
         custom_label: dict[str, dict],
         offers_id_list: list[str],
-        flag: str = 'false'
+        flag: str = 'false',
+        only_changed: bool = False,
+        max_workers: int | None = PROCESS_FEEDS_WORKERS,
+        shard_size: int = PROCESS_SHARD_SIZE
     ) -> bool:
         """
         Метод, подставляющий в фиды данные
         из настраиваемого словаря CUSTOM_LABEL.
+
+        При only_changed=True обрабатываются только фиды,
+        изменившиеся с прошлого запуска (по манифесту фидов).
+        max_workers - число процессов (None - по числу ядер,
+        1 - последовательная обработка), shard_size - примерный
+        размер одной части большого фида в байтах. Результат
+        не зависит от режима.
         """
+        manifest = FeedManifest(self.feeds_folder)
+        file_names = (
+            self._get_changed_filenames(manifest, 'process_feeds')
+            if only_changed else self._get_filenames_list()
+        )
         try:
-            for file_name in self._get_filenames_list():
-                tree = self._get_tree(file_name)
-                root = tree.getroot()
-                for offer in root.findall('.//offer'):
-                    offer_name_text = offer.findtext('name')
-                    offer_url_text = offer.findtext('url')
-                    offer_id = offer.get('id')
-                    if None in (
-                        offer_name_text,
-                        offer_url_text,
-                        offer_id
-                    ):
-                        continue
-                    if offer_id in offers_id_list:
-                        offer.set('available', flag)
-                    existing_nums = set()
-                    for el in offer.findall('*'):
-                        if el.tag.startswith('custom_label_'):
-                            try:
-                                existing_nums.add(int(el.tag.split('_')[-1]))
-                            except ValueError:
-                                continue
-                    for label_name, conditions in custom_label.items():
-                        name_match = any(
-                            sub.lower() in offer_name_text.lower()
-                            for sub in conditions.get('name', [])
-                        )
-                        url_match = any(
-                            sub.lower() in offer_url_text.lower()
-                            for sub in conditions.get('url', [])
-                        )
-                        id_match = offer_id in conditions.get('id', [])
-                        if name_match or url_match or id_match:
-                            next_num = 0
-                            while next_num in existing_nums:
-                                next_num += 1
-                            existing_nums.add(next_num)
-                            ET.SubElement(
-                                offer, f'custom_label_{next_num}'
-                            ).text = label_name
-                output_path = self._make_dir() / f'new_{file_name}'
-                self._format_xml(root, output_path)
+            if max_workers != 1 and file_names:
+                self._process_feeds_parallel(
+                    file_names, custom_label, offers_id_list, flag,
+                    manifest, max_workers, shard_size
+                )
+                return True
+            rules = LabelRules(custom_label, offers_id_list)
+            for file_name in file_names:
+                output_path = self._get_output_path(f'new_{file_name}')
+                stream_label_feed(
+                    self._get_feed_path(file_name),
+                    output_path,
+                    rules,
+                    flag,
+                    **self.writer_options
+                )
                 logging.debug(f'Файл записан по адресу: {output_path}')
+                manifest.mark_processed(file_name, 'process_feeds')
             return True
         except Exception as e:
             logging.error(f'Произошла ошибка: {e}')
             return False
+        finally:
+            manifest.save()
 
-    def get_offers_report(self) -> list[dict]:
-        """Метод, формирующий отчет по офферам."""
-        result = []
-        date_str = (dt.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    def _iter_elements(self, file_name: str, tags: set[str]):
+        """
+        Защищенный метод, потоково перебирает элементы фида с тегами tags.
 
-        for file_name in self._get_filenames_list():
-            tree = self._get_tree(file_name)
-            root = tree.getroot()
-            category_data = {}
-            all_categories = {}
-
-            for category in root.findall('.//category'):
-                category_id = category.get('id')
-                parent_id = category.get('parentId')
-                all_categories[category_id] = parent_id
-                category_data[category_id] = {
-                    'prices': [],
-                    'offers_count': 0
+        Каждый элемент отдается после того, как прочитан целиком, затем
+        очищается и удаляется из родителя, поэтому расход памяти
+        не зависит от размера фида.
+        """
+        file_path = (
+            Path(__file__).parent.parent / self.feeds_folder / file_name
+        )
+        logging.debug(f'Путь к файлу: {file_path}')
+        parents = []
+        for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag in tags:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+    def _collect_report_data(
+        self,
+        file_name: str,
+        streaming: bool = False,
+        max_workers: int | None = FEED_PARSE_WORKERS
+    ) -> tuple[dict, dict]:
+        """
+        Защищенный метод, собирает категории и цены офферов фида.
+
+        Возвращает словарь {id категории: id родителя} и словарь
+        {id категории: список цен}. Если включены снимки фидов, данные
+        берутся из колоночного снимка, а устаревший снимок
+        перестраивается парсером self.parser; снимок всегда строится
+        потоково, поэтому streaming на него не влияет. Фиды
+        от PARALLEL_PARSE_MIN_SIZE байт при любом парсере разбираются
+        частями через etree в пуле из max_workers процессов.
+        Иначе фид читается парсером self.parser: etree строит дерево
+        (в streaming-режиме - через iterparse без полного дерева),
+        expat извлекает только нужные поля без создания элементов.
+        """
+        if self.use_snapshots:
+            snapshot = FeedSnapshot.for_feed(
+                self.feeds_folder,
+                file_name,
+                max_workers=max_workers,
+                parser=self.parser
+            )
+            if not snapshot.meta['invalid_prices']:
+                all_categories = snapshot.categories()
+                return all_categories, snapshot.category_prices(
+                    all_categories
+                )
+        elif (
+            max_workers != 1
+            and self._get_feed_path(file_name).stat().st_size
+            >= PARALLEL_PARSE_MIN_SIZE
+        ):
+            parsed = parse_feed_parallel(
+                self._get_feed_path(file_name),
+                FEED_PARSE_CHUNK_SIZE,
+                max_workers,
+                with_text=False
+            )
+            if parsed is not None and not parsed[2]:
+                skeleton, columns, _ = parsed
+                all_categories = {
+                    elem.get('id'): elem.get('parentId')
+                    for elem in skeleton.iter('category')
                 }
+                return all_categories, group_category_prices(
+                    columns['offer_category'],
+                    columns['price'],
+                    columns['has_price'],
+                    all_categories
+                )
+        all_categories = {}
+        offer_prices = defaultdict(list)
+        fields = ('categoryId', 'price')
+        if self.parser == 'expat':
+            records = expat_records(self._get_feed_path(file_name), fields)
+        elif streaming:
+            records = element_records(
+                self._iter_elements(file_name, {'category', 'offer'}), fields
+            )
+        else:
+            root = self._get_tree(file_name).getroot()
+            records = element_records(chain(
+                root.findall('.//category'), root.findall('.//offer')
+            ), fields)
+
+        for tag, element_id, *values in records:
+            if tag == 'category':
+                all_categories[element_id] = values[0]
+                continue
+            category_id, price = values
+            if category_id and price:
+                offer_prices[category_id].append(int(price))
+
+        category_data = {
+            category_id: offer_prices.pop(category_id, [])
+            for category_id in all_categories
+        }
+        category_data.update(offer_prices)
+        return all_categories, category_data
+
+    @staticmethod
+    def _report_config(
+        percentiles: tuple[float, ...],
+        stats_mode: str,
+        compression: int
+    ) -> dict:
+        """
+        Защищенный метод, возвращает настройки статистики,
+        от которых зависят строки отчета (версию для ключа кеша).
+        """
+        return {
+            'version': REPORT_CACHE_VERSION,
+            'percentiles': list(percentiles),
+            'rounding': DECIMAL_ROUNDING,
+            'outliers': [LOWER_OUTLIER_PERCENTILE, UPPER_OUTLIER_PERCENTILE],
+            'stats_mode': stats_mode,
+            'compression': compression if stats_mode == 'sketch' else None
+        }
+
+    def _report_cache_key(
+        self,
+        manifest: FeedManifest,
+        file_name: str,
+        date_str: str,
+        config: dict
+    ) -> str:
+        """
+        Защищенный метод, возвращает ключ кеша отчета для фида.
+
+        Ключ зависит от хеша содержимого, размера и времени изменения
+        файла на диске. Хеш берется из манифеста, если записанный
+        в нем размер совпадает с размером файла, иначе считается
+        по файлу: файл мог измениться в обход манифеста.
+        """
+        feed_path = self._get_feed_path(file_name)
+        feed_stat = feed_path.stat()
+        content_hash = manifest.content_hash(file_name)
+        if (
+            content_hash is None
+            or manifest.get(file_name).get('content_length')
+            != feed_stat.st_size
+        ):
+            content_hash = file_hash(feed_path)
+        return ReportCache.make_key(
+            file_name,
+            f'{content_hash}:{feed_stat.st_size}:{feed_stat.st_mtime_ns}',
+            date_str,
+            config
+        )
+
+    def _make_report_row(
+        self,
+        stats: dict,
+        index: int,
+        percentiles: tuple[float, ...] = (),
+        stats_mode: str = 'exact',
+        **fields
+    ) -> dict:
+        """
+        Защищенный метод, собирает строку отчета для категории
+        из результатов group_price_stats или sketch_price_stats.
+        Для каждого перцентиля из percentiles добавляется колонка
+        вида p90_price. Медиана нечетного числа цен - целая цена,
+        если это одна из цен (всегда в точном режиме и для несжатых
+        эскизов), иначе медиана эскиза округляется до DECIMAL_ROUNDING
+        знаков.
+        """
+        count_offers = int(stats['count'][index])
+        if not count_offers:
+            median_price = 0
+        elif count_offers % 2 and (
+            stats_mode == 'exact' or stats['median'][index].is_integer()
+        ):
+            median_price = int(stats['median'][index])
+        else:
+            median_price = stats['median'][index].item()
+        row = {
+            **fields,
+            'count_offers': count_offers,
+            'min_price': stats['min'][index].item(),
+            'clear_min_price': stats['clear_min'][index].item(),
+            'max_price': stats['max'][index].item(),
+            'clear_max_price': stats['clear_max'][index].item(),
+            'avg_price': round(
+                stats['mean'][index].item(), DECIMAL_ROUNDING
+            ) if count_offers else 0,
+            'median_price': round(median_price, DECIMAL_ROUNDING)
+        }
+        for quantile in percentiles:
+            key = percentile_key(quantile)
+            row[f'{key}_price'] = round(
+                stats[key][index].item(), DECIMAL_ROUNDING
+            ) if count_offers else 0
+        return row
+
+    @staticmethod
+    def _category_sketches(
+        all_categories: dict,
+        category_data: dict,
+        compression: int
+    ) -> dict:
+        """
+        Защищенный метод, возвращает эскизы цен категорий фида:
+        эскиз родительской категории объединяется из эскизов
+        подкатегорий.
+        """
+        return CategoryTree(all_categories).merge_up(
+            {
+                category_id: QuantileSketch.from_prices(prices, compression)
+                for category_id, prices in category_data.items()
+            },
+            lambda parts: QuantileSketch.merge(parts, compression)
+        )
 
-            for offer in root.findall('.//offer'):
-                category_id = offer.findtext('categoryId')
-                price = offer.findtext('price')
-                if category_id and price:
-                    if category_id not in category_data:
-                        category_data[category_id] = {
-                            'prices': [], 'offers_count': 0}
-                    category_data[category_id]['prices'].append(int(price))
-                    category_data[category_id]['offers_count'] += 1
-
-            def aggregate_data(category_id):
-                prices = category_data[category_id]['prices'].copy()
-                offers_count = category_data[category_id]['offers_count']
-
-                for child_id, parent_id in all_categories.items():
-                    if parent_id == category_id:
-                        child_prices, child_count = aggregate_data(child_id)
-                        prices.extend(child_prices)
-                        offers_count += child_count
-                category_data[category_id]['prices'] = prices
-                category_data[category_id]['offers_count'] = offers_count
-                return prices, offers_count
-
-            root_categories = [
-                cat_id for cat_id, parent_id in all_categories.items()
-                if parent_id is None
+    def _load_region_sketches(
+        self,
+        sketch_cache: ReportCache,
+        sketch_key: str,
+        file_name: str,
+        streaming: bool,
+        max_workers: int | None,
+        compression: int
+    ) -> list:
+        """
+        Защищенный метод, возвращает сохраненные эскизы категорий
+        фида для строк по всем регионам - список [category_id,
+        parent_id, эскиз в виде словаря]. Если их нет в кеше, эскизы
+        считаются по фиду и сохраняются.
+        """
+        entry = sketch_cache.get(sketch_key)
+        if entry is not None:
+            return entry
+        logging.info(f'Эскизов фида {file_name} нет в кеше, фид разбирается')
+        all_categories, category_data = self._collect_report_data(
+            file_name, streaming, max_workers
+        )
+        sketches = self._category_sketches(
+            all_categories, category_data, compression
+        )
+        entry = [
+            [
+                category_id,
+                all_categories.get(category_id),
+                sketches[category_id].to_dict()
             ]
-            for root_id in root_categories:
-                aggregate_data(root_id)
-
-            for category_id, data in category_data.items():
-                count_offers = data['offers_count']
-                price_list = data['prices']
-                parent_id = all_categories.get(category_id)
-
-                result.append({
-                    'date': date_str,
-                    'feed_name': file_name,
-                    'category_id': category_id,
-                    'parent_id': parent_id,
-                    'count_offers': count_offers,
-                    'min_price': min(price_list) if price_list else 0,
-                    'clear_min_price': clear_min(price_list)
-                    if price_list else 0,
-                    'max_price': max(price_list) if price_list else 0,
-                    'clear_max_price': clear_max(price_list)
-                    if price_list else 0,
-                    'avg_price': round(
-                        sum(price_list) / len(price_list), DECIMAL_ROUNDING
-                    ) if price_list else 0,
-                    'median_price': round(
-                        median(price_list), DECIMAL_ROUNDING
-                    ) if price_list else 0
-                })
+            for category_id in category_data
+        ]
+        sketch_cache.put(sketch_key, entry)
+        return entry
+
+    @staticmethod
+    def _add_region_sketches(
+        entry: list,
+        region_sketches: dict,
+        region_parents: dict
+    ) -> None:
+        """
+        Защищенный метод, добавляет сохраненные эскизы категорий
+        фида к эскизам по всем регионам.
+        """
+        for category_id, parent_id, sketch in entry:
+            region_sketches[category_id].append(
+                QuantileSketch.from_dict(sketch)
+            )
+            region_parents.setdefault(category_id, parent_id)
+
+    def get_offers_report(
+        self,
+        streaming: bool = False,
+        percentiles: tuple[float, ...] = EXTRA_PERCENTILES,
+        only_changed: bool = False,
+        max_workers: int | None = FEED_PARSE_WORKERS,
+        stats_mode: str = REPORT_STATS_MODE,
+        all_regions: bool = False,
+        compression: int = SKETCH_COMPRESSION,
+        use_cache: bool = USE_REPORT_CACHE
+    ) -> list[dict]:
+        """
+        Метод, формирующий отчет по офферам.
+
+        При streaming=True фиды без снимков читаются потоково:
+        в памяти хранятся только цены по категориям, а не дерево
+        документа (снимки фидов строятся потоково всегда).
+        Дополнительные перцентили из percentiles (доли от 0 до 1)
+        попадают в строки отчета с ключами вида p90_price.
+        При only_changed=True фиды, не изменившиеся с прошлого
+        запуска (по манифесту фидов), пропускаются. max_workers - число
+        процессов для разбора больших фидов частями.
+
+        stats_mode='sketch' считает медиану, квартили и перцентили
+        по эскизам QuantileSketch с параметром точности compression:
+        эскиз родительской категории объединяется из эскизов
+        подкатегорий, а не из списков цен. При all_regions=True
+        в этом режиме к отчету добавляются строки с feed_name
+        ALL_REGIONS_FEED_NAME, объединяющие эскизы категорий всех
+        фидов. Эскизы категорий каждого фида сохраняются в ReportCache
+        по его содержимому, поэтому фиды, пропущенные из-за
+        only_changed или взятые из кеша, попадают в эти строки
+        по сохраненным эскизам (а при их отсутствии - по разбору фида).
+
+        При use_cache=True строки фида берутся из ReportCache, если
+        для его содержимого, даты отчета и настроек статистики они
+        уже посчитаны, а новые результаты сохраняются в кеш.
+        """
+        if stats_mode not in STATS_MODES:
+            raise ValueError(f'Неизвестный режим статистики: {stats_mode}')
+        if all_regions and stats_mode != 'sketch':
+            raise ValueError(
+                'Строки по всем регионам строятся только в режиме sketch'
+            )
+        result = []
+        region_sketches = defaultdict(list)
+        region_parents = {}
+        date_str = (dt.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        manifest = FeedManifest(self.feeds_folder)
+        file_names = self._get_filenames_list()
+        changed_names = set(
+            self._get_changed_filenames(manifest, 'offers_report')
+            if only_changed else file_names
+        )
+        cache = ReportCache() if use_cache else None
+        sketch_cache = ReportCache() if all_regions else None
+        config = self._report_config(percentiles, stats_mode, compression)
+        sketch_config = {
+            'version': REPORT_CACHE_VERSION,
+            'sketch_compression': compression
+        }
+
+        for file_name in file_names:
+            sketch_key = None
+            if sketch_cache is not None:
+                sketch_key = self._report_cache_key(
+                    manifest, file_name, '', sketch_config
+                )
+            if file_name not in changed_names:
+                if sketch_cache is not None:
+                    self._add_region_sketches(
+                        self._load_region_sketches(
+                            sketch_cache, sketch_key, file_name,
+                            streaming, max_workers, compression
+                        ),
+                        region_sketches,
+                        region_parents
+                    )
+                continue
+            cache_key = None
+            if cache is not None:
+                cache_key = self._report_cache_key(
+                    manifest, file_name, date_str, config
+                )
+                cached_rows = cache.get(cache_key)
+                if cached_rows is not None:
+                    logging.info(f'Отчет по фиду {file_name} взят из кеша')
+                    result.extend(cached_rows)
+                    if sketch_cache is not None:
+                        self._add_region_sketches(
+                            self._load_region_sketches(
+                                sketch_cache, sketch_key, file_name,
+                                streaming, max_workers, compression
+                            ),
+                            region_sketches,
+                            region_parents
+                        )
+                    manifest.mark_processed(file_name, 'offers_report')
+                    continue
+            first_row = len(result)
+            all_categories, category_data = self._collect_report_data(
+                file_name, streaming, max_workers
+            )
+            if stats_mode == 'sketch':
+                sketches = self._category_sketches(
+                    all_categories, category_data, compression
+                )
+                category_ids = list(category_data)
+                stats = sketch_price_stats(
+                    [sketches[category_id] for category_id in category_ids],
+                    percentiles
+                )
+                for index, category_id in enumerate(category_ids):
+                    parent_id = all_categories.get(category_id)
+                    result.append(self._make_report_row(
+                        stats,
+                        index,
+                        percentiles,
+                        stats_mode,
+                        date=date_str,
+                        feed_name=file_name,
+                        category_id=category_id,
+                        parent_id=parent_id
+                    ))
+                    region_sketches[category_id].append(
+                        sketches[category_id]
+                    )
+                    region_parents.setdefault(category_id, parent_id)
+                if sketch_cache is not None:
+                    sketch_cache.put(sketch_key, [
+                        [
+                            category_id,
+                            all_categories.get(category_id),
+                            sketches[category_id].to_dict()
+                        ]
+                        for category_id in category_ids
+                    ])
+            else:
+                tree = CategoryTree(all_categories)
+                flat, spans = tree.rollup(category_data)
+                for category_ids, prices, codes in tree.iter_batches(
+                    flat, spans, list(category_data), STATS_BATCH_SIZE
+                ):
+                    stats = group_price_stats(
+                        prices, codes, len(category_ids), percentiles
+                    )
+                    for index, category_id in enumerate(category_ids):
+                        result.append(self._make_report_row(
+                            stats,
+                            index,
+                            percentiles,
+                            date=date_str,
+                            feed_name=file_name,
+                            category_id=category_id,
+                            parent_id=all_categories.get(category_id)
+                        ))
+            if cache_key is not None:
+                cache.put(cache_key, result[first_row:])
+            manifest.mark_processed(file_name, 'offers_report')
+        manifest.save()
+        if cache is not None or sketch_cache is not None:
+            ReportCache().evict()
+        if all_regions and region_sketches:
+            category_ids = list(region_sketches)
+            stats = sketch_price_stats(
+                [
+                    QuantileSketch.merge(
+                        region_sketches[category_id], compression
+                    )
+                    for category_id in category_ids
+                ],
+                percentiles
+            )
+            for index, category_id in enumerate(category_ids):
+                result.append(self._make_report_row(
+                    stats,
+                    index,
+                    percentiles,
+                    stats_mode,
+                    date=date_str,
+                    feed_name=ALL_REGIONS_FEED_NAME,
+                    category_id=category_id,
+                    parent_id=region_parents[category_id]
+                ))
+        return result
+
+    def replay_offers_report(
+        self,
+        percentiles: tuple[float, ...] = EXTRA_PERCENTILES,
+        stats_mode: str = REPORT_STATS_MODE,
+        compression: int = SKETCH_COMPRESSION
+    ) -> list[dict]:
+        """
+        Метод, возвращает отчет по офферам из кеша без разбора фидов,
+        например для повторной выгрузки в json или базу данных.
+
+        Используются записи для текущего содержимого фидов, даты
+        отчета и настроек статистики. Фиды без файла или записи в кеше
+        пропускаются с предупреждением.
+        """
+        result = []
+        date_str = (dt.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        manifest = FeedManifest(self.feeds_folder)
+        cache = ReportCache()
+        config = self._report_config(percentiles, stats_mode, compression)
+        for file_name in self._get_filenames_list():
+            try:
+                cached_rows = cache.get(self._report_cache_key(
+                    manifest, file_name, date_str, config
+                ))
+            except FileNotFoundError:
+                cached_rows = None
+            if cached_rows is None:
+                logging.warning(f'Отчета по фиду {file_name} нет в кеше')
+                continue
+            result.extend(cached_rows)
         return result
 
     def save_to_json(
@@ -1,15 +1,27 @@
 from io import BytesIO
 import logging
+import os
+import threading
 from pathlib import Path
 from PIL import Image
-import requests
 import xml.etree.ElementTree as ET
 
-from handler.constants import FEEDS_FOLDER, IMAGE_FOLDER, NEW_IMAGE_FOLDER
+from handler.constants import (
+    FEED_PARSER,
+    FEEDS_FOLDER,
+    IMAGE_DOWNLOAD_WORKERS,
+    IMAGE_FOLDER,
+    NEW_IMAGE_FOLDER,
+    USE_FEED_SNAPSHOTS
+)
+from handler.feed_manifest import FeedManifest
+from handler.feed_parsers import FEED_PARSERS, expat_records
+from handler.feed_snapshot import FeedSnapshot
+from handler.image_fetcher import ImageFetcher
+from handler.image_sync import ImageStore
+from handler.image_transform import ImageTransformer
 from handler.feeds import FEEDS
-from handler.logging_config import setup_logging
-
-setup_logging()
+from handler.file_utils import temp_path_for
 
 
 class XMLImage:
@@ -23,17 +35,43 @@ class XMLImage:
         feeds_folder: str = FEEDS_FOLDER,
         image_folder: str = IMAGE_FOLDER,
         new_image_folder: str = NEW_IMAGE_FOLDER,
-        feeds_list: list[str] = FEEDS
+        feeds_list: list[str] = FEEDS,
+        mirror: bool = True,
+        use_snapshots: bool = USE_FEED_SNAPSHOTS,
+        parser: str = FEED_PARSER
     ) -> None:
+        if parser not in FEED_PARSERS:
+            raise ValueError(f'Неизвестный парсер фидов: {parser}')
         self.feeds_folder = feeds_folder
         self.image_folder = image_folder
         self.new_image_folder = new_image_folder
         self.feeds_list = feeds_list
+        self.mirror = mirror
+        self.use_snapshots = use_snapshots
+        self.parser = parser
 
     def _get_filenames_list(self) -> list[str]:
         """Защищенный метод, возвращает список названий фидов."""
         return [feed.split('/')[-1] for feed in self.feeds_list]
 
+    def _get_changed_filenames(
+        self,
+        manifest: FeedManifest,
+        stage: str
+    ) -> list[str]:
+        """
+        Защищенный метод, возвращает названия фидов, изменившихся
+        с последнего запуска этапа stage.
+        """
+        file_names = []
+        for file_name in self._get_filenames_list():
+            if manifest.is_changed(file_name, stage):
+                file_names.append(file_name)
+            else:
+                logging.info(f'Фид {file_name} не изменился, этап {stage} '
+                             'пропущен')
+        return file_names
+
     def _get_tree(self, file_name: str):
         """Защищенный метод, создает экземпляра класса ElementTree."""
         file_path = (
@@ -49,47 +87,259 @@ class XMLImage:
         folder_path.mkdir(parents=True, exist_ok=True)
         return folder_path
 
-    def _get_image_filename(self, offer_id: str, url: str) -> str:
-        """Защищенный метод, создает имя файла с изображением."""
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content))
+    def _get_image_filename(self, offer_id: str, content: bytes) -> str:
+        """
+        Защищенный метод, создает имя файла с изображением.
+
+        Формат определяется по заголовку уже скачанных байтов.
+        """
+        with Image.open(BytesIO(content)) as image:
             image_format = image.format.lower() if image.format else None
-            return f'{offer_id}.{image_format}'
-        except Exception as e:
-            print(f'Ошибка при обработке изображения {url}: {e}')
-            logging.error(f'Ошибка при обработке изображения {url}: {e}')
-        return ''
-
-    def _save_image(self, url: str, folder_path: Path, image_filename: str):
-        """Защищенный метод, сохраняет изображение по указанному пути."""
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            with Image.open(BytesIO(response.content)) as img:
-                file_path = folder_path / image_filename
-                img.load()
-                img.save(file_path)
-        except requests.RequestException as e:
-            logging.error(f'Ошибка при загрузке {url}: {e}')
-        except Exception as e:
-            logging.error(f'Ошибка при обработке изображения {url}: {e}')
-
-    def get_images(self):
-        """Метод получения и сохранения изображений из xml-файла."""
-        for file_name in self._get_filenames_list():
-            tree = self._get_tree(file_name)
-            root = tree.getroot()
-            for offer in root.findall('.//offer'):
-                offer_id = offer.get('id')
-                offer_image = offer.findtext('picture')
+        return f'{offer_id}.{image_format}'
+
+    def _save_image(
+        self,
+        content: bytes,
+        folder_path: Path,
+        image_filename: str
+    ) -> None:
+        """
+        Защищенный метод, сохраняет изображение по указанному пути.
+
+        В режиме mirror исходные байты пишутся на диск как есть:
+        изображение уже проверено чтением заголовка в
+        _get_image_filename, полное декодирование не выполняется.
+        Без mirror изображение декодируется и кодируется заново.
+        """
+        file_path = folder_path / image_filename
+        if self.mirror:
+            temp_path = temp_path_for(file_path)
+            with open(temp_path, 'wb') as file:
+                file.write(content)
+            os.replace(temp_path, file_path)
+            return
+        with Image.open(BytesIO(content)) as img:
+            img.load()
+            img.save(file_path)
+
+    def _iter_offer_pictures(self, file_name: str):
+        """
+        Защищенный метод, перебирает пары (offer_id, ссылка на картинку)
+        фида: из колоночного снимка, если снимки включены, иначе
+        из XML парсером self.parser.
+        """
+        if self.use_snapshots:
+            snapshot = FeedSnapshot.for_feed(
+                self.feeds_folder, file_name, parser=self.parser
+            )
+            offer_ids = (
+                offer_id.decode() for offer_id in snapshot['offer_id'].tolist()
+            )
+            return zip(offer_ids, snapshot.iter_text('picture'))
+        if self.parser == 'expat':
+            file_path = (
+                Path(__file__).parent.parent / self.feeds_folder / file_name
+            )
+            return (
+                (offer_id, picture)
+                for tag, offer_id, picture in expat_records(
+                    file_path, ('picture',)
+                )
+                if tag == 'offer'
+            )
+        root = self._get_tree(file_name).getroot()
+        return (
+            (offer.get('id'), offer.findtext('picture'))
+            for offer in root.findall('.//offer')
+        )
+
+    def _iter_image_tasks(self, file_names: list[str]):
+        """
+        Защищенный метод, перебирает пары (offer_id, ссылка на картинку)
+        из фидов без повторов.
+        """
+        seen = set()
+        for file_name in file_names:
+            for offer_id, offer_image in self._iter_offer_pictures(
+                file_name
+            ):
                 if not offer_image:
                     logging.warning(f'Offer {offer_id} не имеет изображения')
                     continue
-                image_filename = self._get_image_filename(
-                    offer_id,
-                    offer_image
+                if (offer_id, offer_image) in seen:
+                    continue
+                seen.add((offer_id, offer_image))
+                yield offer_id, offer_image
+
+    def _group_image_tasks(self, file_names: list[str]) -> dict[str, list]:
+        """
+        Защищенный метод, группирует офферы фидов по ссылкам на картинки:
+        возвращает словарь {ссылка: список offer_id}.
+        """
+        offers_by_url = {}
+        for offer_id, url in self._iter_image_tasks(file_names):
+            offers_by_url.setdefault(url, []).append(offer_id)
+        return offers_by_url
+
+    def get_images(
+        self,
+        only_changed: bool = False,
+        max_workers: int = IMAGE_DOWNLOAD_WORKERS
+    ) -> dict:
+        """
+        Метод получения и сохранения изображений из xml-файла.
+
+        Каждая ссылка скачивается один раз, даже если картинка общая
+        у нескольких офферов (в том числе в разных фидах): файлы всех
+        этих офферов пишутся из одних и тех же байтов. Загрузка идет
+        параллельно в max_workers потоков через общий пул соединений.
+        Возвращает статистику загрузки по ссылкам
+        (см. ImageFetcher.run). При only_changed=True фиды,
+        не изменившиеся с прошлого запуска (по манифесту фидов),
+        пропускаются.
+        """
+        manifest = FeedManifest(self.feeds_folder)
+        file_names = (
+            self._get_changed_filenames(manifest, 'images')
+            if only_changed else self._get_filenames_list()
+        )
+        folder_path = self._make_dir(self.image_folder)
+
+        def handle_image(offer_ids, url, response):
+            image_filename = self._get_image_filename(
+                offer_ids[0], response.content
+            )
+            extension = image_filename[len(offer_ids[0]):]
+            for offer_id in offer_ids:
+                self._save_image(
+                    response.content, folder_path, f'{offer_id}{extension}'
                 )
-                folder_path = self._make_dir(self.image_folder)
-                self._save_image(offer_image, folder_path, image_filename)
+
+        stats = ImageFetcher(max_workers=max_workers).run(
+            (
+                (offer_ids, url)
+                for url, offer_ids in self._group_image_tasks(
+                    file_names
+                ).items()
+            ),
+            handle_image
+        )
+        for file_name in file_names:
+            manifest.mark_processed(file_name, 'images')
+        manifest.save()
+        return stats
+
+    def _get_image_format(self, content: bytes) -> str:
+        """Защищенный метод, определяет формат изображения по заголовку."""
+        with Image.open(BytesIO(content)) as image:
+            return image.format.lower() if image.format else 'bin'
+
+    def sync_images(
+        self,
+        revalidate: bool = False,
+        max_workers: int = IMAGE_DOWNLOAD_WORKERS
+    ) -> dict:
+        """
+        Метод инкрементальной синхронизации изображений из xml-файлов.
+
+        Каждая ссылка на картинку скачивается один раз за прогон и только
+        если ее нет в манифесте (при revalidate=True известные ссылки
+        перепроверяются условным запросом). Одинаковые изображения
+        хранятся один раз, для каждого оффера создается ссылка
+        <offer_id>.<ext>. Изображения офферов, пропавших из фидов,
+        удаляются. Возвращает статистику загрузки, дополненную числом
+        пропущенных ссылок, обновленных и удаленных файлов.
+        """
+        folder_path = self._make_dir(self.image_folder)
+        store = ImageStore(folder_path)
+        wanted = {}
+        for offer_id, url in self._iter_image_tasks(
+            self._get_filenames_list()
+        ):
+            wanted.setdefault(offer_id, url)
+        skipped = 0
+        results = []
+        lock = threading.Lock()
+
+        def iter_tasks():
+            nonlocal skipped
+            for url in dict.fromkeys(wanted.values()):
+                image = store.get_image(url)
+                if image is None:
+                    yield url, url
+                elif revalidate:
+                    headers = {}
+                    if image['etag']:
+                        headers['If-None-Match'] = image['etag']
+                    if image['last_modified']:
+                        headers['If-Modified-Since'] = image['last_modified']
+                    yield url, url, headers
+                else:
+                    skipped += 1
+
+        def handle_image(url, _, response):
+            if response.status_code == 304:
+                with lock:
+                    results.append((url, None))
+                return
+            sha256, file = store.put_object(
+                response.content, self._get_image_format(response.content)
+            )
+            with lock:
+                results.append((url, {
+                    'sha256': sha256,
+                    'file': file,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }))
+
+        try:
+            stats = ImageFetcher(max_workers=max_workers).run(
+                iter_tasks(), handle_image
+            )
+            for url, image in results:
+                if image is None:
+                    store.touch_image(url)
+                else:
+                    store.record_image(url, **image)
+            linked = 0
+            for offer_id, url in wanted.items():
+                image = store.get_image(url)
+                if image is not None and store.link(offer_id, image['file']):
+                    linked += 1
+            removed_links, removed_objects = store.collect_garbage(
+                set(wanted), set(wanted.values())
+            )
+        finally:
+            store.close()
+        stats.update({
+            'skipped': skipped,
+            'linked': linked,
+            'removed_links': removed_links,
+            'removed_objects': removed_objects
+        })
+        logging.info(
+            f'Синхронизация изображений: пропущено {skipped}, '
+            f'обновлено ссылок {linked}, удалено ссылок {removed_links}, '
+            f'объектов {removed_objects}'
+        )
+        return stats
+
+    def transform_images(
+        self,
+        transformer: ImageTransformer | None = None,
+        max_workers: int | None = None
+    ) -> dict:
+        """
+        Метод обработки изображений из image_folder в new_image_folder.
+
+        Операции (рамки, формат, качество, квадрат) задаются
+        ImageTransformer, по умолчанию - настройками IMAGE_TRANSFORM_*.
+        Работает в пуле процессов на всех ядрах (или max_workers).
+        """
+        transformer = transformer or ImageTransformer()
+        return transformer.run(
+            self._make_dir(self.image_folder),
+            self._make_dir(self.new_image_folder),
+            max_workers
+        )
@@ -1,16 +1,76 @@
+import hashlib
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 import requests
 import xml.etree.ElementTree as ET
 
-from handler.logging_config import setup_logging
 from handler.exceptions import EmptyXMLError, InvalidXMLError
-from handler.constants import FEEDS_FOLDER
+from handler.constants import (
+    DOWNLOAD_CHUNK_SIZE,
+    FEED_DOWNLOAD_WORKERS,
+    FEEDS_FOLDER
+)
+from handler.feed_manifest import FeedManifest
+from handler.session_pool import SessionPool
+from handler.file_utils import temp_path_for
 
 
-setup_logging()
+class XMLStreamValidator:
+    """
+    Класс, предоставляющий инкрементальную проверку xml-потока.
+
+    Куски данных передаются в XMLPullParser по мере получения,
+    разобранные элементы сразу удаляются из дерева, поэтому
+    расход памяти не зависит от размера фида. Синтаксическая ошибка
+    обнаруживается на том куске, в котором она встретилась.
+    """
+
+    def __init__(self) -> None:
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._parents: list = []
+        self._has_content = False
+        self._has_children = False
+
+    def _read_events(self) -> None:
+        """Защищенный метод, обрабатывает накопленные события парсера."""
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                if len(self._parents) == 1:
+                    self._has_children = True
+                self._parents.append(elem)
+                continue
+            self._parents.pop()
+            if len(self._parents) > 1:
+                elem.clear()
+                self._parents[-1].remove(elem)
+
+    def feed(self, chunk: bytes) -> None:
+        """Метод, проверяет очередной кусок xml-потока."""
+        if not self._has_content and chunk.strip():
+            self._has_content = True
+        try:
+            self._parser.feed(chunk)
+            self._read_events()
+        except ET.ParseError as e:
+            raise InvalidXMLError(
+                f'XML содержит синтаксические ошибки: {str(e)}')
+
+    def close(self) -> None:
+        """Метод, завершает проверку потока."""
+        if not self._has_content:
+            raise EmptyXMLError('XML пуст')
+        try:
+            self._parser.close()
+            self._read_events()
+        except ET.ParseError as e:
+            raise InvalidXMLError(
+                f'XML содержит синтаксические ошибки: {str(e)}')
+        if not self._has_children:
+            raise InvalidXMLError('XML содержит только корневой элемент')
 
 
 class XMLSaver:
@@ -23,7 +83,8 @@ class XMLSaver:
     def __init__(
         self,
         feeds_list: list[str],
-        feeds_folder: str = FEEDS_FOLDER
+        feeds_folder: str = FEEDS_FOLDER,
+        max_workers: int = FEED_DOWNLOAD_WORKERS
     ) -> None:
         if not feeds_list:
             logging.error('Не передан список фидов.')
@@ -31,29 +92,44 @@ class XMLSaver:
 
         self.feeds_list = feeds_list
         self.feeds_folder = feeds_folder
+        self.max_workers = max_workers
+        self.manifest = FeedManifest(feeds_folder)
+        self.session_pool = SessionPool(
+            pool_size=max_workers,
+            auth=(
+                os.getenv('XML_FEED_USERNAME'),
+                os.getenv('XML_FEED_PASSWORD')
+            )
+        )
+
+    def _get_file(self, feed: str, headers: dict | None = None):
+        """
+        Защищенный метод, получает фид по ссылке.
 
-    def _get_file(self, feed: str):
-        """Защищенный метод, получает фид по ссылке."""
+        Запрос идет через общий пул сессий: соединения с хостом
+        переиспользуются, а авторизация отправляется сразу,
+        если хост уже отвечал 401. Возвращает ответ 200 или 304
+        (на условный запрос с headers), иначе None.
+        """
         try:
-            response = requests.get(feed)
+            response = self.session_pool.get(
+                feed, headers=headers, stream=True
+            )
 
-            if response.status_code == requests.codes.ok:
+            if response.status_code in (
+                requests.codes.ok,
+                requests.codes.not_modified
+            ):
                 return response
+            response.close()
 
             if response.status_code == requests.codes.unauthorized:
-                username = os.getenv('XML_FEED_USERNAME')
-                password = os.getenv('XML_FEED_PASSWORD')
-                auth_response = requests.get(
-                    feed,
-                    auth=(username, password)
-                )
-
-                if auth_response.status_code == requests.codes.ok:
-                    return auth_response
-                else:
-                    logging.error(
-                        f'Ошибка авторизации: {auth_response.status_code}')
-                    return None
+                logging.error(
+                    f'Ошибка авторизации: {response.status_code}')
+            else:
+                logging.error(
+                    f'Ошибка при загрузке {feed}: {response.status_code}')
+            return None
         except requests.RequestException as e:
             logging.error(f'Ошибка при загрузке {feed}: {e}')
             return None
@@ -62,67 +138,153 @@ class XMLSaver:
         """Защищенный метод, формирующий имя xml-файлу."""
         return feed.split('/')[-1]
 
-    def _chek_syntax(self, str_feed):
+    def _save_feed(self, feed: str, folder_path: Path) -> dict:
         """
-        Защищенный валидирующий метод,
-        проверяющий синтаксис полученного фида.
+        Защищенный метод, скачивает, валидирует и сохраняет один фид.
+
+        Фид читается потоком: каждый кусок одновременно проверяется
+        инкрементальным парсером и пишется во временный файл, который
+        после успешной проверки атомарно переименовывается в итоговый.
+
+        Запрос отправляется с If-None-Match/If-Modified-Since из манифеста.
+        При ответе 304 или совпадении sha256 содержимого с записанным
+        файл не перезаписывается.
+
+        Возвращает статистику загрузки: имя файла, признаки сохранения,
+        изменения и ошибки загрузки, размер в байтах и время в секундах.
         """
+        start_time = time.monotonic()
+        file_name = self._get_filename(feed)
+        file_path = folder_path / file_name
+        stats = {
+            'feed': feed,
+            'file_name': file_name,
+            'saved': False,
+            'changed': False,
+            'failed': False,
+            'bytes': 0,
+            'seconds': 0.0
+        }
+        response = self._get_file(
+            feed, self.manifest.conditional_headers(file_name)
+        )
+
+        if response is None:
+            logging.warning(f'XML-файл {file_name} не получен.')
+            stats['failed'] = True
+            stats['seconds'] = round(time.monotonic() - start_time, 3)
+            return stats
+
+        if response.status_code == requests.codes.not_modified:
+            response.close()
+            self.manifest.update(file_name)
+            stats['seconds'] = round(time.monotonic() - start_time, 3)
+            logging.info(f'XML-файл {file_name} не изменился (304).')
+            return stats
+
+        logging.info(
+            'Автоматическое определение кодировки '
+            f'XML-фала {file_name}: {response.encoding}'
+        )
+        validator = XMLStreamValidator()
+        content_hash = hashlib.sha256()
+        temp_path = temp_path_for(file_path)
         try:
-            ET.fromstring(str_feed)
-            return True
-        except ET.ParseError:
-            return False
+            with response, open(temp_path, 'wb') as temp_file:
+                for chunk in response.iter_content(
+                    chunk_size=DOWNLOAD_CHUNK_SIZE
+                ):
+                    if not stats['bytes']:
+                        encoding = chunk.decode('latin-1').split(
+                            '>')[0].split('=')[-1].strip('?"\'')
+                        logging.info(
+                            f'Кодировка XML-файла {file_name}: {encoding}')
+                    validator.feed(chunk)
+                    content_hash.update(chunk)
+                    temp_file.write(chunk)
+                    stats['bytes'] += len(chunk)
+            validator.close()
+            sha256 = content_hash.hexdigest()
+            if (
+                sha256 == self.manifest.content_hash(file_name)
+                and file_path.is_file()
+            ):
+                os.remove(temp_path)
+                logging.info(
+                    f'Содержимое XML-файла {file_name} не изменилось.')
+            else:
+                os.replace(temp_path, file_path)
+                stats['saved'] = True
+                stats['changed'] = True
+            self.manifest.update(
+                file_name,
+                url=feed,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                content_length=stats['bytes'],
+                sha256=sha256
+            )
+        except (EmptyXMLError, InvalidXMLError):
+            os.remove(temp_path)
+            raise
+        except (IOError, requests.RequestException) as e:
+            os.remove(temp_path)
+            stats['bytes'] = 0
+            stats['failed'] = True
+            logging.error(f'Ошибка при записи файла {file_name}: {e}')
+        stats['seconds'] = round(time.monotonic() - start_time, 3)
+        logging.info(
+            f'XML-файл {file_name}: {stats["bytes"]} байт '
+            f'за {stats["seconds"]} сек.'
+        )
+        return stats
 
-    def _chek_empty(self, str_feed):
+    def save_feed(self, feed: str) -> dict:
         """
-        Защищенный валидирующий метод,
-        проверяющий наполненность фида.
+        Метод, скачивает и сохраняет один фид и сразу записывает
+        манифест, чтобы следующие этапы видели хеш нового содержимого.
+        Возвращает статистику загрузки (см. _save_feed).
         """
-        return not bool(str_feed.strip())
-
-    def _validate_xml(self, str_feed):
-        """Суммирующий валидирующий защищенный метод."""
-        if self._chek_empty(str_feed):
-            raise EmptyXMLError('XML пуст')
-        if not self._chek_syntax(str_feed):
-            raise InvalidXMLError('XML содержит синтаксические ошибки')
+        folder_path = Path(__file__).parent.parent / self.feeds_folder
+        folder_path.mkdir(parents=True, exist_ok=True)
         try:
-            root = ET.fromstring(str_feed)
-            if not list(root):
-                raise InvalidXMLError('XML содержит только корневой элемент')
-        except ET.ParseError as e:
-            raise ValueError(f'Ошибка при анализе XML: {str(e)}')
+            return self._save_feed(feed, folder_path)
+        finally:
+            self.manifest.save()
+
+    def save_xml(self) -> list[dict]:
+        """
+        Метод, сохраняющий фиды в xml-файлы в директорию temp_feeds.
 
-    def save_xml(self) -> None:
-        """Метод, сохраняющий фиды в xml-файлы в директорию temp_feeds."""
+        Фиды скачиваются параллельно пулом из max_workers потоков
+        (при max_workers=1 - последовательно). Возвращает список
+        статистик загрузки по каждому фиду.
+        """
         total_files: int = len(self.feeds_list)
-        saved_files = 0
         folder_path = Path(__file__).parent.parent / self.feeds_folder
         folder_path.mkdir(parents=True, exist_ok=True)
-        for feed in self.feeds_list:
-            file_name = self._get_filename(feed)
-            file_path = folder_path / file_name
-            response = self._get_file(feed)
-            encoding = response.text.split('>')[0].split('=')[-1].strip('?"\'')
-            logging.info(f'Кодировка XML-файла {file_name}: {encoding}')
-            logging.info(
-                'Автоматическое определение кодировки '
-                f'XML-фала {file_name}: {response.encoding}'
-            )
-
-            if response is None:
-                logging.warning(f'XML-файл {file_name} не получен.')
-                continue
-            self._validate_xml(response.text)
-
-            try:
-                with open(file_path, 'wb') as file:
-                    for chunk in response.iter_content(
-                        chunk_size=8192
-                    ):
-                        file.write(chunk)
-                saved_files += 1
-            except IOError as e:
-                logging.error(f'Ошибка при записи файла {file_name}: {e}')
+        start_time = time.monotonic()
+        try:
+            if self.max_workers > 1:
+                with ThreadPoolExecutor(
+                    max_workers=self.max_workers
+                ) as executor:
+                    results = list(executor.map(
+                        lambda feed: self._save_feed(feed, folder_path),
+                        self.feeds_list
+                    ))
+            else:
+                results = [
+                    self._save_feed(feed, folder_path)
+                    for feed in self.feeds_list
+                ]
+        finally:
+            self.session_pool.close()
+            self.manifest.save()
+        saved_files = sum(stats['saved'] for stats in results)
+        total_bytes = sum(stats['bytes'] for stats in results)
         logging.info(
-            f'Успешно записано {saved_files} файлов из {total_files}.')
+            f'Успешно записано {saved_files} файлов из {total_files} '
+            f'({total_bytes} байт за '
+            f'{round(time.monotonic() - start_time, 3)} сек.).')
+        return results
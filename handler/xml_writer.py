@@ -0,0 +1,164 @@
+import gzip
+import io
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from handler.constants import FEED_WRITE_BUFFER_SIZE
+from handler.file_utils import temp_path_for
+
+PLACEHOLDER_TAG = 'feed-writer-placeholder'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+def indent(elem, level: int = 0) -> None:
+    """Расставляет отступы в элементе и его потомках."""
+    i = '\n' + level * '  '
+    if len(elem):
+        if not elem.text or not elem.text.strip():
+            elem.text = i + '  '
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+        for child in elem:
+            indent(child, level + 1)
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+    else:
+        if level and (not elem.tail or not elem.tail.strip()):
+            elem.tail = i
+
+
+def element_depth(root, target) -> int:
+    """Возвращает глубину элемента target в дереве root."""
+    stack = [(root, 0)]
+    while stack:
+        elem, depth = stack.pop()
+        if elem is target:
+            return depth
+        stack.extend((child, depth + 1) for child in elem)
+    raise ValueError('Элемент не найден в дереве.')
+
+
+class FeedWriter:
+    """
+    Класс, предоставляющий потоковую запись фида в файл.
+
+    Шапка фида (все до первого оффера) пишется методом begin, офферы -
+    по одному методом write_offer, окончание документа - методом finish.
+    При pretty=True отступы расставляются на лету и совпадают
+    с отступами XMLHandler._indent для всего дерева. При compress=True
+    файл сжимается gzip, при declaration=True начинается
+    с XML-декларации. Запись идет через буфер во временный файл,
+    который при успешном выходе из контекста атомарно заменяет итоговый.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        pretty: bool = True,
+        compress: bool = False,
+        declaration: bool = False
+    ) -> None:
+        self.file_path = Path(file_path)
+        self.pretty = pretty
+        self.compress = compress
+        self.declaration = declaration
+        self.offers_count = 0
+        self._file = None
+        self._raw = None
+        self._level = None
+
+    def __enter__(self):
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._temp_path = temp_path_for(self.file_path)
+        self._raw = open(
+            self._temp_path, 'wb', buffering=FEED_WRITE_BUFFER_SIZE
+        )
+        stream = (
+            gzip.GzipFile(fileobj=self._raw, mode='wb', mtime=0)
+            if self.compress else self._raw
+        )
+        self._file = io.TextIOWrapper(stream, encoding='utf-8')
+        if self.declaration:
+            self._file.write(XML_DECLARATION)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._file.close()
+        self._raw.close()
+        if exc_type is None:
+            os.replace(self._temp_path, self.file_path)
+        else:
+            os.remove(self._temp_path)
+
+    @property
+    def started(self) -> bool:
+        """Признак того, что шапка фида уже записана."""
+        return self._level is not None
+
+    def _split(self, root, offers) -> tuple[str, str]:
+        """
+        Защищенный метод, сериализует каркас фида и делит его на часть
+        до офферов и часть после них. Дочерние элементы offers
+        на время сериализации отсоединяются.
+        """
+        children = list(offers)
+        del offers[:]
+        placeholder = ET.SubElement(offers, PLACEHOLDER_TAG)
+        try:
+            if self.pretty:
+                indent(root)
+            text = ET.tostring(root, encoding='unicode')
+        finally:
+            offers.remove(placeholder)
+            offers.extend(children)
+        head, tail = text.split(f'<{PLACEHOLDER_TAG} />', 1)
+        return head, tail[len(placeholder.tail or ''):]
+
+    def begin(self, root, offers, level: int | None = None) -> None:
+        """
+        Метод, записывает шапку фида.
+
+        level - глубина офферов в дереве (по умолчанию вычисляется).
+        """
+        if level is None:
+            level = element_depth(root, offers) + 1
+        head, _ = self._split(root, offers)
+        self._file.write(head)
+        self._level = level
+
+    def write_offer(self, offer) -> None:
+        """Метод, записывает очередной оффер."""
+        if self.pretty:
+            indent(offer, self._level)
+        self._file.write(ET.tostring(offer, encoding='unicode'))
+        self.offers_count += 1
+
+    def write_raw(self, text: str) -> None:
+        """Метод, записывает уже сериализованные офферы."""
+        self._file.write(text)
+
+    def finish(self, root, offers) -> None:
+        """
+        Метод, записывает окончание фида. Если шапка еще не записана,
+        записывает дерево целиком.
+        """
+        if not self.started:
+            if self.pretty:
+                indent(root)
+            self._file.write(ET.tostring(root, encoding='unicode'))
+            return
+        _, tail = self._split(root, offers)
+        self._file.write(tail)
+
+    def write_document(self, root) -> None:
+        """
+        Метод, записывает готовое дерево фида: каркас целиком,
+        офферы - по одному, не собирая весь документ в одну строку.
+        """
+        offers = root.find('.//offers')
+        if offers is not None and len(offers):
+            self.begin(root, offers)
+            for offer in offers:
+                self.write_offer(offer)
+        self.finish(root, offers)